@@ -0,0 +1,126 @@
+import numpy as np
+
+from thermal_capture import apply_lut, make_window_lut
+
+
+class AutoGainControl:
+    def __init__(self, low_percentile=1.0, high_percentile=99.0, subsample=4, bins=1024, drift=32,
+                 smoothing=0.8, equalize=False, bit_depth=16):
+        """
+        Automatic gain control that turns 16 bit frames into 8 bit frames through a lookup table.
+
+        The percentile bounds come from a histogram of every subsample-th pixel, are smoothed over time and the
+        65536 entry LUT is only rebuilt when they drift by more than drift raw counts, so most frames cost one
+        histogram of a few thousand pixels and one np.take.
+
+        Args:
+            low_percentile: Percentile mapped to 0
+            high_percentile: Percentile mapped to 255
+            subsample: Pixel step in both directions for the histogram
+            bins: Number of histogram bins over the sensor range
+            drift: Raw value change of a bound that triggers a LUT rebuild
+            smoothing: Weight of the previous bounds in the exponential moving average, 0 disables smoothing
+            equalize: Histogram equalization between the bounds instead of a linear stretch
+            bit_depth: Significant bits of the sensor
+        """
+        self.low_percentile = low_percentile
+        self.high_percentile = high_percentile
+        self.subsample = subsample
+        self.bins = bins
+        self.drift = drift
+        self.smoothing = smoothing
+        self.equalize = equalize
+        self.bit_depth = bit_depth
+        self._shift = max(0, bit_depth - int(np.log2(bins)))
+
+        self.low = None
+        self.high = None
+        self.lut = None
+        self._lut_bounds = None
+        self.lut_updates = 0
+
+    def _histogram(self, frame16):
+        sample = frame16[::self.subsample, ::self.subsample]
+        return np.bincount((sample >> self._shift).ravel(), minlength=self.bins)
+
+    def _bounds(self, cdf):
+        total = cdf[-1]
+        low_bin = np.searchsorted(cdf, total * self.low_percentile / 100)
+        high_bin = np.searchsorted(cdf, total * self.high_percentile / 100)
+        return float(low_bin << self._shift), float((high_bin + 1) << self._shift)
+
+    def _build_lut(self, hist):
+        low, high = int(self.low), int(self.high)
+        if not self.equalize:
+            return make_window_lut(low, high)
+        # Equalize the histogram between the bounds and expand it from bins to raw values
+        low_bin, high_bin = low >> self._shift, max((high >> self._shift), (low >> self._shift) + 1)
+        cdf = np.cumsum(hist[low_bin:high_bin]).astype(np.float32)
+        cdf = (cdf - cdf[0]) * (255.0 / max(cdf[-1] - cdf[0], 1))
+        lut = np.empty(65536, np.uint8)
+        lut[:low_bin << self._shift] = 0
+        step = 1 << self._shift
+        lut[low_bin << self._shift:high_bin << self._shift] = np.repeat(cdf.astype(np.uint8), step)
+        lut[high_bin << self._shift:] = 255
+        return lut
+
+    def update(self, frame16):
+        """Updates the bounds from a frame and rebuilds the LUT when they drifted, returns the LUT."""
+        hist = self._histogram(frame16)
+        low, high = self._bounds(np.cumsum(hist))
+        if self.low is None or not self.smoothing:
+            self.low, self.high = low, high
+        else:
+            self.low = self.smoothing * self.low + (1 - self.smoothing) * low
+            self.high = self.smoothing * self.high + (1 - self.smoothing) * high
+
+        if (self._lut_bounds is None or abs(self.low - self._lut_bounds[0]) > self.drift or
+                abs(self.high - self._lut_bounds[1]) > self.drift):
+            self.lut = self._build_lut(hist)
+            self._lut_bounds = (self.low, self.high)
+            self.lut_updates += 1
+        return self.lut
+
+    def __call__(self, frame16, out=None):
+        """Returns the frame as uint8, writing into out when given."""
+        return apply_lut(frame16, self.update(frame16), out=out)
+
+
+def float_normalize(frame16, low_percentile=1.0, high_percentile=99.0):
+    """Direct per-pixel float normalization, the reference the AGC is benchmarked against."""
+    low, high = np.percentile(frame16, (low_percentile, high_percentile))
+    frame = (frame16.astype(np.float32) - low) / max(high - low, 1) * 255
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=640, help="Frame width")
+    parser.add_argument("--height", type=int, default=512, help="Frame height")
+    parser.add_argument("--frames", type=int, default=200, help="Number of frames")
+    parser.add_argument("--dump", type=str, default=None, help="Raw 16 bit dump to use instead of synthetic frames")
+    args = parser.parse_args()
+
+    if args.dump:
+        from thermal_capture import RawFrameFile
+        frames = RawFrameFile(args.dump, args.width, args.height)
+    else:
+        # Slowly warming scene with sensor noise in the 14 bit range
+        rng = np.random.default_rng(0)
+        base = rng.normal(6000, 400, size=(args.height, args.width))
+        frames = [np.clip(base + i * 2 + rng.normal(0, 30, base.shape), 0, 16383).astype(np.uint16)
+                  for i in range(args.frames)]
+
+    out = np.empty((args.height, args.width), np.uint8)
+    for name, convert in (("float", float_normalize),
+                          ("agc", AutoGainControl(bit_depth=14)),
+                          ("agc-equalize", AutoGainControl(bit_depth=14, equalize=True))):
+        start = time.perf_counter()
+        for frame in frames:
+            result = convert(frame) if name == "float" else convert(frame, out=out)
+        elapsed = time.perf_counter() - start
+        updates = getattr(convert, "lut_updates", len(frames))
+        print(f"{name:>13}: {elapsed / len(frames) * 1000:.2f} ms/frame, {updates} LUT updates")
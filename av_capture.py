@@ -0,0 +1,175 @@
+import queue
+import sys
+import threading
+import time
+
+import av
+
+from frame_source import FrameSource
+
+# Most preferred first: raw 16 bit, raw 8 bit, raw YUV, then compressed formats that need decoding
+PIXEL_FORMATS = ('gray16le', 'gray', 'yuyv422', 'nv12', 'mjpeg')
+
+AVError = getattr(av, 'FFmpegError', None) or getattr(av, 'AVError')
+
+
+def default_device():
+    """Returns (device, container format) of the first camera on this platform."""
+    if sys.platform.startswith('linux'):
+        return '/dev/video0', 'v4l2'
+    if sys.platform == 'darwin':
+        return '0', 'avfoundation'
+    return 'video=UVC Camera', 'dshow'
+
+
+def _format_options(fmt, pixel_format):
+    if fmt == 'dshow':
+        return {'vcodec': 'mjpeg'} if pixel_format == 'mjpeg' else {'pixel_format': pixel_format}
+    if fmt == 'v4l2':
+        return {'input_format': pixel_format}
+    return {'pixel_format': pixel_format}
+
+
+def _stream_format(stream):
+    """Pixel format the stream delivers, the codec name for compressed streams."""
+    codec = stream.codec_context
+    if codec.name not in ('rawvideo', ''):
+        return codec.name
+    return codec.pix_fmt
+
+
+def open_camera(device=None, fmt=None, pixel_formats=PIXEL_FORMATS, video_size=None, framerate=None):
+    """
+    Opens a camera with the first pixel format of pixel_formats the device accepts.
+
+    Args:
+        device: Device name, platform default when None
+        fmt: Container format ('v4l2', 'dshow', 'avfoundation'), platform default when None
+        pixel_formats: Formats to try, most preferred first
+        video_size: Optional 'WIDTHxHEIGHT'
+        framerate: Optional frame rate
+
+    Returns:
+        tuple: (container, pixel format name)
+    """
+    default, default_fmt = default_device()
+    device = device or default
+    fmt = fmt or default_fmt
+    extra = {}
+    if video_size:
+        extra['video_size'] = video_size
+    if framerate:
+        extra['framerate'] = str(framerate)
+
+    for pixel_format in pixel_formats:
+        try:
+            container = av.open(device, format=fmt, options={**_format_options(fmt, pixel_format), **extra})
+        except AVError:
+            continue
+        # Drivers may silently fall back to another format, only accept what was asked for
+        got = _stream_format(container.streams.video[0])
+        if got == pixel_format or (pixel_format == 'mjpeg' and got in ('mjpeg', 'jpeg')):
+            return container, pixel_format
+        container.close()
+    # Let the device choose
+    container = av.open(device, format=fmt, options=extra)
+    return container, _stream_format(container.streams.video[0])
+
+
+def _converter(pixel_format):
+    """Picks the ndarray conversion once for the negotiated format."""
+    if pixel_format in ('gray16le', 'gray16be', 'gray'):
+        return lambda frame: frame.to_ndarray()
+    return lambda frame: frame.to_ndarray(format='bgr24')
+
+
+class AVCaptureSource(FrameSource):
+    def __init__(self, device=None, fmt=None, pixel_formats=PIXEL_FORMATS, video_size=None, framerate=None,
+                 queue_size=2):
+        """
+        Camera frames decoded by PyAV on a worker thread.
+
+        Gray formats are delivered as uint8/uint16 arrays, everything else as BGR. When the consumer falls
+        behind the oldest queued frame is dropped so capture never stalls.
+
+        Args:
+            device: Device name, platform default when None
+            fmt: Container format, platform default when None
+            pixel_formats: Pixel formats to try, most preferred first
+            video_size: Optional 'WIDTHxHEIGHT'
+            framerate: Optional frame rate
+            queue_size: Decoded frames buffered between the worker and read()
+        """
+        self.container, self.pixel_format = open_camera(device, fmt, pixel_formats, video_size, framerate)
+        stream = self.container.streams.video[0]
+        # Frame threading for compressed formats, harmless for raw video
+        stream.thread_type = 'AUTO'
+        self._stream = stream
+        self._convert = _converter(self.pixel_format)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopped = False
+        self.frames = 0
+        self.dropped = 0
+        self._decode_time = 0.0
+        self._convert_time = 0.0
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._decode_thread, daemon=True)
+        self._thread.start()
+
+    def _put_latest(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _decode_thread(self):
+        try:
+            # Demuxing waits for the device, only decoding and converting are timed
+            packets = self.container.demux(self._stream)
+            while not self._stopped:
+                packet = next(packets, None)
+                if packet is None:
+                    break
+                start = time.perf_counter()
+                frames = packet.decode()
+                self._decode_time += time.perf_counter() - start
+                for frame in frames:
+                    start = time.perf_counter()
+                    image = self._convert(frame)
+                    self._convert_time += time.perf_counter() - start
+                    self.frames += 1
+                    self._put_latest((image, time.time()))
+        finally:
+            self._put_latest((None, None))
+
+    def read(self):
+        if self._stopped:
+            return False, None, None
+        image, timestamp = self._queue.get()
+        if image is None:
+            self._stopped = True
+            return False, None, None
+        return True, image, timestamp
+
+    def metrics(self):
+        """Returns decoded frame rate, mean decode and conversion time per frame and dropped frames."""
+        elapsed = time.perf_counter() - self._start
+        return {
+            'pixel_format': self.pixel_format,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'decode_ms': self._decode_time / self.frames * 1000 if self.frames else 0.0,
+            'convert_ms': self._convert_time / self.frames * 1000 if self.frames else 0.0,
+            'dropped': self.dropped,
+        }
+
+    def release(self):
+        self._stopped = True
+        self._thread.join(timeout=1)
+        self.container.close()
@@ -0,0 +1,180 @@
+import time
+
+import numpy as np
+
+from yolov7.utils import nms
+
+EMPTY = (np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int))
+
+
+def expand_box(box, margin, min_size, width, height):
+    """Grows an xyxy box by margin of its size on every side to a square of at least min_size, inside the image."""
+    x1, y1, x2, y2 = box
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * margin)
+    side = min(max(side, min_size), width, height)
+    left = int(np.clip(cx - side / 2, 0, width - side))
+    top = int(np.clip(cy - side / 2, 0, height - side))
+    return left, top, left + int(side), top + int(side)
+
+
+class CascadeDetector:
+    def __init__(self, screener, confirmer, screen_classes=None, screen_thres=0.3, confirm_thres=0.5,
+                 mode='frame', margin=0.5, min_crop=96, max_crops=4, hold_frames=0):
+        """
+        Runs a cheap screener on every frame and the full model only when the screener fires.
+
+        Both stages are YOLOv7-style detectors, callables returning (boxes, scores, class_ids) in frame
+        coordinates: YOLOv7, the OpenCV YOLOv7, or the moose model after onnx_tools.fuse_nms.
+
+        Args:
+            screener: Fast, low resolution detector
+            confirmer: Full detector whose detections are returned
+            screen_classes: Screener class ids that trigger the confirmer, any class when None
+            screen_thres: Screener score threshold
+            confirm_thres: Confirmer score threshold
+            mode: 'frame' runs the confirmer on the whole frame, 'crops' on square crops around the candidates,
+                which the confirmer upscales to its input size
+            margin: Crop context around a candidate, as a fraction of the candidate size on every side
+            min_crop: Minimum crop side in pixels
+            max_crops: Maximum crops per frame, the best scoring candidates are kept
+            hold_frames: Frames the confirmer keeps running after a confirmation, so a screener miss on a
+                present animal does not drop it
+        """
+        if mode not in ('frame', 'crops'):
+            raise ValueError(f"Unknown cascade mode {mode}")
+        self.screener = screener
+        self.confirmer = confirmer
+        self.screen_classes = None if screen_classes is None else set(screen_classes)
+        self.screener.conf_threshold = screen_thres
+        self.confirmer.conf_threshold = confirm_thres
+        self.mode = mode
+        self.margin = margin
+        self.min_crop = min_crop
+        self.max_crops = max_crops
+        self.hold_frames = hold_frames
+        self._hold = 0
+
+        self.frames = 0
+        self.screened = 0
+        self.confirmer_runs = 0
+        self.confirmed = 0
+        self._screen_time = 0.0
+        self._confirm_time = 0.0
+        self.boxes, self.scores, self.class_ids = EMPTY
+
+    def __call__(self, image):
+        return self.detect_objects(image)
+
+    def _candidates(self, boxes, scores, class_ids):
+        if len(scores) == 0:
+            return EMPTY[0], EMPTY[1]
+        boxes, scores, class_ids = np.asarray(boxes), np.asarray(scores), np.asarray(class_ids)
+        if self.screen_classes is not None:
+            keep = np.isin(class_ids, list(self.screen_classes))
+            boxes, scores = boxes[keep], scores[keep]
+        return boxes, scores
+
+    def _confirm_crops(self, image, candidates, scores):
+        height, width = image.shape[:2]
+        all_boxes, all_scores, all_class_ids = [], [], []
+        for i in np.argsort(scores)[::-1][:self.max_crops]:
+            x1, y1, x2, y2 = expand_box(candidates[i], self.margin, self.min_crop, width, height)
+            boxes, scores_, class_ids = self.confirmer(image[y1:y2, x1:x2])
+            if len(scores_):
+                all_boxes.append(np.asarray(boxes, np.float32) + np.array([x1, y1, x1, y1], np.float32))
+                all_scores.append(np.asarray(scores_))
+                all_class_ids.append(np.asarray(class_ids))
+        if not all_boxes:
+            return EMPTY
+        boxes, scores, class_ids = (np.concatenate(all_boxes), np.concatenate(all_scores),
+                                    np.concatenate(all_class_ids))
+        # Overlapping crops see the same animal twice
+        keep = nms(boxes, scores, self.confirmer.iou_threshold)
+        return boxes[keep], scores[keep], class_ids[keep]
+
+    def detect_objects(self, image):
+        self.frames += 1
+        start = time.perf_counter()
+        candidates, candidate_scores = self._candidates(*self.screener(image))
+        self._screen_time += time.perf_counter() - start
+
+        fired = len(candidate_scores) > 0
+        if fired:
+            self.screened += 1
+        if not fired and self._hold == 0:
+            self.boxes, self.scores, self.class_ids = EMPTY
+            return self.boxes, self.scores, self.class_ids
+
+        start = time.perf_counter()
+        self.confirmer_runs += 1
+        if self.mode == 'crops' and fired:
+            result = self._confirm_crops(image, candidates, candidate_scores)
+        else:
+            # Held frames without candidates have nothing to crop around
+            result = self.confirmer(image)
+        self._confirm_time += time.perf_counter() - start
+
+        if len(result[1]):
+            self.boxes, self.scores, self.class_ids = (np.asarray(result[0], np.float32), np.asarray(result[1]),
+                                                       np.asarray(result[2]))
+        else:
+            self.boxes, self.scores, self.class_ids = EMPTY
+        if len(self.scores):
+            self.confirmed += 1
+            self._hold = self.hold_frames
+        elif self._hold:
+            self._hold -= 1
+        return self.boxes, self.scores, self.class_ids
+
+    def draw_detections(self, image, mask_alpha=0.4):
+        return self.confirmer.renderer.draw(image, self.boxes, self.scores, self.class_ids, mask_alpha=mask_alpha)
+
+    def metrics(self):
+        """Returns how often each stage runs and what it costs."""
+        elapsed = self._screen_time + self._confirm_time
+        return {
+            'frames': self.frames,
+            'screener_fired': self.screened / self.frames if self.frames else 0.0,
+            'confirmer_rate': self.confirmer_runs / self.frames if self.frames else 0.0,
+            'confirmed': self.confirmed,
+            'screen_ms': self._screen_time / self.frames * 1000 if self.frames else 0.0,
+            'confirm_ms': self._confirm_time / self.confirmer_runs * 1000 if self.confirmer_runs else 0.0,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from frame_source import open_source
+    from yolov7 import YOLOv7
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Camera index, video or recording")
+    parser.add_argument("--screener", default="models/yolov7-tiny_480x640.onnx", help="Fast screening model")
+    parser.add_argument("--confirmer", default="models/moose_20240125_mAP50-0.992_nms.onnx",
+                        help="Full model, with NMS fused by onnx_tools")
+    parser.add_argument("--classes", default="dataset.yaml", help="Class names of the confirmer")
+    # COCO cow, elephant and bear look enough like a moose for the screener
+    parser.add_argument("--screen-classes", default="19,20,21", help="Screener class ids that trigger")
+    parser.add_argument("--screen-thres", type=float, default=0.3, help="Screener score threshold")
+    parser.add_argument("--confirm-thres", type=float, default=0.5, help="Confirmer score threshold")
+    parser.add_argument("--mode", choices=["frame", "crops"], default="frame", help="Confirm on frames or crops")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to process")
+    args = parser.parse_args()
+
+    cascade = CascadeDetector(YOLOv7(args.screener), YOLOv7(args.confirmer, classes=args.classes),
+                              [int(c) for c in args.screen_classes.split(",")], args.screen_thres,
+                              args.confirm_thres, args.mode)
+    # Reference: the confirmer alone on the same frames
+    confirmer_time = 0.0
+    with open_source(args.source) as source:
+        for _, (frame, _) in zip(range(args.frames), source):
+            cascade(frame)
+            start = time.perf_counter()
+            cascade.confirmer(frame)
+            confirmer_time += time.perf_counter() - start
+    metrics = cascade.metrics()
+    print(metrics)
+    print(f"Confirmer alone: {metrics['frames'] / confirmer_time:.1f} fps, cascade: {metrics['fps']:.1f} fps")
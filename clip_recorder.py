@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class ClipRecorder:
+    def __init__(self, directory, pre_roll=5.0, post_roll=5.0, fps=10.0, quality=80, max_bytes=64 << 20,
+                 queue_size=256, fourcc='mp4v', extension='.mp4'):
+        """
+        Keeps recent frames JPEG-compressed in memory and writes them to a video file when triggered.
+
+        push() and trigger() never block: frames go into a ring bounded by pre_roll seconds and max_bytes, and
+        while a clip is being recorded also to the writer thread, at most queue_size of them. When the writer
+        cannot keep up (slow SD card) frames are dropped from the clip instead of stalling capture. The start and
+        end markers of a clip are never dropped, there are two per clip, so they do not count towards queue_size.
+
+        The JPEG encoding runs in push(), on the capture thread, a few milliseconds for a 640x480 frame: the ring
+        holds the compressed frames, encoding on the writer would mean copying every raw frame to it first.
+
+        Args:
+            directory: Directory clips are written to
+            pre_roll: Seconds kept before a trigger
+            post_roll: Seconds recorded after the last trigger
+            fps: Frame rate written to the clip files
+            quality: JPEG quality of buffered frames
+            max_bytes: Maximum bytes of the pre-roll ring
+            queue_size: Maximum frames waiting for the writer
+            fourcc: Codec of the clip files
+            extension: File extension of the clip files
+        """
+        self.directory = directory
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.fps = fps
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.fourcc = fourcc
+        self.extension = extension
+        os.makedirs(directory, exist_ok=True)
+
+        self._ring = deque()
+        self._ring_bytes = 0
+        self._recording_until = None
+        self.queue_size = queue_size
+        # Unbounded so markers always get through, frames are limited in _send
+        self._queue = queue.Queue()
+        self.dropped = 0
+        self.clips = []
+
+        self._thread = threading.Thread(target=self._writer_thread, daemon=True)
+        self._thread.start()
+
+    @property
+    def recording(self):
+        return self._recording_until is not None
+
+    def _send(self, item):
+        if self._queue.qsize() >= self.queue_size:
+            self.dropped += 1
+        else:
+            self._queue.put_nowait(item)
+
+    def push(self, frame, timestamp=None):
+        """Adds a captured frame."""
+        timestamp = time.time() if timestamp is None else timestamp
+        ret, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ret:
+            return
+        data = data.tobytes()
+
+        self._ring.append((timestamp, data))
+        self._ring_bytes += len(data)
+        while self._ring and (self._ring[0][0] < timestamp - self.pre_roll or self._ring_bytes > self.max_bytes):
+            self._ring_bytes -= len(self._ring.popleft()[1])
+
+        if self._recording_until is not None:
+            if timestamp <= self._recording_until:
+                self._send(('frame', data))
+            else:
+                self._recording_until = None
+                # The end marker must get through, it closes the file
+                self._queue.put_nowait(('end', None))
+
+    def trigger(self, timestamp=None, label='event'):
+        """
+        Starts a clip with the pre-roll, or extends the running clip by post_roll seconds.
+
+        Returns:
+            str: Path of the clip being written.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self._recording_until is None:
+            name = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)) + f'-{label}{self.extension}'
+            path = os.path.join(self.directory, name)
+            self.clips.append(path)
+            self._queue.put_nowait(('start', path))
+            for _, data in list(self._ring):
+                self._send(('frame', data))
+        self._recording_until = timestamp + self.post_roll
+        return self.clips[-1]
+
+    def _writer_thread(self):
+        writer = None
+        path = None
+        while True:
+            kind, value = self._queue.get()
+            if kind == 'stop':
+                break
+            if kind == 'start':
+                path = value
+            elif kind == 'frame' and path is not None:
+                frame = cv2.imdecode(np.frombuffer(value, np.uint8), cv2.IMREAD_COLOR)
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+                writer.write(frame)
+            elif kind == 'end':
+                if writer is not None:
+                    writer.release()
+                writer = None
+                path = None
+        if writer is not None:
+            writer.release()
+
+    def memory_bytes(self):
+        """Returns the bytes held by the pre-roll ring."""
+        return self._ring_bytes
+
+    def close(self):
+        """Finishes the running clip and stops the writer."""
+        if self._recording_until is not None:
+            self._recording_until = None
+            self._queue.put(('end', None))
+        self._queue.put(('stop', None))
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300, help="Number of synthetic 640x480 frames at 30 fps")
+    parser.add_argument("--dir", default=None, help="Clip directory, a temporary one when not given")
+    args = parser.parse_args()
+
+    recorder = ClipRecorder(args.dir or tempfile.mkdtemp(), pre_roll=3, post_roll=3, fps=30)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (480, 640, 3), np.uint8)
+    now = time.time()
+    max_push = 0.0
+    peak = 0
+    for i in range(args.frames):
+        frame = np.roll(background, i, axis=1)
+        timestamp = now + i / 30
+        start = time.perf_counter()
+        recorder.push(frame, timestamp)
+        if i == args.frames // 2:
+            recorder.trigger(timestamp, "test")
+        max_push = max(max_push, time.perf_counter() - start)
+        peak = max(peak, recorder.memory_bytes())
+    recorder.close()
+    print(f"Max push {max_push * 1000:.1f} ms, peak ring {peak / 1e6:.1f} MB, dropped {recorder.dropped}")
+    for path in recorder.clips:
+        print(path, os.path.getsize(path), "bytes")
@@ -2,70 +2,88 @@ import argparse
 import cv2.dnn
 import numpy as np
 from pathlib import Path
-import re
-import yaml
-
-def yaml_load(file="data.yaml", append_filename=False):
-    """
-    Load YAML data from a file.
-
-    Args:
-        file (str, optional): File name. Default is 'data.yaml'.
-        append_filename (bool): Add the YAML filename to the YAML dictionary. Default is False.
-
-    Returns:
-        dict: YAML data and file name.
-    """
-    assert Path(file).suffix in {".yaml", ".yml"}, f"Attempting to load non-YAML file {file} with yaml_load()"
-    with open(file, errors="ignore", encoding="utf-8") as f:
-        s = f.read()  # string
-
-        # Remove special characters
-        if not s.isprintable():
-            s = re.sub(
-                r"[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010ffff]+", "", s
-            )
-
-        # Add YAML filename to dict and return
-        data = yaml.safe_load(s) or {}  # always return a dict
-        if append_filename:
-            data["yaml_file"] = str(file)
-        return data
+
+from image_io import ImageLoader, list_images, prefetch, save_jpeg
+from model_meta import load_meta
+from profiling import DnnProfiler
+from startup import timer, warm_up_dnn
+from yolov7.utils import DetectionRenderer
 
 class ObjectDetector:
-    def __init__(self, model_path, class_file_path):
+    def __init__(self, model_path, class_file_path, loader=None, warmup=1, profile=False, low_memory=False):
         """
         Initializes the ObjectDetector with the given model and class file paths.
 
         Args:
             model_path (str): Path to the ONNX model file.
-            class_file_path (str): Path to the YAML file containing class names.
+            class_file_path (str): Path to the YAML file with class names, used when the model metadata has none.
+            loader (ImageLoader, optional): Image loader, decodes JPEGs reduced to the model input by default.
+            warmup (int, optional): Number of warm-up inferences run before the first image.
+            profile (bool, optional): Collect per-layer timings of every inference, see profile_report().
+            low_memory (bool, optional): Keep no frames between calls: no decode cache, no padded full size copy,
+                and boxes are drawn on the image passed to detect(). A read-only image, like the memory-mapped
+                frames of frame_source.ReplaySource, is copied and the annotated copy left in self.original_image.
         """
-        # Load the ONNX model
+        # Class names and input size from the model metadata, falling back to the YAML file
+        self.meta = load_meta(model_path, class_file_path, default_input_shape=(640, 640))
+        self.CLASSES = self.meta.names
+        self.colors = self.meta.colors
+        # Images are padded to a square, so the model input is square too
+        self.input_size = self.meta.input_shape[1]
+        # Models with preprocessing in the graph take uint8 BGR frames, see onnx_tools.add_preprocessing
+        self.raw_input = self.meta.preprocess == 'bgr_uint8_nhwc'
+
+        # Load the ONNX model and run the slow first inferences before the first image
         self.model = cv2.dnn.readNetFromONNX(model_path)
-
-        # Load class names from YAML file
-        self.CLASSES = yaml_load(class_file_path)["names"]
-        np.random.seed(42)
-        self.colors = np.random.uniform(0, 255, size=(len(self.CLASSES), 3))
-
-    def load_image(self, image_path):
+        self.profiler = DnnProfiler(self.model, model_path) if profile else None
+        timer.mark_once("model loaded")
+        if self.raw_input:
+            warm_up_dnn(self.model, (1, self.input_size, self.input_size, 3), warmup, np.uint8)
+        else:
+            warm_up_dnn(self.model, (1, 3, self.input_size, self.input_size), warmup)
+        timer.mark_once("warm-up")
+
+        self.renderer = DetectionRenderer(self.CLASSES, self.colors, mask_alpha=0, font_scale=0.5)
+        self.low_memory = low_memory
+        self.loader = loader or ImageLoader((self.input_size, self.input_size), letterbox=True,
+                                            cache_size=0 if low_memory else 32)
+        self.image = None
+        self.original_image = None
+        # Model input sized letterbox of low memory mode
+        self._input = None
+
+    def load_image(self, image_path, reduction=1):
         """
         Loads an image from the given path and prepares it for inference.
 
+        Large JPEGs are decoded at a reduced size, self.reduction is the factor that maps coordinates of
+        self.original_image back to the full resolution file.
+
         Args:
-            image_path (str): Path to the input image.
+            image_path (str or numpy.ndarray): Path to the input image, or an already decoded image.
+            reduction (int, optional): Decode reduction of an already decoded image, as ImageLoader.load returns it.
         """
-        self.original_image = cv2.imread(image_path)
-        height, width, _ = self.original_image.shape
-
-        # Prepare a square image by padding if necessary
+        if isinstance(image_path, np.ndarray):
+            source, self.reduction = image_path, reduction
+        else:
+            source, self.reduction = self.loader.load(image_path)
+        height, width, _ = source.shape
         length = max(height, width)
-        self.image = np.zeros((length, length, 3), np.uint8)
-        self.image[0:height, 0:width] = self.original_image
+        if self.low_memory:
+            # Padded at model input size in preprocess(), boxes are drawn on the source itself
+            self.original_image = source
+            self.scale = length / self.input_size
+            return
+
+        # Prepare a square image by padding if necessary, reusing the buffer for images of the same size
+        if self.image is None or self.image.shape[0] != length or self.original_image.shape[:2] != (height, width):
+            self.image = np.zeros((length, length, 3), np.uint8)
+        self.image[0:height, 0:width] = source
+        # Boxes are drawn on the unpadded part, the loaded image itself may be a shared cache entry
+        self.original_image = self.image[0:height, 0:width]
 
         # Calculate scale factor
-        self.scale = length / 640
+        self.scale = length / self.input_size
 
     def preprocess(self):
         """
@@ -74,15 +92,43 @@ class ObjectDetector:
         Returns:
             numpy.ndarray: The preprocessed blob.
         """
+        if self.low_memory:
+            image = self.letterbox()
+            if self.raw_input:
+                return image[np.newaxis]
+        elif self.raw_input:
+            return cv2.resize(self.image, (self.input_size, self.input_size))[np.newaxis]
+        else:
+            image = self.image
+
         # Prepare blob for model input
         blob = cv2.dnn.blobFromImage(
-            self.image,
+            image,
             scalefactor=1 / 255,
-            size=(640, 640),
+            size=(self.input_size, self.input_size),
             swapRB=True,
         )
         return blob
 
+    def letterbox(self):
+        """
+        Resizes self.original_image into a reused model input sized buffer, padded at the bottom or right.
+
+        Same as padding the full frame to a square and resizing that, without the full size square.
+
+        Returns:
+            numpy.ndarray: (input_size, input_size, 3) uint8 image.
+        """
+        height, width = self.original_image.shape[:2]
+        size = (min(round(width / self.scale), self.input_size), min(round(height / self.scale), self.input_size))
+        if self._input is None:
+            self._input = np.zeros((self.input_size, self.input_size, 3), np.uint8)
+        elif self._size != size:
+            self._input.fill(0)
+        self._size = size
+        self._input[:size[1], :size[0]] = cv2.resize(self.original_image, size)
+        return self._input
+
     def inference(self, blob):
         """
         Performs inference on the preprocessed blob.
@@ -95,8 +141,19 @@ class ObjectDetector:
         """
         self.model.setInput(blob)
         outputs = self.model.forward()
+        if self.profiler is not None:
+            self.profiler.add()
         return outputs
 
+    def profile_report(self):
+        """
+        Per-layer timings of the inferences so far, for a detector created with profile=True.
+
+        Returns:
+            profiling.ProfileReport: Ranked layers and totals by op type.
+        """
+        return self.profiler.report()
+
     def postprocess(self, outputs):
         """
         Processes the model outputs, applies NMS, and prepares detections.
@@ -107,6 +164,9 @@ class ObjectDetector:
         Returns:
             list: List of dictionaries containing detection information.
         """
+        if self.meta.postprocess == 'nms':
+            return self.postprocess_fused(outputs)
+
         # Prepare output array
         outputs = np.array([cv2.transpose(outputs[0])])
         rows = outputs.shape[1]
@@ -146,11 +206,34 @@ class ObjectDetector:
                     "class_name": self.CLASSES[class_ids[i]],
                     "confidence": scores[i],
                     "box": box,
-                    "scale": self.scale,
+                    "scale": self.scale * self.reduction,
                 }
                 detections.append(detection)
         return detections
 
+    def postprocess_fused(self, outputs):
+        """
+        Prepares detections from a model with NMS in the graph (see onnx_tools.fuse_nms).
+
+        Args:
+            outputs (numpy.ndarray): (K, 7) rows of [batch, x1, y1, x2, y2, class, score].
+
+        Returns:
+            list: List of dictionaries containing detection information.
+        """
+        detections = []
+        for _, x1, y1, x2, y2, class_id, score in outputs.reshape(-1, 7):
+            if score >= 0.25:
+                class_id = int(class_id)
+                detections.append({
+                    "class_id": class_id,
+                    "class_name": self.CLASSES[class_id],
+                    "confidence": float(score),
+                    "box": [x1, y1, x2 - x1, y2 - y1],
+                    "scale": self.scale * self.reduction,
+                })
+        return detections
+
     def draw_boxes(self, detections):
         """
         Draws bounding boxes and labels on the original image based on the detections.
@@ -158,43 +241,65 @@ class ObjectDetector:
         Args:
             detections (list): List of detection dictionaries.
         """
-        for detection in detections:
-            class_id = detection["class_id"]
-            confidence = detection["confidence"]
-            x = round(detection["box"][0] * detection["scale"])
-            y = round(detection["box"][1] * detection["scale"])
-            x_plus_w = round((detection["box"][0] + detection["box"][2]) * detection["scale"])
-            y_plus_h = round((detection["box"][1] + detection["box"][3]) * detection["scale"])
-            label = f"{self.CLASSES[class_id]} ({confidence:.2f})"
-            color = self.colors[class_id]
-            cv2.rectangle(self.original_image, (x, y), (x_plus_w, y_plus_h), color, 2)
-            cv2.putText(
-                self.original_image,
-                label,
-                (x - 10, y - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                color,
-                2,
-            )
-
-    def detect(self, image_path):
+        # The detections are scaled to the file, self.original_image may be decoded at a reduced size
+        boxes = [
+            [
+                round(detection["box"][0] * detection["scale"] / self.reduction),
+                round(detection["box"][1] * detection["scale"] / self.reduction),
+                round((detection["box"][0] + detection["box"][2]) * detection["scale"] / self.reduction),
+                round((detection["box"][1] + detection["box"][3]) * detection["scale"] / self.reduction),
+            ]
+            for detection in detections
+        ]
+        scores = [detection["confidence"] for detection in detections]
+        class_ids = [detection["class_id"] for detection in detections]
+        if not self.original_image.flags.writeable:
+            self.original_image = self.original_image.copy()
+        self.renderer.draw(self.original_image, boxes, scores, class_ids, out=self.original_image)
+
+    def detect(self, image_path, reduction=1):
         """
         Full detection pipeline on the input image.
 
         Args:
-            image_path (str): Path to the input image.
+            image_path (str or numpy.ndarray): Path to the input image, or an already decoded image.
+            reduction (int, optional): Decode reduction of an already decoded image, as ImageLoader.load returns it.
 
         Returns:
-            list: List of detection dictionaries.
+            list: List of detection dictionaries, box times scale is in pixels of the full resolution image.
         """
-        self.load_image(image_path)
+        self.load_image(image_path, reduction)
+        loaded = self.original_image
         blob = self.preprocess()
         outputs = self.inference(blob)
         detections = self.postprocess(outputs)
         self.draw_boxes(detections)
+        # A copy made for a read-only image is kept, it is the only annotated one
+        if self.low_memory and self.original_image is loaded:
+            self.original_image = None
         return detections
 
+    def __call__(self, image):
+        """
+        Detects objects in a decoded image without drawing, in the form YOLOv7 returns, so roi.ROIDetector
+        and cascade.CascadeDetector can wrap this detector.
+
+        Args:
+            image (numpy.ndarray): BGR image.
+
+        Returns:
+            tuple: (boxes, scores, class_ids) with xyxy boxes in image pixels.
+        """
+        self.load_image(image)
+        detections = self.postprocess(self.inference(self.preprocess()))
+        if self.low_memory:
+            self.original_image = None
+        boxes = np.array([[x, y, x + w, y + h] for x, y, w, h in (d["box"] for d in detections)],
+                         np.float32).reshape(-1, 4) * self.scale
+        scores = np.array([d["confidence"] for d in detections], np.float32)
+        class_ids = np.array([d["class_id"] for d in detections], int)
+        return boxes, scores, class_ids
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -202,19 +307,49 @@ if __name__ == "__main__":
         default="models/moose_20240125_mAP50-0.992.onnx",
         help="Path to your ONNX model.",
     )
-    parser.add_argument("--img", default="moose-1.jpg", help="Path to input image.")
+    parser.add_argument("--img", default="moose-1.jpg", help="Path to input image or a directory of images.")
     parser.add_argument(
         "--classes", default="dataset.yaml", help="Path to class names YAML file."
     )
+    parser.add_argument("--save-dir", default=None, help="Directory to write annotated images to.")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of annotated images.")
+    parser.add_argument("--profile", action="store_true", help="Print per-layer timings at the end.")
+    parser.add_argument("--low-memory", action="store_true", help="Keep no frames and no decode cache.")
     args = parser.parse_args()
 
     from tqdm import tqdm
 
     # Initialize the detector once to avoid reloading model and classes in each iteration
-    detector = ObjectDetector(args.model, args.classes)
-    for i in tqdm(range(1000)):
+    detector = ObjectDetector(args.model, args.classes, profile=args.profile, low_memory=args.low_memory)
+    startup_reported = False
+    if Path(args.img).is_dir():
+        # Decode the next images on a thread pool while the current one is detected
+        for path, image, reduction in tqdm(prefetch(list_images(args.img), detector.loader)):
+            detections = detector.detect(image, reduction)
+            if not startup_reported:
+                timer.mark("first detection")
+                print(timer.report())
+                startup_reported = True
+            if args.save_dir:
+                # In low memory mode the boxes are drawn on the loaded image itself
+                annotated = image if args.low_memory else detector.original_image
+                save_jpeg(Path(args.save_dir) / Path(path).name, annotated, args.quality)
+    else:
         detections = detector.detect(args.img)
+        timer.mark("first detection")
+        print(timer.report())
+        for i in tqdm(range(999)):
+            detections = detector.detect(args.img)
+        if args.save_dir:
+            if args.low_memory:
+                annotated, reduction = detector.loader.load(args.img)
+                detector.detect(annotated, reduction)
+            else:
+                annotated = detector.original_image
+            save_jpeg(Path(args.save_dir) / Path(args.img).name, annotated, args.quality)
         # Optionally, display or save the result image
         # cv2.imshow("Detections", detector.original_image)
         # cv2.waitKey(0)
-        # cv2.destroyAllWindows()
\ No newline at end of file
+        # cv2.destroyAllWindows()
+    if args.profile:
+        print(detector.profile_report().format())
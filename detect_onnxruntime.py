@@ -2,56 +2,18 @@ import argparse
 
 import cv2
 import numpy as np
-import onnxruntime as ort
 
-from pathlib import Path
-import re
-import yaml
-
-from tqdm import tqdm
-
-
-def load_yaml(file="data.yaml", append_filename=False):
-    """
-    Load YAML data from a file.
-
-    Args:
-        file (str, optional): File name. Defaults to 'data.yaml'.
-        append_filename (bool, optional): If True, adds the YAML filename to the returned dictionary under the key 'yaml_file'. Defaults to False.
-
-    Returns:
-        dict: Parsed YAML data, possibly including the filename.
-    """
-    # Validate the file extension
-    if Path(file).suffix.lower() not in {".yaml", ".yml"}:
-        raise ValueError(f"Attempting to load non-YAML file '{file}' with load_yaml()")
-
-    # Read the file content
-    with open(file, "r", encoding="utf-8", errors="ignore") as f:
-        content = f.read()
-
-    # Remove non-printable and special characters
-    content = re.sub(
-        r"[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD"
-        r"\U00010000-\U0010FFFF]+",
-        "",
-        content,
-    )
-
-    # Parse the YAML content
-    data = yaml.safe_load(content) or {}  # Ensure a dictionary is returned
-
-    # Optionally append the filename
-    if append_filename:
-        data["yaml_file"] = str(file)
-
-    return data
+from image_io import ImageLoader
+from model_meta import load_meta
+from startup import create_session, timer, warm_up
+from yolov7.utils import DetectionRenderer
 
 
 class YOLOv8:
     """YOLOv8 object detection model class for handling inference and visualization."""
 
-    def __init__(self, onnx_model, input_image, confidence_thres, iou_thres):
+    def __init__(self, onnx_model, input_image, confidence_thres, iou_thres, classes="dataset.yaml", warmup=1,
+                 manager=None, priority=1.0):
         """
         Initializes an instance of the YOLOv8 class.
 
@@ -60,17 +22,47 @@ class YOLOv8:
             input_image: Path to the input image.
             confidence_thres: Confidence threshold for filtering detections.
             iou_thres: IoU (Intersection over Union) threshold for non-maximum suppression.
+            classes: Path to the class names YAML file, used when the model metadata has no class names.
+            warmup: Number of warm-up inferences run before the first image.
+            manager: sessions.SessionManager to create the session with, when other models run in the process.
+            priority: Share of the inference time relative to the other sessions of the manager.
         """
         self.onnx_model = onnx_model
         self.input_image = input_image
         self.confidence_thres = confidence_thres
         self.iou_thres = iou_thres
 
-        # Load the class names from the COCO dataset
-        self.classes = load_yaml("dataset.yaml")["names"]
+        # Load the class names from the model metadata or the dataset YAML, with the shared color table
+        meta = load_meta(self.onnx_model, classes)
+        self.classes = meta.names
+        self.color_palette = meta.colors
+        # Models fused by onnx_tools.fuse_nms output final (K, 7) detections
+        self.fused_nms = meta.postprocess == 'nms'
+        self.renderer = DetectionRenderer(self.classes, self.color_palette, mask_alpha=0, font_scale=0.5)
 
-        # Generate a color palette for the classes
-        self.color_palette = np.random.uniform(0, 255, size=(len(self.classes), 3))
+        # Decodes JPEGs reduced to the model input size once it is known, repeated runs hit the decode cache
+        self.loader = ImageLoader()
+
+        # Create the inference session once, the optimized graph is cached on disk for the next start
+        if manager is not None:
+            self.session = manager.create(self.onnx_model, priority)
+        else:
+            self.session = create_session(self.onnx_model)
+        timer.mark_once("model loaded")
+
+        # Store the shape of the input for later use
+        self.model_inputs = self.session.get_inputs()
+        input_shape = self.model_inputs[0].shape
+        # Models with preprocessing in the graph take (1, H, W, 3) uint8 BGR frames
+        self.raw_input = self.model_inputs[0].type == "tensor(uint8)"
+        if self.raw_input:
+            self.input_height, self.input_width = input_shape[1:3]
+        else:
+            self.input_width = input_shape[2]
+            self.input_height = input_shape[3]
+
+        warm_up(self.session, warmup)
+        timer.mark_once("warm-up")
 
     def draw_detections(self, img, box, score, class_id):
         """
@@ -85,32 +77,8 @@ class YOLOv8:
         Returns:
             None
         """
-        # Extract the coordinates of the bounding box
         x1, y1, w, h = box
-
-        # Retrieve the color for the class ID
-        color = self.color_palette[class_id]
-
-        # Draw the bounding box on the image
-        cv2.rectangle(img, (int(x1), int(y1)), (int(x1 + w), int(y1 + h)), color, 2)
-
-        # Create the label text with class name and score
-        label = f"{self.classes[class_id]}: {score:.2f}"
-
-        # Calculate the dimensions of the label text
-        (label_width, label_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-
-        # Calculate the position of the label text
-        label_x = x1
-        label_y = y1 - 10 if y1 - 10 > label_height else y1 + 10
-
-        # Draw a filled rectangle as the background for the label text
-        cv2.rectangle(
-            img, (label_x, label_y - label_height), (label_x + label_width, label_y + label_height), color, cv2.FILLED
-        )
-
-        # Draw the label text on the image
-        cv2.putText(img, label, (label_x, label_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+        self.renderer.draw(img, [(x1, y1, x1 + w, y1 + h)], [score], [class_id], out=img)
 
     def preprocess(self):
         """
@@ -119,12 +87,17 @@ class YOLOv8:
         Returns:
             image_data: Preprocessed image data ready for inference.
         """
-        # Read the input image using OpenCV
-        self.img = cv2.imread(self.input_image)
+        # Read the input image, copied because detections are drawn on it and the decoded image is cached
+        self.loader.target = (self.input_width, self.input_height)
+        self.img = self.loader.load(self.input_image)[0].copy()
 
         # Get the height and width of the input image
         self.img_height, self.img_width = self.img.shape[:2]
 
+        if self.raw_input:
+            # The model converts, scales and transposes itself
+            return cv2.resize(self.img, (self.input_width, self.input_height))[np.newaxis]
+
         # Convert the image color space from BGR to RGB
         img = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)
 
@@ -154,6 +127,9 @@ class YOLOv8:
         Returns:
             numpy.ndarray: The input image with detections drawn on it.
         """
+        if self.fused_nms:
+            return self.postprocess_fused(input_image, output[0])
+
         # Transpose and squeeze the output to match the expected shape
         outputs = np.transpose(np.squeeze(output[0]))
 
@@ -199,19 +175,35 @@ class YOLOv8:
         # Apply non-maximum suppression to filter out overlapping bounding boxes
         indices = cv2.dnn.NMSBoxes(boxes, scores, self.confidence_thres, self.iou_thres)
 
-        # Iterate over the selected indices after non-maximum suppression
-        for i in indices:
-            # Get the box, score, and class ID corresponding to the index
-            box = boxes[i]
-            score = scores[i]
-            class_id = class_ids[i]
-
-            # Draw the detection on the input image
-            self.draw_detections(input_image, box, score, class_id)
+        # Draw the detections selected by non-maximum suppression in one pass
+        self.renderer.draw(
+            input_image,
+            [(boxes[i][0], boxes[i][1], boxes[i][0] + boxes[i][2], boxes[i][1] + boxes[i][3]) for i in indices],
+            [scores[i] for i in indices],
+            [class_ids[i] for i in indices],
+            out=input_image,
+        )
 
         # Return the modified input image
         return input_image
 
+    def postprocess_fused(self, input_image, detections):
+        """
+        Draws the detections of a model with NMS in the graph.
+
+        Args:
+            input_image (numpy.ndarray): The input image.
+            detections (numpy.ndarray): (K, 7) rows of [batch, x1, y1, x2, y2, class, score] in model input pixels.
+
+        Returns:
+            numpy.ndarray: The input image with detections drawn on it.
+        """
+        detections = detections[detections[:, 6] >= self.confidence_thres]
+        factors = np.array([self.img_width / self.input_width, self.img_height / self.input_height] * 2, np.float32)
+        self.renderer.draw(input_image, detections[:, 1:5] * factors, detections[:, 6],
+                           detections[:, 5].astype(int), out=input_image)
+        return input_image
+
     def main(self):
         """
         Performs inference using an ONNX model and returns the output image with drawn detections.
@@ -219,22 +211,11 @@ class YOLOv8:
         Returns:
             output_img: The output image with drawn detections.
         """
-        # Create an inference session using the ONNX model and specify execution providers
-        session = ort.InferenceSession(self.onnx_model, providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
-
-        # Get the model inputs
-        model_inputs = session.get_inputs()
-
-        # Store the shape of the input for later use
-        input_shape = model_inputs[0].shape
-        self.input_width = input_shape[2]
-        self.input_height = input_shape[3]
-
         # Preprocess the image data
         img_data = self.preprocess()
 
         # Run inference using the preprocessed image data
-        outputs = session.run(None, {model_inputs[0].name: img_data})
+        outputs = self.session.run(None, {self.model_inputs[0].name: img_data})
 
         # Perform post-processing on the outputs to obtain output image.
         return self.postprocess(self.img, outputs)  # output image
@@ -245,18 +226,24 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, default="models/moose_20240125_mAP50-0.992.onnx", help="Input your ONNX model.")
     parser.add_argument("--img", type=str, default="moose-1.jpg", help="Path to input image.")
+    parser.add_argument("--classes", type=str, default="dataset.yaml", help="Path to class names YAML file.")
     parser.add_argument("--conf-thres", type=float, default=0.5, help="Confidence threshold")
     parser.add_argument("--iou-thres", type=float, default=0.5, help="NMS IoU threshold")
     args = parser.parse_args()
 
+    from tqdm import tqdm
+
     # Check the requirements and select the appropriate backend (CPU or GPU)
     # check_requirements("onnxruntime-gpu" if torch.cuda.is_available() else "onnxruntime")
 
     # Create an instance of the YOLOv8 class with the specified arguments
-    detection = YOLOv8(args.model, args.img, args.conf_thres, args.iou_thres)
+    detection = YOLOv8(args.model, args.img, args.conf_thres, args.iou_thres, args.classes)
 
     # Perform object detection and obtain the output image
-    for i in tqdm(range(1000)):
+    output_image = detection.main()
+    timer.mark("first detection")
+    print(timer.report())
+    for i in tqdm(range(999)):
         output_image = detection.main()
 
     # Display the output image in a window
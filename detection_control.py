@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+
+
+def percentile(values, q):
+    """Returns the q-th percentile (0-100) of values, nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class DetectionGate:
+    def __init__(self, signal, thresholds: dict|float=0.5, n_on: int=3, window: int=5, n_off: int=1,
+                 min_on_time: float=5.0, min_off_time: float=2.0, min_interval: float=1.0, channel=None,
+                 history: int=1000):
+        """
+        Turns a stream of per-frame detections into debounced ON/OFF states for an RF controller.
+
+        A frame counts as a hit when any detection passes its class threshold. The state turns ON when at least
+        n_on of the last window frames are hits and OFF when fewer than n_off are. A new state is held for at
+        least min_on_time/min_off_time seconds and state changes are sent at most once every min_interval
+        seconds, so flickering detections never reach the transmitter.
+
+        Args:
+            signal: SignalControl, or MultiChannelControl together with channel
+            thresholds: Confidence threshold for every class, or a dict of class_id -> threshold where
+                classes that are not listed are ignored
+            n_on: Hits in the window needed to turn ON
+            window: Number of recent frames considered
+            n_off: Turn OFF when the window holds fewer hits than this
+            min_on_time: Minimum seconds to stay ON
+            min_off_time: Minimum seconds to stay OFF
+            min_interval: Minimum seconds between two state changes sent to the signal
+            channel: Channel name when signal is a MultiChannelControl
+            history: Number of latency samples kept for stats()
+        """
+        if not 0 < n_on <= window:
+            raise ValueError("n_on must be between 1 and window")
+        if not 0 < n_off <= n_on:
+            raise ValueError("n_off must be between 1 and n_on")
+        self.signal = signal
+        self.thresholds = thresholds
+        self.n_on = n_on
+        self.n_off = n_off
+        self.min_on_time = min_on_time
+        self.min_off_time = min_off_time
+        self.min_interval = min_interval
+        self.channel = channel
+
+        self.state = False
+        self._hits = deque(maxlen=window)
+        self._hit_count = 0
+        self._state_time = float('-inf')
+        self._emit_time = float('-inf')
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.changes = 0
+        self.suppressed = 0
+        self._decision_latency = deque(maxlen=history)
+        self._emit_latency = deque(maxlen=history)
+
+    def _is_hit(self, scores, class_ids):
+        thresholds = self.thresholds
+        if isinstance(thresholds, dict):
+            for score, class_id in zip(scores, class_ids):
+                threshold = thresholds.get(int(class_id))
+                if threshold is not None and score >= threshold:
+                    return True
+            return False
+        return any(score >= thresholds for score in scores)
+
+    def update(self, boxes, scores, class_ids, capture_time: float|None=None) -> bool:
+        """
+        Feed the detections of one frame, as returned by YOLOv7.detect_objects.
+
+        Args:
+            boxes: Detected boxes, unused but accepted so detector output can be passed as is
+            scores: Detection scores
+            class_ids: Detection class ids
+            capture_time: time.perf_counter() when the frame was captured, used for latency stats
+
+        Returns:
+            bool: The current state after this frame.
+        """
+        now = time.perf_counter()
+        hit = self._is_hit(scores, class_ids)
+        with self._lock:
+            self.frames += 1
+            if len(self._hits) == self._hits.maxlen:
+                self._hit_count -= self._hits[0]
+            self._hits.append(hit)
+            self._hit_count += hit
+
+            if self.state:
+                wanted = self._hit_count >= self.n_off
+            else:
+                wanted = self._hit_count >= self.n_on
+
+            emit = False
+            if wanted != self.state:
+                dwell = self.min_on_time if self.state else self.min_off_time
+                if now - self._state_time < dwell or now - self._emit_time < self.min_interval:
+                    self.suppressed += 1
+                else:
+                    self.state = wanted
+                    self._state_time = now
+                    self._emit_time = now
+                    self.changes += 1
+                    emit = True
+            state = self.state
+
+        if emit:
+            if self.channel is None:
+                self.signal.set_state(state)
+            else:
+                self.signal.set_state(self.channel, state)
+        if capture_time is not None:
+            done = time.perf_counter()
+            with self._lock:
+                self._decision_latency.append(done - capture_time)
+                if emit:
+                    self._emit_latency.append(done - capture_time)
+        return state
+
+    def update_detections(self, detections, capture_time: float|None=None) -> bool:
+        """Feed the detection dictionaries of one frame, as returned by ObjectDetector.detect."""
+        return self.update([d["box"] for d in detections],
+                           [d["confidence"] for d in detections],
+                           [d["class_id"] for d in detections],
+                           capture_time)
+
+    def stats(self) -> dict:
+        """
+        Returns decision counters and latencies in milliseconds.
+
+        decision_* is capture to decision for every frame, emit_* is capture to the state change being handed
+        to the RF controller for frames that changed the state.
+        """
+        with self._lock:
+            decision = list(self._decision_latency)
+            emit = list(self._emit_latency)
+            stats = {
+                'frames': self.frames,
+                'changes': self.changes,
+                'suppressed': self.suppressed,
+                'state': self.state,
+            }
+        for name, values in (('decision', decision), ('emit', emit)):
+            stats[f'{name}_p50_ms'] = percentile(values, 50) * 1000
+            stats[f'{name}_p95_ms'] = percentile(values, 95) * 1000
+            stats[f'{name}_max_ms'] = max(values, default=0.0) * 1000
+        return stats
+
+
+if __name__ == "__main__":
+    import cv2
+    from rpi_rf import RFDevice
+    from wireless import SignalControl
+    from yolov7.YOLOv7opencv import YOLOv7
+
+    PIN = 17  # GPIO pin
+    MOOSE_LIKE = {19: 0.5, 20: 0.5, 21: 0.5}  # cow, elephant, bear in COCO
+
+    rfdevice = RFDevice(PIN)
+    rfdevice.enable_tx()
+    gate = DetectionGate(SignalControl(rfdevice), MOOSE_LIKE)
+
+    cap = cv2.VideoCapture(0)
+    yolov7_detector = YOLOv7("models/yolov7-tiny_480x640.onnx", conf_thres=0.3, iou_thres=0.5)
+    while cap.isOpened():
+        ret, frame = cap.read()
+        capture_time = time.perf_counter()
+        if not ret:
+            break
+        if gate.update(*yolov7_detector(frame), capture_time=capture_time):
+            print("Detection ON", gate.stats())
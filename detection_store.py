@@ -0,0 +1,279 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+DetectionRecord = namedtuple('DetectionRecord',
+                             ['timestamp', 'camera', 'class_id', 'score', 'x1', 'y1', 'x2', 'y2', 'crop'])
+
+_LOGGER = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    camera TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    crop TEXT
+);
+CREATE INDEX IF NOT EXISTS detections_time ON detections (timestamp);
+CREATE INDEX IF NOT EXISTS detections_class_time ON detections (class_id, timestamp);
+"""
+
+
+class DetectionStore:
+    def __init__(self, path, batch_size=2048, flush_interval=1.0, queue_size=10000):
+        """
+        Append-only detection log in SQLite, indexed on time and on class plus time.
+
+        Records are queued by add() and written in batches by a background thread, so the inference thread
+        never waits for the disk. When the queue is full new frames are dropped and their records counted. A batch
+        that cannot be written (disk full, database locked) is logged and counted in failed, the writer goes on.
+
+        Args:
+            path: Database file
+            batch_size: Records per transaction the writer aims for
+            flush_interval: Maximum seconds a record waits before it is written
+            queue_size: Maximum frames waiting to be written
+        """
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        # Reader connection of every thread that queried, closed by close()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._writer_thread, daemon=True)
+        self._thread.start()
+
+    def _connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        # WAL lets queries run while the writer appends
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add(self, timestamp, camera, class_ids, scores, boxes, crops=None):
+        """
+        Queues the detections of one frame, as returned by YOLOv7.detect_objects.
+
+        Args:
+            timestamp: Unix time of the frame
+            camera: Camera name
+            class_ids: Detection class ids
+            scores: Detection scores
+            boxes: Boxes as (x1, y1, x2, y2)
+            crops: Optional reference (e.g. file name) of a saved crop per detection
+
+        Returns:
+            bool: False when the records were dropped because the writer fell behind.
+        """
+        if crops is None:
+            crops = [None] * len(scores)
+        timestamp = float(timestamp)
+        rows = [(timestamp, camera, int(class_id), float(score), float(box[0]), float(box[1]), float(box[2]),
+                 float(box[3]), crop)
+                for class_id, score, box, crop in zip(class_ids, scores, boxes, crops)]
+        if not rows:
+            return True
+        if not self._thread.is_alive():
+            self.dropped += len(rows)
+            return False
+        # One queue entry per frame keeps the locking cost off the per-detection path
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped += len(rows)
+            return False
+        return True
+
+    def add_records(self, records):
+        """
+        Queues DetectionRecords as one entry, written in one transaction: all of them or, when the write fails,
+        none.
+
+        Returns:
+            bool: False when the records were dropped because the writer fell behind.
+        """
+        rows = [tuple(record) for record in records]
+        if not rows:
+            return True
+        if not self._thread.is_alive():
+            self.dropped += len(rows)
+            return False
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped += len(rows)
+            return False
+        return True
+
+    def add_detections(self, timestamp, camera, detections):
+        """Queues the detection dictionaries of one frame, as returned by ObjectDetector.detect."""
+        boxes = [(d["box"][0] * d["scale"], d["box"][1] * d["scale"],
+                  (d["box"][0] + d["box"][2]) * d["scale"], (d["box"][1] + d["box"][3]) * d["scale"])
+                 for d in detections]
+        return self.add(timestamp, camera, [d["class_id"] for d in detections],
+                        [d["confidence"] for d in detections], boxes)
+
+    def _writer_thread(self):
+        connection = self._connect()
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                if isinstance(item, threading.Event):
+                    # Flush marker, written with the current batch
+                    self._write(connection, batch)
+                    batch = []
+                    item.set()
+                    continue
+                batch.extend(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            self._write(connection, batch)
+        connection.close()
+
+    def _write(self, connection, batch):
+        if batch:
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO detections (timestamp, camera, class_id, score, x1, y1, x2, y2, crop) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            except sqlite3.Error as e:
+                self.failed += len(batch)
+                _LOGGER.error("writing %d detections to %s failed: %s", len(batch), self.path, e)
+                return
+            self.written += len(batch)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything queued so far is written.
+
+        Returns:
+            bool: False when a write failed in the meantime, the writer stopped or timeout seconds passed.
+        """
+        failed = self.failed
+        done = threading.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        while not done.wait(0.5 if deadline is None else min(max(deadline - time.monotonic(), 0), 0.5)):
+            if not self._thread.is_alive() or (deadline is not None and time.monotonic() >= deadline):
+                return False
+        return self.failed == failed
+
+    def _reader(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Closed from the thread that calls close()
+            connection = self._local.connection = self._connect(check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(connection)
+        return connection
+
+    def _where(self, start, end, class_id, min_score, camera):
+        clauses, params = [], []
+        for clause, value in (("timestamp >= ?", start), ("timestamp < ?", end), ("class_id = ?", class_id),
+                              ("score >= ?", min_score), ("camera = ?", camera)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, start=None, end=None, class_id=None, min_score=None, camera=None, limit=None):
+        """
+        Returns DetectionRecords matching all given filters, oldest first.
+
+        Args:
+            start: Unix time, inclusive
+            end: Unix time, exclusive
+            class_id: Only this class
+            min_score: Only detections with at least this score
+            camera: Only this camera
+            limit: Maximum number of records
+        """
+        where, params = self._where(start, end, class_id, min_score, camera)
+        sql = ("SELECT timestamp, camera, class_id, score, x1, y1, x2, y2, crop FROM detections"
+               + where + " ORDER BY timestamp")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [DetectionRecord(*row) for row in self._reader().execute(sql, params)]
+
+    def count(self, start=None, end=None, class_id=None, min_score=None, camera=None):
+        """Returns the number of detections matching all given filters."""
+        where, params = self._where(start, end, class_id, min_score, camera)
+        return self._reader().execute("SELECT COUNT(*) FROM detections" + where, params).fetchone()[0]
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for connection in readers:
+            connection.close()
+        self._local = threading.local()
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import random
+    import tempfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of detections to write")
+    parser.add_argument("--db", default=None, help="Database file, a temporary one when not given")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "detections.db")
+    # Queue sized for the whole burst, the benchmark adds far faster than any camera
+    store = DetectionStore(path, queue_size=args.rows)
+    rng = random.Random(0)
+    now = time.time()
+    week = 7 * 24 * 3600
+
+    start = time.perf_counter()
+    max_add = 0.0
+    for i in range(0, args.rows, 4):
+        t = time.perf_counter()
+        # Four weeks of frames in time order, like a live pipeline produces them
+        store.add(now - 4 * week * (1 - i / args.rows), f"cam{i % 3}", [rng.randrange(3) for _ in range(4)],
+                  [rng.random() for _ in range(4)], [(10, 20, 110, 220)] * 4)
+        max_add = max(max_add, time.perf_counter() - t)
+    queued = time.perf_counter() - start
+    store.flush()
+    total = time.perf_counter() - start
+    print(f"Queued {args.rows} rows in {queued:.2f} s (max add {max_add * 1000:.2f} ms), "
+          f"written after {total:.2f} s ({store.written / total:.0f} rows/s), dropped {store.dropped}")
+
+    start = time.perf_counter()
+    moose = store.query(start=now - week, class_id=0, min_score=0.8)
+    print(f"Moose above 0.8 last week: {len(moose)} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+    store.close()
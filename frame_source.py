@@ -0,0 +1,198 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# Container layout: a 64 byte header, then records of an 8 byte timestamp followed by the raw frame.
+# The frame count is derived from the file size, so a recording cut short by a crash stays readable.
+MAGIC = b'RAWVID01'
+HEADER = struct.Struct('<8sIII8s')
+HEADER_SIZE = 64
+
+
+def record_dtype(shape, dtype):
+    """Structured dtype of one (timestamp, frame) record."""
+    return np.dtype([('timestamp', '<f8'), ('frame', np.dtype(dtype), tuple(shape))])
+
+
+class FrameSource:
+    """Base class of frame sources, read() returns (ret, frame, timestamp)."""
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            ret, frame, timestamp = self.read()
+            if not ret:
+                return
+            yield frame, timestamp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class CameraSource(FrameSource):
+    def __init__(self, device=0, api=cv2.CAP_ANY):
+        """
+        Live frames from cv2.VideoCapture.
+
+        Args:
+            device: Camera index, device path or video file
+            api: OpenCV capture API
+        """
+        self.cap = cv2.VideoCapture(device, api)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open camera {device}")
+        self._frame = None
+
+    def read(self):
+        ret, frame = self.cap.read(self._frame)
+        timestamp = time.time()
+        if not ret:
+            return False, None, timestamp
+        self._frame = frame
+        return True, frame, timestamp
+
+    def release(self):
+        self.cap.release()
+
+
+class FrameRecorder:
+    def __init__(self, path, shape, dtype=np.uint8):
+        """
+        Writes raw frames with their timestamps to a container that ReplaySource memory-maps.
+
+        Args:
+            path: Output file
+            shape: Shape of every frame, e.g. (480, 640, 3)
+            dtype: Pixel type of every frame
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if len(self.shape) not in (2, 3):
+            raise ValueError("Frames must be 2D or 3D")
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) == 3 else 0
+        self._file = open(path, 'wb')
+        header = HEADER.pack(MAGIC, height, width, channels, self.dtype.str.encode())
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self._timestamp = np.zeros(1, '<f8')
+        self.count = 0
+
+    def write(self, frame, timestamp=None):
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError(f"Frame {frame.shape} {frame.dtype} does not match {self.shape} {self.dtype}")
+        self._timestamp[0] = time.time() if timestamp is None else timestamp
+        self._timestamp.tofile(self._file)
+        np.ascontiguousarray(frame).tofile(self._file)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_recording(path):
+    """Memory-maps a recording, returns the record array with 'timestamp' and 'frame' fields."""
+    with open(path, 'rb') as f:
+        magic, height, width, channels, dtype = HEADER.unpack(f.read(HEADER_SIZE)[:HEADER.size])
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a raw video recording")
+    shape = (height, width, channels) if channels else (height, width)
+    rec_dtype = record_dtype(shape, dtype.rstrip(b'\0').decode())
+    count = (np.memmap(path, np.uint8, mode='r').size - HEADER_SIZE) // rec_dtype.itemsize
+    return np.memmap(path, rec_dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+class ReplaySource(FrameSource):
+    def __init__(self, path, realtime=False, speed=1.0, loop=False):
+        """
+        Serves frames of a recording as read-only views into the memory map.
+
+        Args:
+            path: Recording written by FrameRecorder
+            realtime: Pace frames like they were recorded, otherwise serve them as fast as possible
+            speed: Playback speed factor when realtime
+            loop: Start over at the end of the recording
+        """
+        self.records = open_recording(path)
+        self.frames = self.records['frame']
+        self.timestamps = np.asarray(self.records['timestamp'])
+        self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        self._start = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def read(self):
+        if self.index >= len(self.frames):
+            if not self.loop or not len(self.frames):
+                return False, None, None
+            self.index = 0
+            self._start = None
+        i = self.index
+        self.index += 1
+        if self.realtime:
+            now = time.perf_counter()
+            if self._start is None:
+                self._start = now - (self.timestamps[i] - self.timestamps[0]) / self.speed
+            delay = self._start + (self.timestamps[i] - self.timestamps[0]) / self.speed - now
+            if delay > 0:
+                time.sleep(delay)
+        return True, self.frames[i], float(self.timestamps[i])
+
+
+def open_source(spec, **kwargs):
+    """Opens a recording when spec is a path to one, a live camera otherwise."""
+    if isinstance(spec, str) and not spec.isdigit():
+        with open(spec, 'rb') as f:
+            if f.read(len(MAGIC)) == MAGIC:
+                return ReplaySource(spec, **kwargs)
+        return CameraSource(spec)
+    return CameraSource(int(spec))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["record", "replay"], help="Record from a camera or replay a recording")
+    parser.add_argument("path", help="Recording file")
+    parser.add_argument("--device", default="0", help="Camera to record from")
+    parser.add_argument("--count", type=int, default=300, help="Number of frames to record")
+    parser.add_argument("--realtime", action="store_true", help="Replay at the recorded frame rate")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        with open_source(args.device) as source:
+            ret, frame, timestamp = source.read()
+            assert ret, 'no image'
+            with FrameRecorder(args.path, frame.shape, frame.dtype) as recorder:
+                recorder.write(frame, timestamp)
+                for _, (frame, timestamp) in zip(range(args.count - 1), source):
+                    recorder.write(frame, timestamp)
+        print(f"Recorded {recorder.count} frames")
+    else:
+        source = ReplaySource(args.path, realtime=args.realtime)
+        start = time.perf_counter()
+        checksum = 0
+        for frame, _ in source:
+            checksum += int(frame[0, 0].sum())
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {len(source)} frames in {elapsed:.2f} s ({len(source) / elapsed:.0f} fps)")
@@ -0,0 +1,152 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def jpeg_size(path):
+    """
+    Reads the (width, height) of a JPEG from its frame header without decoding it.
+
+    Returns:
+        tuple: (width, height), or None when the file is not a JPEG.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            # Skip fill bytes
+            while marker[1] == 0xFF:
+                marker = marker[1:] + f.read(1)
+            length = struct.unpack('>H', f.read(2))[0]
+            # Start of frame markers, except DHT, JPG and DAC which share the range
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>xHH', f.read(5))
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def reduction_factor(size, target, letterbox=False):
+    """
+    Picks the largest JPEG decode reduction (1, 2, 4 or 8) that keeps the image at least as large as target.
+
+    Args:
+        size: (width, height) of the full image
+        target: (width, height) the image is resized to afterwards
+        letterbox: The image is padded to a square before resizing, so only the longer side has to fit
+    """
+    width, height = size
+    for factor in (8, 4, 2):
+        if letterbox:
+            fits = max(width, height) / factor >= max(target)
+        else:
+            # EXIF rotation may swap the sides after decoding, so both orientations have to fit
+            fits = min(width, height) / factor >= max(target)
+        if fits:
+            return factor
+    return 1
+
+
+class ImageLoader:
+    def __init__(self, target=None, letterbox=False, cache_size=32):
+        """
+        Loads images with reduced-size JPEG decoding and a decode cache.
+
+        Cached images are shared and read-only, copy them before drawing on them.
+
+        Args:
+            target: (width, height) of the model input, full resolution decoding when None
+            letterbox: The detector pads to a square before resizing
+            cache_size: Number of decoded images kept, keyed by path, mtime and reduction; 0 disables the cache
+        """
+        self.target = target
+        self.letterbox = letterbox
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """
+        Loads an image.
+
+        Returns:
+            tuple: (image, factor) where factor is the decode reduction, multiply coordinates by it to get
+            full resolution coordinates.
+        """
+        path = str(path)
+        stat = os.stat(path)
+        factor = 1
+        if self.target is not None:
+            size = jpeg_size(path)
+            if size is not None:
+                factor = reduction_factor(size, self.target, self.letterbox)
+        key = (path, stat.st_mtime_ns, stat.st_size, factor)
+
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return image, factor
+            self.misses += 1
+
+        image = cv2.imread(path, REDUCED_FLAGS[factor])
+        if image is None:
+            raise IOError(f"Cannot read image {path}")
+        image.flags.writeable = False
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = image
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return image, factor
+
+
+def list_images(directory):
+    """Returns the image files in a directory, sorted by name."""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES)
+
+
+def prefetch(paths, loader, workers=4, lookahead=8):
+    """
+    Decodes images on a thread pool ahead of the consumer.
+
+    Yields:
+        tuple: (path, image, factor) in the order of paths.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(loader.load, path) for path in paths[:lookahead]]
+        for i, path in enumerate(paths):
+            image, factor = pending[i].result()
+            pending[i] = None
+            if i + lookahead < len(paths):
+                pending.append(pool.submit(loader.load, paths[i + lookahead]))
+            yield path, image, factor
+
+
+def encode_jpeg(image, quality=90):
+    """Encodes an image as JPEG bytes."""
+    ret, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ret:
+        raise IOError("JPEG encoding failed")
+    return data.tobytes()
+
+
+def save_jpeg(path, image, quality=90):
+    """Writes an annotated image as JPEG with the given quality."""
+    if not cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise IOError(f"Cannot write image {path}")
@@ -0,0 +1,191 @@
+"""
+Peak resident memory of the detectors with and without low_memory.
+
+Every configuration runs in a fresh process that reports its peak RSS (VmHWM) after imports and after the
+frames, so the numbers do not include each other. Without --model a synthetic YOLO-shaped model with weights of
+the size of yolov7-tiny is generated, so the benchmark runs where the real models are not available. With
+--max-mb the exit status is 1 when a low memory configuration grows by more than that, .github/workflows/memory.yml
+runs it as a CI check.
+
+    python memory_benchmark.py --frames 20 --max-mb 140
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    # ru_maxrss survives exec, a child would report the peak of the parent, VmHWM starts over
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def anonymous_mb():
+    """
+    Resident memory of this process that is not backed by a file, in MB.
+
+    Memory-mapped weights count towards RSS, but the kernel drops those pages under pressure and reads them
+    again, the heap it cannot. 0 where /proc is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def synthetic_model(path, layout='yolov7', size=640, weights_mb=12, classes=80):
+    """
+    Writes a model with a YOLO input and output, the activations of a stride 32 backbone and random weights.
+
+    Args:
+        path: ONNX file to write
+        layout: 'yolov7' for a (1, anchors, 5 + classes) output, 'yolov8' for (1, 4 + classes, anchors)
+        size: Square input size
+        weights_mb: Size of the two wide 1x1 convolutions, the backbone adds about as much
+        classes: Number of classes
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    outputs = classes + (5 if layout == 'yolov7' else 4)
+    channels = int(np.sqrt(weights_mb * (1 << 20) / 8))
+    # A stride 2 backbone with the large early activations of a real detector, then two wide 1x1 convolutions
+    # holding most of the weights, at stride 32
+    layers = [(3, 32, 3, 2), (32, 64, 3, 2), (64, 128, 3, 2), (128, 256, 3, 2), (256, channels, 3, 2),
+              (channels, channels, 1, 1), (channels, channels, 1, 1)]
+    initializers = []
+    nodes = []
+    name = 'images'
+    for i, (c_in, c_out, kernel, stride) in enumerate(layers):
+        # Small weights keep the activations and scores in a sensible range
+        weight = rng.normal(0, 1 / np.sqrt(c_in * kernel * kernel), (c_out, c_in, kernel, kernel))
+        initializers.append(numpy_helper.from_array(weight.astype(np.float32), f'w{i}'))
+        nodes += [helper.make_node('Conv', [name, f'w{i}'], [f'c{i}'], strides=[stride, stride],
+                                   pads=[kernel // 2] * 4),
+                  helper.make_node('Relu', [f'c{i}'], [f'r{i}'])]
+        name = f'r{i}'
+    weight = rng.normal(0, 0.02, (outputs, channels, 1, 1))
+    initializers.append(numpy_helper.from_array(weight.astype(np.float32), 'head'))
+    anchors = (size // 32) ** 2
+    initializers.append(numpy_helper.from_array(np.array([1, outputs, anchors], np.int64), 'shape'))
+    nodes += [
+        helper.make_node('Conv', [name, 'head'], ['scores']),
+        helper.make_node('Sigmoid', ['scores'], ['sigmoid']),
+        helper.make_node('Reshape', ['sigmoid', 'shape'], ['output' if layout == 'yolov8' else 'flat']),
+    ]
+    if layout == 'yolov7':
+        nodes.append(helper.make_node('Transpose', ['flat'], ['output'], perm=[0, 2, 1]))
+        out_shape = [1, anchors, outputs]
+    else:
+        out_shape = [1, outputs, anchors]
+    graph = helper.make_graph(nodes, 'synthetic_yolo',
+                              [helper.make_tensor_value_info('images', TensorProto.FLOAT, [1, 3, size, size])],
+                              [helper.make_tensor_value_info('output', TensorProto.FLOAT, out_shape)], initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def run_child(detector_name, model_path, low_memory, frames):
+    """Runs one configuration in this process and prints its peak RSS as JSON."""
+    import cv2
+
+    baseline = peak_rss_mb()
+    base_anonymous = anonymous = anonymous_mb()
+    # One capture buffer that the camera overwrites, like frame_source does
+    frame = np.random.default_rng(1).integers(0, 255, (1080, 1920, 3), np.uint8)
+    if detector_name == 'yolov7':
+        from yolov7 import YOLOv7
+
+        detector = YOLOv7(model_path, conf_thres=0.5, cache_dir=None, low_memory=low_memory)
+        for _ in range(frames):
+            detector(frame)
+            annotated = detector.draw_detections(frame)
+            cv2.imencode('.jpg', annotated)
+            anonymous = max(anonymous, anonymous_mb())
+    else:
+        from detect import ObjectDetector
+
+        detector = ObjectDetector(model_path, None, low_memory=low_memory)
+        for _ in range(frames):
+            detector.detect(frame)
+            cv2.imencode('.jpg', frame if low_memory else detector.original_image)
+            anonymous = max(anonymous, anonymous_mb())
+    print(json.dumps({'baseline_mb': baseline, 'peak_mb': peak_rss_mb(),
+                      'anonymous_mb': anonymous - base_anonymous}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=None, help="YOLOv7 layout model, synthetic when not given")
+    parser.add_argument("--model-v8", default=None, help="YOLOv8 layout model for ObjectDetector, synthetic when "
+                                                         "not given")
+    parser.add_argument("--frames", type=int, default=20, help="1080p frames per configuration")
+    parser.add_argument("--max-mb", type=float, default=None, help="Fail when a low memory run grows more")
+    parser.add_argument("--child", nargs=3, metavar=("DETECTOR", "MODEL", "LOW_MEMORY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        detector_name, model_path, low_memory = args.child
+        run_child(detector_name, model_path, low_memory == '1', args.frames)
+        return
+
+    from onnx_tools import save_external
+
+    with tempfile.TemporaryDirectory() as directory:
+        models = {'yolov7': args.model, 'object': args.model_v8}
+        for name, layout in (('yolov7', 'yolov7'), ('object', 'yolov8')):
+            if models[name] is None:
+                models[name] = os.path.join(directory, f'synthetic_{layout}.onnx')
+                synthetic_model(models[name], layout)
+        import onnx
+
+        # Low memory runs use the weights from a memory-mapped file
+        external = os.path.join(directory, 'external.onnx')
+        save_external(onnx.load(models['yolov7']), external)
+
+        configurations = [
+            ('YOLOv7 (onnxruntime)', 'yolov7', models['yolov7'], '0'),
+            ('YOLOv7 (onnxruntime) low memory', 'yolov7', external, '1'),
+            ('ObjectDetector (cv2.dnn)', 'object', models['object'], '0'),
+            ('ObjectDetector (cv2.dnn) low memory', 'object', models['object'], '1'),
+        ]
+        failed = False
+        print(f"{'configuration':<38} {'baseline MB':>12} {'peak MB':>9} {'growth MB':>10} {'heap MB':>8}")
+        for label, detector_name, model_path, low_memory in configurations:
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--frames", str(args.frames),
+                                     "--child", detector_name, model_path, low_memory],
+                                    capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            usage = json.loads(result.stdout.strip().splitlines()[-1])
+            growth = usage['peak_mb'] - usage['baseline_mb']
+            print(f"{label:<38} {usage['baseline_mb']:>12.1f} {usage['peak_mb']:>9.1f} {growth:>10.1f} "
+                  f"{usage['anonymous_mb']:>8.1f}")
+            if low_memory == '1' and args.max_mb is not None and growth > args.max_mb:
+                failed = True
+        if failed:
+            print(f"A low memory configuration grew by more than {args.max_mb} MB")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
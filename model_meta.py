@@ -0,0 +1,195 @@
+import ast
+import os
+import pickle
+import re
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from startup import file_digest, lazy_import
+
+yaml = lazy_import("yaml")
+onnx = lazy_import("onnx")
+
+COCO_NAMES = ('person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
+              'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse',
+              'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie',
+              'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove',
+              'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon',
+              'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut',
+              'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse',
+              'remote', 'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book',
+              'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush')
+
+# Characters YAML cannot hold, removed before parsing
+NON_PRINTABLE = re.compile(r"[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]+")
+
+ModelMeta = namedtuple('ModelMeta', ['names', 'input_shape', 'colors', 'postprocess', 'preprocess'])
+ModelMeta.__doc__ = """
+Class names, (height, width) of the model input or None, a BGR color per class, the postprocessing in the
+graph ('nms' for models fused by onnx_tools.fuse_nms, None for raw outputs) and the preprocessing in the graph
+('bgr_uint8_nhwc' for models from onnx_tools.add_preprocessing, None for float NCHW RGB input).
+"""
+
+_parsed = {}
+
+
+def file_hash(path):
+    return file_digest(path)
+
+
+def _cached(path, kind, parse):
+    """
+    Parses a file once per content hash.
+
+    Results are kept in memory and pickled to .meta_cache next to the file, so later starts skip parsing.
+    """
+    key = (kind, file_hash(path))
+    if key in _parsed:
+        return _parsed[key]
+    cache = os.path.join(os.path.dirname(os.path.abspath(path)), '.meta_cache', f"{kind}.{key[1][:16]}.pickle")
+    try:
+        with open(cache, 'rb') as f:
+            data = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        data = parse(path)
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            partial = f"{cache}.{os.getpid()}.tmp"
+            with open(partial, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, cache)
+        except OSError:
+            # Read-only model directory, the in-memory cache still applies
+            pass
+    _parsed[key] = data
+    return data
+
+
+def _parse_yaml(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        content = f.read()
+    return yaml.safe_load(NON_PRINTABLE.sub("", content)) or {}
+
+
+def load_yaml(file="data.yaml", append_filename=False):
+    """
+    Load YAML data from a file, parsed once per file content.
+
+    Args:
+        file (str, optional): File name. Defaults to 'data.yaml'.
+        append_filename (bool, optional): If True, adds the YAML filename to the returned dictionary under the
+            key 'yaml_file'. Defaults to False.
+
+    Returns:
+        dict: Parsed YAML data, possibly including the filename. Nested values are shared, do not modify them.
+    """
+    if Path(file).suffix.lower() not in {".yaml", ".yml"}:
+        raise ValueError(f"Attempting to load non-YAML file '{file}' with load_yaml()")
+    data = dict(_cached(file, "yaml", _parse_yaml))
+    if append_filename:
+        data["yaml_file"] = str(file)
+    return data
+
+
+def _parse_onnx(path):
+    # Only the graph structure and metadata are needed, external weights stay on disk
+    model = onnx.load(str(path), load_external_data=False)
+    metadata = {prop.key: prop.value for prop in model.metadata_props}
+    initializers = {init.name for init in model.graph.initializer}
+    inputs = []
+    for model_input in model.graph.input:
+        if model_input.name in initializers:
+            continue
+        dims = model_input.type.tensor_type.shape.dim
+        inputs.append((model_input.name, tuple(d.dim_value if d.HasField('dim_value') else None for d in dims)))
+    return {'metadata': metadata, 'inputs': inputs}
+
+
+def onnx_info(model_path):
+    """
+    Reads the custom metadata and input shapes of an ONNX model.
+
+    Without the onnx package, e.g. on a cv2.dnn-only install, both are empty and load_meta falls back to the
+    dataset YAML and the default input shape.
+
+    Returns:
+        dict: 'metadata' maps metadata keys to strings, 'inputs' is a list of (name, shape) with None for
+        dynamic dimensions.
+    """
+    try:
+        return _cached(model_path, "onnx", _parse_onnx)
+    except ImportError:
+        return {'metadata': {}, 'inputs': []}
+
+
+def _literal(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return None
+
+
+def names_list(names):
+    """Converts class names given as a list or as an {id: name} mapping to a list indexed by class id."""
+    if isinstance(names, dict):
+        names = {int(k): str(v) for k, v in names.items()}
+        return tuple(names.get(i, str(i)) for i in range(max(names) + 1)) if names else ()
+    return tuple(str(name) for name in names)
+
+
+@lru_cache(maxsize=None)
+def class_colors(count, seed=3):
+    """Returns one BGR color per class id, the same for every detector with the same number of classes."""
+    rng = np.random.default_rng(seed)
+    return tuple(tuple(int(c) for c in color) for color in rng.uniform(0, 255, size=(count, 3)))
+
+
+def load_meta(model_path=None, dataset_yaml=None, default_input_shape=None):
+    """
+    Collects what a detector needs to know about its model.
+
+    Class names come from the ONNX metadata of the model (as written by Ultralytics export), then from the
+    'names' of the dataset YAML, then COCO. The input shape comes from the model input, then from the 'imgsz'
+    metadata.
+
+    Args:
+        model_path: ONNX model file
+        dataset_yaml: Dataset YAML with a 'names' entry
+        default_input_shape: (height, width) used when the model does not tell
+
+    Returns:
+        ModelMeta
+    """
+    names = None
+    input_shape = None
+    postprocess = None
+    preprocess = None
+    if model_path is not None and Path(model_path).suffix.lower() == ".onnx":
+        info = onnx_info(model_path)
+        metadata = info['metadata']
+        postprocess = metadata.get('postprocess')
+        preprocess = metadata.get('preprocess')
+        if 'names' in metadata:
+            parsed = _literal(metadata['names'])
+            if parsed:
+                names = names_list(parsed)
+        if info['inputs']:
+            shape = info['inputs'][0][1]
+            # Frames in, (1, H, W, 3), otherwise a (1, 3, H, W) tensor
+            height, width = (1, 2) if preprocess == 'bgr_uint8_nhwc' else (2, 3)
+            if len(shape) == 4 and shape[height] and shape[width]:
+                input_shape = (shape[height], shape[width])
+        if input_shape is None and 'imgsz' in metadata:
+            imgsz = _literal(metadata['imgsz'])
+            if isinstance(imgsz, int):
+                input_shape = (imgsz, imgsz)
+            elif imgsz:
+                input_shape = tuple(imgsz)
+    if names is None and dataset_yaml is not None:
+        names = names_list(load_yaml(dataset_yaml)["names"])
+    if names is None:
+        names = COCO_NAMES
+    return ModelMeta(names, input_shape or default_input_shape, class_colors(len(names)), postprocess, preprocess)
@@ -0,0 +1,392 @@
+"""
+Switches detection models while the loop keeps running.
+
+ModelRegistry builds and warms a detector for a new model on a background thread and swaps it in between two
+frames, the frames in between still go through the current model. Detectors stay cached up to a capacity, least
+recently used first out, and one that is still running an inference is only dropped when that inference is done.
+A model file that is replaced on disk, e.g. a new moose_*.onnx copied over with mv, is loaded again and swapped in
+the same way. ModelSchedule picks the model by time of day or by the brightness of the frames.
+
+    python model_registry.py 0 --schedule schedule.yaml
+    python model_registry.py recording.bin --models models/yolov7-tiny_480x640.onnx models/thermal.onnx
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from model_meta import load_yaml
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, model, detector, mtime, load_time):
+        self.model = model
+        self.detector = detector
+        self.mtime = mtime
+        self.load_time = load_time
+        # Inferences running on this detector, it is dropped from memory only when they are done
+        self.refs = 0
+        self.cached = True
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _lower_priority():
+    # Niceness is per thread on Linux and inherited by the threads ONNX Runtime starts while loading, so the
+    # warm-up runs on the cycles the detection loop leaves
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class ModelRegistry:
+    def __init__(self, make_detector, capacity=2, watch_interval=5.0, retry_interval=60.0, clock=time.monotonic):
+        """
+        Detector for the current model, loaded in the background when it changes.
+
+        Args:
+            make_detector: Callable building a warmed-up YOLOv7-style detector from a model path
+            capacity: Detectors kept loaded, including the current one
+            watch_interval: Seconds between checks whether a loaded model file changed on disk, None disables them
+            retry_interval: Seconds before a model that failed to load is tried again
+            clock: Time source for the checks
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self.make_detector = make_detector
+        self.capacity = capacity
+        self.watch_interval = watch_interval
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}
+        # Model to the time its load failed, a schedule asks for it every frame
+        self._failed = {}
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='model-loader', initializer=_lower_priority)
+        self._current = None
+        self._target = None
+        self._checked = clock()
+        self._last = None
+        self.loads = 0
+        self.swaps = 0
+        self.evictions = 0
+
+    @property
+    def model(self):
+        """Path of the model the next frame runs through, None before the first switch() finished."""
+        return self._current.model if self._current else None
+
+    @property
+    def detector(self):
+        """Current detector, None before the first switch() finished."""
+        return self._current.detector if self._current else None
+
+    def switch(self, model, wait=False):
+        """
+        Makes model the current one, right away when it is loaded and otherwise once it is loaded and warmed up.
+
+        Args:
+            model: Model path passed to make_detector
+            wait: Block until the model is current, needed for the first model
+
+        Returns:
+            concurrent.futures.Future of the load, or None when the model was loaded already or failed to load less
+            than retry_interval ago.
+        """
+        with self._lock:
+            self._target = model
+            entry = self._entries.get(model)
+            if entry is not None:
+                self._swap(entry)
+                return None
+            failed = self._failed.get(model)
+            if failed is not None and self.clock() - failed < self.retry_interval and not wait:
+                return None
+            future = self._load(model)
+        if wait:
+            future.result()
+        return future
+
+    def reload(self, model, wait=False):
+        """Loads model again from its file, replacing the cached detector, e.g. after a new version was deployed."""
+        with self._lock:
+            future = self._load(model)
+        if wait:
+            future.result()
+        return future
+
+    def _load(self, model):
+        # Called with the lock held
+        future = self._loading.get(model)
+        if future is None:
+            future = self._executor.submit(self._build, model)
+            self._loading[model] = future
+        return future
+
+    def _build(self, model):
+        start = time.perf_counter()
+        mtime = _mtime(model)
+        try:
+            detector = self.make_detector(model)
+        except Exception:
+            _LOGGER.exception("loading %s failed, keeping %s", model, self.model)
+            with self._lock:
+                del self._loading[model]
+                self._failed[model] = self.clock()
+            raise
+        entry = _Entry(model, detector, mtime, time.perf_counter() - start)
+        with self._lock:
+            del self._loading[model]
+            self._failed.pop(model, None)
+            self.loads += 1
+            old = self._entries.pop(model, None)
+            self._entries[model] = entry
+            if old is not None:
+                self._drop(old)
+            if self._target == model or (old is not None and old is self._current):
+                self._swap(entry)
+            self._evict()
+        _LOGGER.info("loaded %s in %.0f ms", model, entry.load_time * 1000)
+        return entry.detector
+
+    def _swap(self, entry):
+        # Called with the lock held, frames that already acquired the old detector finish on it
+        self._entries.move_to_end(entry.model)
+        if entry is not self._current:
+            if self._current is not None:
+                _LOGGER.info("model %s -> %s", self._current.model, entry.model)
+                self.swaps += 1
+            self._current = entry
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        for model in list(self._entries):
+            if len(self._entries) <= self.capacity:
+                break
+            entry = self._entries[model]
+            if entry is not self._current:
+                del self._entries[model]
+                self._drop(entry)
+                self.evictions += 1
+
+    def _drop(self, entry):
+        entry.cached = False
+        if entry.refs == 0:
+            entry.detector = None
+
+    @contextmanager
+    def use(self):
+        """
+        Current detector for one frame, kept loaded until the block ends even when another model is swapped in.
+
+        Yields:
+            The detector make_detector built.
+        """
+        self._check_files()
+        with self._lock:
+            entry = self._current
+            if entry is None:
+                raise RuntimeError("No model loaded, call switch(model, wait=True) first")
+            entry.refs += 1
+        try:
+            yield entry.detector
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if not entry.cached and entry.refs == 0:
+                    entry.detector = None
+
+    def _check_files(self):
+        if self.watch_interval is None or self.clock() - self._checked < self.watch_interval:
+            return
+        self._checked = self.clock()
+        with self._lock:
+            changed = [entry.model for entry in self._entries.values()
+                       if entry.model not in self._loading and _mtime(entry.model) not in (entry.mtime, None)]
+            for model in changed:
+                _LOGGER.info("%s changed on disk, loading it again", model)
+                self._load(model)
+
+    def __call__(self, image):
+        with self.use() as detector:
+            self._last = detector
+            return detector(image)
+
+    def draw_detections(self, image, *args, **kwargs):
+        """Draws the detections of the last frame with the detector that found them."""
+        return self._last.draw_detections(image, *args, **kwargs)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'model': self.model,
+                'loaded': list(self._entries),
+                'loading': list(self._loading),
+                'load_ms': {entry.model: entry.load_time * 1000 for entry in self._entries.values()},
+                'loads': self.loads,
+                'swaps': self.swaps,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        """Stops the loader thread after the load in progress."""
+        self._executor.shutdown(wait=True)
+
+
+def _parse_time(value):
+    if isinstance(value, int):
+        # YAML 1.1 reads an unquoted 20:00 as sexagesimal minutes
+        return datetime.time(value // 60 % 24, value % 60)
+    return datetime.time.fromisoformat(str(value))
+
+
+def brightness(frame, step=16):
+    """Mean of every step-th pixel of an 8 bit frame, 0 to 255."""
+    return float(np.mean(frame[::step, ::step]))
+
+
+class ModelSchedule:
+    def __init__(self, rules, default, alpha=0.1, margin=10.0, min_interval=60.0, clock=time.monotonic):
+        """
+        Picks a model by time of day or frame brightness. The first rule that matches wins, else the default.
+
+        Rules are dicts with a model and either a time window, {'model': m, 'from': '20:00', 'to': '06:30'}, which
+        may wrap around midnight, or a brightness bound, {'model': m, 'below': 40} or {'model': m, 'above': 200}.
+
+        Args:
+            rules: List of rules
+            default: Model when no rule matches
+            alpha: Weight of a new frame in the smoothed brightness
+            margin: Brightness a bound has to be crossed by to leave the model it selected, so dusk does not flap
+            min_interval: Seconds at least between two changes
+            clock: Time source for min_interval
+        """
+        self.rules = []
+        for rule in rules:
+            rule = dict(rule)
+            if 'from' in rule or 'to' in rule:
+                rule['from'], rule['to'] = _parse_time(rule['from']), _parse_time(rule['to'])
+            elif 'below' not in rule and 'above' not in rule:
+                raise ValueError(f"Rule for {rule.get('model')} needs from/to, below or above")
+            self.rules.append(rule)
+        self.default = default
+        self.alpha = alpha
+        self.margin = margin
+        self.min_interval = min_interval
+        self.clock = clock
+        self.brightness = None
+        self.model = None
+        self._changed = None
+
+    def _matches(self, rule, now):
+        if 'from' in rule:
+            start, end = rule['from'], rule['to']
+            return start <= now < end if start <= end else now >= start or now < end
+        # The bound of the active model is widened by the margin
+        margin = self.margin if rule['model'] == self.model else 0.0
+        if self.brightness is None:
+            return False
+        if 'below' in rule:
+            return self.brightness < rule['below'] + margin
+        return self.brightness > rule['above'] - margin
+
+    def select(self, frame=None, now=None):
+        """
+        Model for the current time and frame.
+
+        Args:
+            frame: 8 bit frame for the brightness rules, None keeps the last brightness
+            now: datetime.time, the local time when None
+
+        Returns:
+            str: Model path.
+        """
+        if frame is not None:
+            value = brightness(frame)
+            self.brightness = value if self.brightness is None else \
+                self.alpha * value + (1 - self.alpha) * self.brightness
+        now = now or datetime.datetime.now().time()
+        model = next((rule['model'] for rule in self.rules if self._matches(rule, now)), self.default)
+        if model != self.model:
+            if self._changed is not None and self.clock() - self._changed < self.min_interval:
+                return self.model
+            self.model = model
+            self._changed = self.clock()
+        return self.model
+
+
+def load_schedule(path, **kwargs):
+    """
+    Reads a ModelSchedule from YAML:
+
+        default: models/yolov7-tiny_480x640.onnx
+        rules:
+          - model: models/thermal.onnx
+            from: "20:00"
+            to: "06:30"
+          - model: models/thermal.onnx
+            below: 40
+    """
+    data = load_yaml(path)
+    return ModelSchedule(data.get('rules') or [], data['default'], **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from frame_source import open_source
+    from yolov7.YOLOv7opencv import YOLOv7
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", nargs="?", default="0", help="Camera index or recording")
+    parser.add_argument("--schedule", default=None, help="YAML schedule, see load_schedule")
+    parser.add_argument("--models", nargs="+", default=None, help="Models to cycle through without a schedule")
+    parser.add_argument("--swap-every", type=int, default=50, help="Frames between switches when cycling")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to run")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    schedule = load_schedule(args.schedule) if args.schedule else None
+    models = args.models or []
+    if schedule is None and not models:
+        parser.error("Give --schedule or --models")
+    registry = ModelRegistry(lambda path: YOLOv7(path, conf_thres=0.5), capacity=max(2, len(models)))
+    registry.switch(schedule.select() if schedule else models[0], wait=True)
+
+    times = []
+    source = open_source(int(args.source) if args.source.isdigit() else args.source)
+    for i, (frame, _) in enumerate(source):
+        if i == args.frames:
+            break
+        start = time.perf_counter()
+        if schedule is not None:
+            registry.switch(schedule.select(frame))
+        elif i and i % args.swap_every == 0:
+            registry.switch(models[i // args.swap_every % len(models)])
+        registry(frame)
+        times.append(time.perf_counter() - start)
+    source.release()
+    registry.close()
+
+    times = np.array(times) * 1000
+    metrics = registry.metrics()
+    print(f"{len(times)} frames, median {np.median(times):.1f} ms, max {times.max():.1f} ms, "
+          f"{metrics['swaps']} swaps")
+    # A switch that builds the detector in the loop stalls one frame by this much
+    print("load and warm-up ms:", {os.path.basename(m): round(ms) for m, ms in metrics['load_ms'].items()})
@@ -0,0 +1,3 @@
+from .external import save_external
+from .nms import fuse_nms, output_layout
+from .preprocess import add_preprocessing
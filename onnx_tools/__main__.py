@@ -0,0 +1,135 @@
+"""
+Model surgery on exported ONNX models.
+
+    python -m onnx_tools nms model.onnx model_nms.onnx --benchmark moose-1.jpg
+    python -m onnx_tools preprocess model_nms.onnx model_raw.onnx --benchmark moose-1.jpg
+    python -m onnx_tools external model_raw.onnx model_lowmem.onnx
+"""
+import argparse
+import time
+
+import onnx
+
+from onnx_tools.external import save_external
+from onnx_tools.nms import fuse_nms, output_layout, python_postprocess
+from onnx_tools.preprocess import add_preprocessing
+
+
+def benchmark_nms(raw_path, fused_path, image_path, conf_thres, iou_thres, top_k, runs):
+    """Prints inference plus Python postprocess time against the fused model on CPU."""
+    import cv2
+
+    from startup import create_session, warm_up
+
+    providers = ['CPUExecutionProvider']
+    raw_session = create_session(raw_path, providers, cache_dir=None)
+    fused_session = create_session(fused_path, providers, cache_dir=None)
+    if output_layout(onnx.load(raw_path, load_external_data=False)) != 'yolov8':
+        raise SystemExit("The Python baseline implements the YOLOv8 layout only")
+    model_input = raw_session.get_inputs()[0]
+    height, width = model_input.shape[2:]
+    blob = cv2.dnn.blobFromImage(cv2.imread(image_path), 1 / 255, (width, height), swapRB=True)
+    feeds = {model_input.name: blob}
+    warm_up(raw_session)
+    warm_up(fused_session)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        outputs = raw_session.run(None, feeds)
+    infer = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        expected = python_postprocess(outputs[0], conf_thres, iou_thres, top_k)
+    post = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        detections = fused_session.run(None, feeds)[0]
+    fused = (time.perf_counter() - start) / runs
+
+    print(f"Python: {(infer + post) * 1000:.2f} ms (inference {infer * 1000:.2f} ms + postprocess "
+          f"{post * 1000:.2f} ms), {len(expected)} detections")
+    print(f"Fused:  {fused * 1000:.2f} ms, {int((detections[:, 6] >= 0).sum())} detections")
+
+
+def benchmark_preprocess(float_path, raw_path, image_path, runs):
+    """Prints Python normalization plus inference time against the uint8 input model on CPU."""
+    import cv2
+    import numpy as np
+
+    from startup import create_session, warm_up
+
+    providers = ['CPUExecutionProvider']
+    float_session = create_session(float_path, providers, cache_dir=None)
+    raw_session = create_session(raw_path, providers, cache_dir=None)
+    float_input = float_session.get_inputs()[0]
+    raw_input = raw_session.get_inputs()[0]
+    height, width = float_input.shape[2:]
+    image = cv2.imread(image_path)
+    warm_up(float_session)
+    warm_up(raw_session)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        # What YOLOv7.prepare_input does
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        tensor = (cv2.resize(rgb, (width, height)) / 255.0).transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+        expected = float_session.run(None, {float_input.name: tensor})[0]
+    python = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        frame = cv2.resize(image, (width, height))[np.newaxis]
+        result = raw_session.run(None, {raw_input.name: frame})[0]
+    fused = (time.perf_counter() - start) / runs
+
+    print(f"Python: {python * 1000:.2f} ms, {tensor.nbytes} input bytes")
+    print(f"Fused:  {fused * 1000:.2f} ms, {frame.nbytes} input bytes")
+    if expected.shape == result.shape:
+        print(f"Max output difference {np.abs(expected - result).max():.2g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m onnx_tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    nms = commands.add_parser("nms", help="Append box decoding and NonMaxSuppression")
+    nms.add_argument("model", help="Exported ONNX model with the raw YOLO output")
+    nms.add_argument("output", help="Fused ONNX model to write")
+    nms.add_argument("--conf-thres", type=float, default=0.25, help="Score threshold")
+    nms.add_argument("--iou-thres", type=float, default=0.45, help="NMS IoU threshold")
+    nms.add_argument("--top-k", type=int, default=300, help="Maximum detections")
+    nms.add_argument("--per-class", action="store_true", help="Run NMS per class instead of across classes")
+    nms.add_argument("--benchmark", default=None, help="Image to compare fused and Python postprocess on")
+    nms.add_argument("--runs", type=int, default=100, help="Benchmark iterations")
+
+    preprocess = commands.add_parser("preprocess", help="Prepend uint8 BGR NHWC input normalization")
+    preprocess.add_argument("model", help="ONNX model with a float NCHW RGB input")
+    preprocess.add_argument("output", help="ONNX model with a uint8 BGR NHWC input to write")
+    preprocess.add_argument("--no-fold", action="store_true", help="Do not fold into the first Conv")
+    preprocess.add_argument("--benchmark", default=None, help="Image to compare Python and fused normalization on")
+    preprocess.add_argument("--runs", type=int, default=100, help="Benchmark iterations")
+
+    external = commands.add_parser("external", help="Move the weights to a page aligned file for memory mapping")
+    external.add_argument("model", help="ONNX model with its weights inside")
+    external.add_argument("output", help="ONNX model to write, the weights go to output + '.data'")
+    external.add_argument("--min-size", type=int, default=1024, help="Smaller tensors stay in the graph")
+    args = parser.parse_args()
+
+    if args.command == "nms":
+        fused = fuse_nms(onnx.load(args.model), args.conf_thres, args.iou_thres, args.top_k, not args.per_class)
+        onnx.save(fused, args.output)
+        print(f"Wrote {args.output}")
+        if args.benchmark:
+            benchmark_nms(args.model, args.output, args.benchmark, args.conf_thres, args.iou_thres, args.top_k,
+                          args.runs)
+    elif args.command == "preprocess":
+        onnx.save(add_preprocessing(onnx.load(args.model), fold=not args.no_fold), args.output)
+        print(f"Wrote {args.output}")
+        if args.benchmark:
+            benchmark_preprocess(args.model, args.output, args.benchmark, args.runs)
+    elif args.command == "external":
+        data_path = save_external(onnx.load(args.model), args.output, args.min_size)
+        print(f"Wrote {args.output} and {data_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Moves the weights of a model into a separate, page aligned file.
+
+ONNX Runtime memory-maps external data on the CPU, so the weights are read from the page cache as needed and can
+be dropped by the kernel under memory pressure instead of living in the heap of the process. Every tensor starts
+at a multiple of the page size, which mapping needs. Pair with startup.create_session(low_memory=True), which
+keeps ONNX Runtime from copying the weights into prepacked buffers.
+"""
+import os
+
+import onnx
+from onnx import TensorProto, numpy_helper
+
+PAGE_SIZE = 4096
+
+
+def save_external(model, path, min_size=1024, align=PAGE_SIZE):
+    """
+    Writes model to path with initializers of at least min_size bytes in path + '.data'.
+
+    Args:
+        model: onnx.ModelProto with its weights inside
+        path: ONNX file to write
+        min_size: Smaller tensors stay in the graph
+        align: Byte alignment of every tensor in the data file
+
+    Returns:
+        str: Path of the data file.
+    """
+    model = onnx.ModelProto.FromString(model.SerializeToString())
+    data_path = path + '.data'
+    location = os.path.basename(data_path)
+    offset = 0
+    with open(data_path, 'wb') as f:
+        for tensor in model.graph.initializer:
+            if tensor.data_location == TensorProto.EXTERNAL:
+                raise ValueError(f"Initializer {tensor.name} is already external, load the model with its data")
+            if tensor.data_type == TensorProto.STRING:
+                continue
+            data = numpy_helper.to_array(tensor).tobytes()
+            if len(data) < min_size:
+                continue
+            offset = -(-offset // align) * align
+            f.seek(offset)
+            f.write(data)
+            name, dims, data_type = tensor.name, list(tensor.dims), tensor.data_type
+            tensor.Clear()
+            tensor.name, tensor.data_type = name, data_type
+            tensor.dims.extend(dims)
+            tensor.data_location = TensorProto.EXTERNAL
+            for key, value in (('location', location), ('offset', str(offset)), ('length', str(len(data)))):
+                entry = tensor.external_data.add()
+                entry.key, entry.value = key, value
+            offset += len(data)
+    onnx.save(model, path)
+    onnx.checker.check_model(path)
+    return data_path
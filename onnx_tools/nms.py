@@ -0,0 +1,193 @@
+"""
+Appends box decoding and NonMaxSuppression to an exported YOLO model.
+
+The fused model has a single output 'detections' of shape (K, 7): [batch, x1, y1, x2, y2, class, score] in
+model input pixels, the format of the official YOLOv7 end-to-end export that
+YOLOv7.parse_processed_output reads. Rows with a negative score are padding and fall below any
+confidence threshold. The model metadata gets postprocess='nms' so detectors switch to it without
+configuration.
+"""
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+# [cx, cy, w, h] @ CXCYWH_TO_XYXY = [x1, y1, x2, y2]
+CXCYWH_TO_XYXY = np.array([[1, 0, 1, 0],
+                           [0, 1, 0, 1],
+                           [-0.5, 0, 0.5, 0],
+                           [0, -0.5, 0, 0.5]], np.float32)
+
+
+def _static_dims(value_info):
+    return [d.dim_value if d.HasField('dim_value') else None for d in value_info.type.tensor_type.shape.dim]
+
+
+def output_layout(model):
+    """
+    Tells the raw output layout of a YOLO model.
+
+    Returns:
+        str: 'yolov8' for (1, 4 + classes, anchors) without objectness, 'yolov7' for (1, anchors, 5 + classes).
+    """
+    dims = _static_dims(model.graph.output[0])
+    if len(dims) != 3 or dims[1] is None or dims[2] is None:
+        raise ValueError(f"Cannot tell the layout of output shape {dims}, pass layout explicitly")
+    return 'yolov8' if dims[1] < dims[2] else 'yolov7'
+
+
+def fuse_nms(model, conf_thres=0.25, iou_thres=0.45, top_k=300, agnostic=True, layout=None):
+    """
+    Returns a copy of model with decoding and NMS in the graph.
+
+    Args:
+        model: onnx.ModelProto with one raw YOLO output
+        conf_thres: Score threshold applied before NMS
+        iou_thres: NMS IoU threshold
+        top_k: Maximum detections per image (per class when not agnostic), not counting the padding row
+        agnostic: Suppress across classes using the best class of every box, like cv2.dnn.NMSBoxes on the
+            max class score does in the Python postprocess
+        layout: 'yolov8' or 'yolov7', read from the output shape when None
+
+    Returns:
+        onnx.ModelProto
+    """
+    model = onnx.ModelProto.FromString(model.SerializeToString())
+    graph = model.graph
+    if len(graph.output) != 1:
+        raise ValueError("Expected a model with a single raw output")
+    layout = layout or output_layout(model)
+    raw = graph.output[0].name
+    # NonMaxSuppression and GatherND need opset 11
+    opset = next(o for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+    opset.version = max(opset.version, 11)
+    prefix = 'nms_'
+    nodes = []
+    consts = {
+        'xyxy': CXCYWH_TO_XYXY,
+        'zero': np.array([0], np.int64),
+        'four': np.array([4], np.int64),
+        'five': np.array([5], np.int64),
+        'end': np.array([np.iinfo(np.int64).max], np.int64),
+        'one': np.array([1], np.int64),
+        'axis1': np.array([1], np.int64),
+        'axis2': np.array([2], np.int64),
+        # One more per class for the padding box
+        'max_boxes': np.array([top_k + 1], np.int64),
+        'pad_box': np.array([[[-2, -2, -1, -1]]], np.float32),
+        'pad_class': np.zeros((1, 1, 1), np.int64),
+        'iou': np.array([iou_thres], np.float32),
+        'conf': np.array([conf_thres], np.float32),
+        'box_cols': np.array([0, 2], np.int64),
+    }
+    used = set()
+
+    def node(op, inputs, outputs=None, **attrs):
+        outputs = outputs or [prefix + f'{op.lower()}_{len(nodes)}']
+        names = []
+        for name in inputs:
+            if name in consts:
+                used.add(name)
+            names.append(name if name.startswith(prefix) or name == raw else prefix + name)
+        nodes.append(helper.make_node(op, names, outputs, **attrs))
+        return outputs[0]
+
+    dims = _static_dims(graph.output[0])
+    if layout == 'yolov8':
+        classes = dims[1] - 4 if dims[1] else None
+        # (1, 4 + nc, N): boxes are rows 0-3, class scores the rest, already in NMS score layout (1, nc, N)
+        boxes = node('Slice', [raw, 'zero', 'four', 'axis1'])
+        boxes = node('Transpose', [boxes], perm=[0, 2, 1])
+        scores = node('Slice', [raw, 'four', 'end', 'axis1'])
+    elif layout == 'yolov7':
+        classes = dims[2] - 5 if dims[2] else None
+        # (1, N, 5 + nc): score is class confidence times objectness
+        boxes = node('Slice', [raw, 'zero', 'four', 'axis2'])
+        objectness = node('Slice', [raw, 'four', 'five', 'axis2'])
+        scores = node('Slice', [raw, 'five', 'end', 'axis2'])
+        scores = node('Mul', [scores, objectness])
+        scores = node('Transpose', [scores], perm=[0, 2, 1])
+    else:
+        raise ValueError(f"Unknown layout {layout}")
+    boxes = node('MatMul', [boxes, 'xyxy'])
+
+    # With a single class (the moose model) agnostic and per-class NMS are the same
+    agnostic = agnostic and classes != 1
+    if agnostic:
+        # One score row with the best class, TopK yields the max and its class id in one pass
+        nms_scores = node('TopK', [scores, 'one'], [prefix + 'best_score', prefix + 'best_class'], axis=1)
+        class_ids = prefix + 'best_class'
+    else:
+        nms_scores = scores
+    # A padding box outside the image with score 1 is always selected, so the output is never empty (OpenCV's
+    # dnn fails on empty tensors). It never overlaps a real box, and its output score is -1 so it is filtered.
+    rows = 1 if agnostic else classes
+    if rows is None:
+        raise ValueError("Per-class NMS needs a static number of classes")
+    consts['pad_pass'] = np.ones((1, rows, 1), np.float32)
+    consts['pad_fail'] = -np.ones((1, rows, 1), np.float32)
+    boxes = node('Concat', [boxes, 'pad_box'], axis=1)
+    output_scores = node('Concat', [nms_scores, 'pad_fail'], axis=2)
+    nms_scores = node('Concat', [nms_scores, 'pad_pass'], axis=2)
+    if agnostic:
+        class_ids = node('Concat', [class_ids, 'pad_class'], axis=2)
+    selected = node('NonMaxSuppression', [boxes, nms_scores, 'max_boxes', 'iou', 'conf'])
+
+    def unsqueeze(x):
+        # Axes became an input in opset 13
+        if opset.version >= 13:
+            return node('Unsqueeze', [x, 'axis1'])
+        return node('Unsqueeze', [x], axes=[1])
+
+    # selected rows are [batch, class, box], indexing (1, classes, N) scores directly
+    score = unsqueeze(node('GatherND', [output_scores, selected]))
+    batch_box = node('Gather', [selected, 'box_cols'], axis=1)
+    box = node('GatherND', [boxes, batch_box])
+    if agnostic:
+        class_id = unsqueeze(node('GatherND', [class_ids, selected]))
+    else:
+        class_id = node('Gather', [selected, 'axis1'], axis=1)
+    batch = node('Gather', [selected, 'zero'], axis=1)
+
+    batch = node('Cast', [batch], to=TensorProto.FLOAT)
+    class_id = node('Cast', [class_id], to=TensorProto.FLOAT)
+    node('Concat', [batch, box, class_id, score], ['detections'], axis=1)
+
+    graph.initializer.extend(numpy_helper.from_array(consts[name], prefix + name) for name in sorted(used))
+    graph.node.extend(nodes)
+    del graph.output[:]
+    graph.output.append(helper.make_tensor_value_info('detections', TensorProto.FLOAT, ['num_detections', 7]))
+
+    metadata = {'postprocess': 'nms', 'conf_thres': str(conf_thres), 'iou_thres': str(iou_thres),
+                'top_k': str(top_k), 'agnostic': str(agnostic)}
+    existing = {prop.key: prop for prop in model.metadata_props}
+    for key, value in metadata.items():
+        if key in existing:
+            existing[key].value = value
+        else:
+            model.metadata_props.append(onnx.StringStringEntryProto(key=key, value=value))
+    onnx.checker.check_model(model)
+    return model
+
+
+def python_postprocess(output, conf_thres, iou_thres, top_k=300):
+    """
+    Vectorized version of the Python YOLOv8 postprocess, the baseline the fused graph is benchmarked against.
+
+    Returns:
+        numpy.ndarray: (K, 7) rows like the fused 'detections' output.
+    """
+    import cv2
+
+    predictions = output[0].T
+    scores = predictions[:, 4:]
+    class_ids = scores.argmax(axis=1)
+    best = scores[np.arange(len(scores)), class_ids]
+    keep = best >= conf_thres
+    predictions, best, class_ids = predictions[keep], best[keep], class_ids[keep]
+    boxes = predictions[:, :4] @ CXCYWH_TO_XYXY
+    xywh = np.concatenate([boxes[:, :2], predictions[:, 2:4]], axis=1)
+    # NMSBoxes' own top_k cuts candidates before suppression, the graph limits the kept boxes instead
+    indices = np.asarray(cv2.dnn.NMSBoxes(xywh.tolist(), best.tolist(), conf_thres, iou_thres),
+                         np.int64).reshape(-1)[:top_k]
+    return np.concatenate([np.zeros((len(indices), 1), np.float32), boxes[indices],
+                           class_ids[indices, None].astype(np.float32), best[indices, None]], axis=1)
@@ -0,0 +1,93 @@
+"""
+Prepends image normalization to a YOLO model so it takes frames as OpenCV delivers them.
+
+The new input is (1, height, width, 3) uint8 BGR, a quarter of the bytes of the float NCHW tensor. The graph
+transposes to NCHW, swaps the channels to RGB, casts and scales by 1/255. When the image input feeds a single
+Conv with constant weights, the channel swap and the scale are folded into those weights, leaving only the
+transpose and the cast. Resizing to the model input size stays with the caller. The model metadata gets
+preprocess='bgr_uint8_nhwc'.
+"""
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+PREPROCESS = 'bgr_uint8_nhwc'
+
+
+def _fold_into_conv(graph, input_name):
+    """Reverses the input channels of the first Conv and scales its weights, returns False when not possible."""
+    consumers = [node for node in graph.node if input_name in node.input]
+    if len(consumers) != 1 or consumers[0].op_type != 'Conv' or consumers[0].input[0] != input_name:
+        return False
+    conv = consumers[0]
+    # Grouped convolutions mix channels per group, reversing them would change the result
+    if any(attr.name == 'group' and attr.i != 1 for attr in conv.attribute):
+        return False
+    initializers = {init.name: init for init in graph.initializer}
+    weight = initializers.get(conv.input[1])
+    if weight is None or any(conv.input[1] in node.input for node in graph.node if node is not conv):
+        return False
+    values = numpy_helper.to_array(weight)
+    if values.ndim != 4 or values.shape[1] != 3:
+        return False
+    # Conv(x_bgr / 255, W) == Conv(x_rgb, W[:, ::-1] / 255) because the convolution is linear in its input
+    folded = (values[:, ::-1] / 255).astype(values.dtype)
+    weight.CopyFrom(numpy_helper.from_array(folded, weight.name))
+    return True
+
+
+def add_preprocessing(model, input_name='frame', fold=True):
+    """
+    Returns a copy of model that takes uint8 BGR NHWC frames at the model input size.
+
+    Args:
+        model: onnx.ModelProto with a float (1, 3, height, width) RGB input scaled to 0-1
+        input_name: Name of the new input
+        fold: Fold the channel swap and scale into the first Conv when possible
+
+    Returns:
+        onnx.ModelProto
+    """
+    model = onnx.ModelProto.FromString(model.SerializeToString())
+    graph = model.graph
+    initializers = {init.name for init in graph.initializer}
+    inputs = [i for i in graph.input if i.name not in initializers]
+    if len(inputs) != 1:
+        raise ValueError("Expected a model with a single image input")
+    old = inputs[0]
+    dims = [d.dim_value if d.HasField('dim_value') else d.dim_param for d in old.type.tensor_type.shape.dim]
+    if len(dims) != 4 or dims[1] != 3 or old.type.tensor_type.elem_type != TensorProto.FLOAT:
+        raise ValueError(f"Expected a float (N, 3, H, W) input, got {dims}")
+    batch, _, height, width = dims
+
+    prefix = 'pre_'
+    nodes = []
+    if fold and _fold_into_conv(graph, old.name):
+        nodes += [helper.make_node('Transpose', [input_name], [prefix + 'nchw'], perm=[0, 3, 1, 2]),
+                  helper.make_node('Cast', [prefix + 'nchw'], [old.name], to=TensorProto.FLOAT)]
+    else:
+        graph.initializer.extend([numpy_helper.from_array(np.array([2, 1, 0], np.int64), prefix + 'bgr_to_rgb'),
+                                  numpy_helper.from_array(np.array(1 / 255, np.float32), prefix + 'scale')])
+        nodes += [
+            # Transpose and swap on uint8, before the tensor grows four times; in NCHW the swap copies planes
+            helper.make_node('Transpose', [input_name], [prefix + 'nchw'], perm=[0, 3, 1, 2]),
+            helper.make_node('Gather', [prefix + 'nchw', prefix + 'bgr_to_rgb'], [prefix + 'rgb'], axis=1),
+            helper.make_node('Cast', [prefix + 'rgb'], [prefix + 'float'], to=TensorProto.FLOAT),
+            helper.make_node('Mul', [prefix + 'float', prefix + 'scale'], [old.name]),
+        ]
+
+    # The old input name becomes the output of the preprocessing, nothing downstream changes
+    position = list(graph.input).index(old)
+    new_input = helper.make_tensor_value_info(input_name, TensorProto.UINT8, [batch, height, width, 3])
+    graph.input.remove(old)
+    graph.input.insert(position, new_input)
+    for i, node in enumerate(nodes):
+        graph.node.insert(i, node)
+
+    existing = {prop.key: prop for prop in model.metadata_props}
+    if 'preprocess' in existing:
+        existing['preprocess'].value = PREPROCESS
+    else:
+        model.metadata_props.append(onnx.StringStringEntryProto(key='preprocess', value=PREPROCESS))
+    onnx.checker.check_model(model)
+    return model
@@ -0,0 +1,276 @@
+"""
+Per-operator timings of a model on ONNX Runtime and on OpenCV's dnn module.
+
+ONNX Runtime writes a Chrome trace when profiling is enabled, every node execution is an event with its op type.
+cv2.dnn keeps the timings of the last forward pass, DnnProfiler adds them up over passes. Both become a
+ProfileReport of milliseconds per run and node, with totals by op type; dnn layer types are mapped to ONNX op
+names so reports of the two backends and of different model variants line up.
+
+    python profiling.py models/yolov7-tiny_480x640.onnx --backend both --image moose-1.jpg
+    python profiling.py --compare fp32.json int8.json
+"""
+import json
+import os
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+# cv2.dnn layer types under their ONNX op names, types that do not map one to one keep their dnn name
+DNN_TYPES = {
+    'Convolution': 'Conv',
+    'Deconvolution': 'ConvTranspose',
+    'InnerProduct': 'Gemm',
+    'ReLU': 'Relu',
+    'Sigmoid': 'Sigmoid',
+    'Swish': 'Swish',
+    'Mish': 'Mish',
+    'Permute': 'Transpose',
+    'Reshape': 'Reshape',
+    'Flatten': 'Flatten',
+    'Concat': 'Concat',
+    'Slice': 'Slice',
+    'Resize': 'Resize',
+    'Softmax': 'Softmax',
+    'Gather': 'Gather',
+    'BatchNorm': 'BatchNormalization',
+    'Identity': 'Identity',
+}
+
+
+def dnn_op_type(layer_type):
+    """Returns the ONNX op name of a cv2.dnn layer type, OpenCV 5 appends a 2 to the types of its new engine."""
+    if layer_type.endswith('2') and layer_type not in DNN_TYPES:
+        layer_type = layer_type[:-1]
+    return DNN_TYPES.get(layer_type, layer_type)
+
+
+class ProfileReport:
+    def __init__(self, rows, runs, backend, model):
+        """
+        Timings of one model on one backend.
+
+        Args:
+            rows: List of dicts with name, op_type and ms, the total over all runs
+            runs: Number of profiled runs
+            backend: 'onnxruntime' or 'dnn'
+            model: Model file
+        """
+        self.rows = rows
+        self.runs = runs
+        self.backend = backend
+        self.model = model
+
+    @property
+    def total_ms(self):
+        """Milliseconds per run over all nodes."""
+        return sum(row['ms'] for row in self.rows) / max(self.runs, 1)
+
+    def ranked(self):
+        """Returns (name, op_type, ms per run) of the nodes, slowest first."""
+        runs = max(self.runs, 1)
+        return sorted(((row['name'], row['op_type'], row['ms'] / runs) for row in self.rows),
+                      key=lambda row: -row[2])
+
+    def by_type(self):
+        """Returns {op_type: (ms per run, node count)}, slowest first."""
+        totals = defaultdict(float)
+        counts = defaultdict(int)
+        for row in self.rows:
+            totals[row['op_type']] += row['ms'] / max(self.runs, 1)
+            counts[row['op_type']] += 1
+        return {op: (totals[op], counts[op]) for op in sorted(totals, key=lambda op: -totals[op])}
+
+    def format(self, top=20):
+        """Returns the ranked nodes and the op type totals as a text table."""
+        total = self.total_ms or 1.0
+        lines = [f"{os.path.basename(self.model)} on {self.backend}: {self.total_ms:.2f} ms per run "
+                 f"over {len(self.rows)} nodes, {self.runs} runs", "",
+                 f"{'node':<48} {'op':<20} {'ms':>8} {'%':>6}"]
+        for name, op_type, ms in self.ranked()[:top]:
+            lines.append(f"{name[-48:]:<48} {op_type:<20} {ms:>8.3f} {ms / total:>6.1%}")
+        lines += ["", f"{'op type':<20} {'nodes':>6} {'ms':>8} {'%':>6}"]
+        for op_type, (ms, count) in self.by_type().items():
+            lines.append(f"{op_type:<20} {count:>6} {ms:>8.3f} {ms / total:>6.1%}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {'model': self.model, 'backend': self.backend, 'runs': self.runs, 'rows': self.rows}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['rows'], data['runs'], data['backend'], data['model'])
+
+
+def compare(reports):
+    """Returns a text table of milliseconds per run by op type, one column per report."""
+    columns = [report.by_type() for report in reports]
+    op_types = sorted({op for column in columns for op in column},
+                      key=lambda op: -max(column.get(op, (0.0, 0))[0] for column in columns))
+    labels = [f"{os.path.basename(report.model)[:18]}/{report.backend[:4]}" for report in reports]
+    lines = [f"{'op type':<20}" + "".join(f" {label:>24}" for label in labels)]
+    for op in op_types:
+        lines.append(f"{op:<20}" + "".join(f" {column.get(op, (0.0, 0))[0]:>24.3f}" for column in columns))
+    lines.append(f"{'total':<20}" + "".join(f" {report.total_ms:>24.3f}" for report in reports))
+    return "\n".join(lines)
+
+
+def parse_ort_trace(path, skip_runs=0):
+    """
+    Adds up the node events of an ONNX Runtime profile.
+
+    Args:
+        path: JSON trace returned by InferenceSession.end_profiling()
+        skip_runs: Leading runs to leave out, e.g. warm-up
+
+    Returns:
+        tuple: (rows, runs) like ProfileReport takes.
+    """
+    with open(path) as f:
+        events = json.load(f)
+    runs = sorted((event for event in events if event.get('name') == 'model_run'), key=lambda event: event['ts'])
+    # Node events of skipped runs start before the end of the last skipped run
+    start = runs[skip_runs - 1]['ts'] + runs[skip_runs - 1]['dur'] if 0 < skip_runs <= len(runs) else -1
+    totals = {}
+    for event in events:
+        if event.get('cat') != 'Node' or not event.get('name', '').endswith('_kernel_time') or event['ts'] < start:
+            continue
+        name = event['name'][:-len('_kernel_time')]
+        row = totals.setdefault(name, {'name': name, 'op_type': event.get('args', {}).get('op_name', '?'),
+                                       'ms': 0.0})
+        row['ms'] += event['dur'] / 1000
+    return list(totals.values()), max(len(runs) - skip_runs, 0)
+
+
+def profile_options(options=None, prefix='ort_profile'):
+    """Returns SessionOptions with ONNX Runtime's profiler on, the trace is written on end_profiling()."""
+    from startup import ort
+
+    options = options or ort.SessionOptions()
+    options.enable_profiling = True
+    options.profile_file_prefix = prefix
+    return options
+
+
+def ort_report(session, model, skip_runs=0):
+    """Ends profiling of a session created with profile_options() and returns its ProfileReport."""
+    path = session.end_profiling()
+    try:
+        rows, runs = parse_ort_trace(path, skip_runs)
+    finally:
+        os.remove(path)
+    return ProfileReport(rows, runs, 'onnxruntime', model)
+
+
+class DnnProfiler:
+    def __init__(self, net, model=''):
+        """
+        Adds up the per-layer timings of a cv2.dnn network, call add() after every forward().
+
+        Args:
+            net: cv2.dnn.Net
+            model: Model file, for the report
+        """
+        self.net = net
+        self.model = model
+        self.names = net.getLayerNames()
+        # Layer ids are 1-based in OpenCV 4 where id 0 is the input and 0-based in OpenCV 5, ask by name
+        self.types = [dnn_op_type(net.getLayer(net.getLayerId(name)).type) for name in self.names]
+        self.ticks = np.zeros(len(self.names), np.float64)
+        self.runs = 0
+
+    def add(self):
+        _, timings = self.net.getPerfProfile()
+        self.ticks[:len(timings)] += np.asarray(timings, np.float64).reshape(-1)
+        self.runs += 1
+
+    def report(self):
+        to_ms = 1000 / cv2.getTickFrequency()
+        rows = [{'name': name, 'op_type': op_type, 'ms': float(ticks * to_ms)}
+                for name, op_type, ticks in zip(self.names, self.types, self.ticks) if ticks > 0]
+        return ProfileReport(rows, self.runs, 'dnn', self.model)
+
+
+def _model_input(model_path, image_path):
+    """Returns the model input for an image or zeros, and the input shape, from the model metadata."""
+    from model_meta import load_meta
+
+    meta = load_meta(model_path, None)
+    height, width = meta.input_shape or (640, 640)
+    raw = meta.preprocess == 'bgr_uint8_nhwc'
+    if image_path is None:
+        return np.zeros((1, height, width, 3) if raw else (1, 3, height, width), np.uint8 if raw else np.float32)
+    image = cv2.imread(image_path)
+    if raw:
+        return cv2.resize(image, (width, height))[np.newaxis]
+    return cv2.dnn.blobFromImage(image, 1 / 255, (width, height), swapRB=True)
+
+
+def profile_onnxruntime(model_path, runs=20, warmup=3, image_path=None, providers=None):
+    """Profiles runs inferences after warmup on ONNX Runtime and returns the ProfileReport."""
+    import tempfile
+
+    from startup import create_session
+
+    blob = _model_input(model_path, image_path)
+    prefix = os.path.join(tempfile.gettempdir(), 'ort_profile')
+    session = create_session(model_path, providers, cache_dir=None, options=profile_options(prefix=prefix))
+    feeds = {session.get_inputs()[0].name: blob}
+    for _ in range(warmup + runs):
+        session.run(None, feeds)
+    return ort_report(session, model_path, skip_runs=warmup)
+
+
+def profile_dnn(model_path, runs=20, warmup=3, image_path=None):
+    """Profiles runs inferences after warmup on cv2.dnn and returns the ProfileReport."""
+    blob = _model_input(model_path, image_path)
+    net = cv2.dnn.readNetFromONNX(model_path)
+    outputs = net.getUnconnectedOutLayersNames()
+    profiler = DnnProfiler(net, model_path)
+    for i in range(warmup + runs):
+        net.setInput(blob)
+        net.forward(outputs)
+        if i >= warmup:
+            profiler.add()
+    return profiler.report()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", nargs="?", help="ONNX model to profile")
+    parser.add_argument("--backend", choices=["onnxruntime", "dnn", "both"], default="onnxruntime")
+    parser.add_argument("--image", default=None, help="Input image, zeros when not given")
+    parser.add_argument("--runs", type=int, default=20, help="Profiled inferences")
+    parser.add_argument("--warmup", type=int, default=3, help="Inferences before profiling")
+    parser.add_argument("--top", type=int, default=20, help="Slowest nodes to list")
+    parser.add_argument("--json", default=None, help="Write the report here, with the backend appended for both")
+    parser.add_argument("--compare", nargs="+", default=None, help="Saved reports to compare by op type")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare([ProfileReport.load(path) for path in args.compare]))
+    elif args.model:
+        backends = ["onnxruntime", "dnn"] if args.backend == "both" else [args.backend]
+        reports = []
+        for backend in backends:
+            if backend == "onnxruntime":
+                report = profile_onnxruntime(args.model, args.runs, args.warmup, args.image)
+            else:
+                report = profile_dnn(args.model, args.runs, args.warmup, args.image)
+            print(report.format(args.top), end="\n\n")
+            if args.json:
+                root, ext = os.path.splitext(args.json)
+                report.save(f"{root}_{backend}{ext or '.json'}" if len(backends) > 1 else args.json)
+            reports.append(report)
+        if len(reports) > 1:
+            print(compare(reports))
+    else:
+        parser.error("a model or --compare is required")
@@ -1,27 +1,25 @@
-import av
-import numpy as np
-import cv2
-
-# Open the camera using PyAV
-camera_index = 0
-container = av.open("video=UVC Camera", format="dshow")  # Use appropriate device path for your platform
+import time
 
-# Set video stream
-# stream = container.streams.video[0]
-# stream.pix_fmt = 'gray16le'  # 16-bit grayscale format (adjust if necessary)
+import cv2
 
-for frame in container.decode(video=0):
-    # Check the format of the frame
-    print(f"Frame: {frame} format: {frame.format.name}")
+from av_capture import AVCaptureSource
 
-    # Assuming it's grayscale (you can check its format and handle accordingly)
-    if frame.format.name == 'gray16be':  # 14-bit grayscale might be handled as 16-bit for compatibility
-        print("Grayscale frame received!")
+# Open the first camera of this platform (v4l2 on Linux, dshow on Windows) in its best raw format
+source = AVCaptureSource()
+print(f"Pixel format: {source.pixel_format}")
 
-        # Process the frame (you can access pixel data as a NumPy array if needed)
-        frame_data = frame.to_ndarray()
+last_report = time.perf_counter()
+for frame, timestamp in source:
+    # gray16 frames carry the 14 bit sensor data in a uint16 array
+    if frame.dtype == 'uint16':
+        frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    cv2.imshow('Camera', frame)
+    if cv2.waitKey(1) == ord('q'):
+        break
 
-        # Example: Print shape of frame data
-        print(frame_data.shape)
+    if time.perf_counter() - last_report > 5:
+        print(source.metrics())
+        last_report = time.perf_counter()
 
+source.release()
 cv2.destroyAllWindows()
@@ -0,0 +1,277 @@
+"""
+Keeps the per-frame latency of the detection loop under a target while the Pi heats up and throttles.
+
+QualityController walks a ladder of configurations, best first: it steps down when the smoothed latency is over
+the target or the CPU is hot, and back up when there is headroom again. AdaptiveDetector applies the current
+level to the detector, and the loop sleeps controller.delay(elapsed) instead of a fixed time.
+"""
+import logging
+import os
+import time
+from collections import deque
+from typing import NamedTuple
+
+import cv2
+
+from model_registry import ModelRegistry
+from startup import lazy_import
+
+psutil = lazy_import('psutil')
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Level(NamedTuple):
+    """
+    One configuration of the ladder.
+
+    The models have a static input shape, so the input size is chosen by the model variant, e.g.
+    yolov7-tiny_480x640.onnx and yolov7-tiny_256x320.onnx.
+    """
+    name: str
+    model: str
+    fps: float
+    threads: int
+
+
+def _read_number(path):
+    try:
+        with open(path) as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SystemSensor:
+    def __init__(self, root='/sys'):
+        """
+        Reads CPU temperature and frequency from sysfs, through psutil where sysfs has none.
+
+        Args:
+            root: sysfs mount point, a directory with the same layout stands in for it in tests
+        """
+        self.temp_path = os.path.join(root, 'class/thermal/thermal_zone0/temp')
+        self.freq_path = os.path.join(root, 'devices/system/cpu/cpu0/cpufreq/scaling_cur_freq')
+        self.max_freq_path = os.path.join(root, 'devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq')
+
+    def _psutil(self):
+        temp = freq = max_freq = None
+        try:
+            sensors = psutil.sensors_temperatures()
+            readings = sensors.get('cpu_thermal') or sensors.get('coretemp') or next(iter(sensors.values()), [])
+            if readings:
+                temp = readings[0].current
+            cpu_freq = psutil.cpu_freq()
+            if cpu_freq:
+                freq, max_freq = cpu_freq.current, cpu_freq.max or None
+        except (ImportError, AttributeError, OSError):
+            pass
+        return temp, freq, max_freq
+
+    def read(self):
+        """
+        Returns:
+            dict: temp_c, freq_mhz and max_freq_mhz, None where unknown.
+        """
+        temp = _read_number(self.temp_path)
+        freq = _read_number(self.freq_path)
+        max_freq = _read_number(self.max_freq_path)
+        if temp is None and freq is None:
+            temp, freq, max_freq = self._psutil()
+        else:
+            # sysfs reports millidegrees and kHz
+            temp = temp / 1000 if temp is not None else None
+            freq = freq / 1000 if freq is not None else None
+            max_freq = max_freq / 1000 if max_freq is not None else None
+        return {'temp_c': temp, 'freq_mhz': freq, 'max_freq_mhz': max_freq}
+
+
+class QualityController:
+    def __init__(self, ladder, target_ms, sensor=None, alpha=0.2, headroom=0.6, hot_c=80.0, cool_c=72.0,
+                 throttle_ratio=0.8, min_frames=10, backoff=10.0, max_backoff=300.0, sense_interval=1.0,
+                 clock=time.monotonic):
+        """
+        Chooses a level of the ladder from the measured latency and the CPU state.
+
+        Args:
+            ladder: Levels, best quality first
+            target_ms: End-to-end latency target per frame
+            sensor: Object with read() like SystemSensor, None to ignore temperature and frequency
+            alpha: Weight of a new sample in the exponential moving average of the latency
+            headroom: Step up when the latency is below this fraction of the target
+            hot_c: Step down at this temperature, even when the latency is fine
+            cool_c: Step up only below this temperature
+            throttle_ratio: CPU frequency below this fraction of the maximum counts as throttled, no step up
+            min_frames: Frames at a level before the next decision, so the average reflects the level
+            backoff: Seconds after a step down before trying to step up again
+            max_backoff: Upper bound of the backoff, which doubles whenever a step up has to be undone
+            sense_interval: Seconds between sensor reads
+            clock: Time source in seconds
+        """
+        if not ladder:
+            raise ValueError("The ladder needs at least one level")
+        self.ladder = list(ladder)
+        self.target = target_ms / 1000
+        self.sensor = sensor
+        self.alpha = alpha
+        self.headroom = headroom
+        self.hot_c = hot_c
+        self.cool_c = cool_c
+        self.throttle_ratio = throttle_ratio
+        self.min_frames = min_frames
+        self.backoff = backoff
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.sense_interval = sense_interval
+        self.clock = clock
+
+        self.index = 0
+        self.latency = None
+        self.reading = {'temp_c': None, 'freq_mhz': None, 'max_freq_mhz': None}
+        self._last_sense = None
+        self._frames_at_level = 0
+        self._stepped_down = None
+        self._stepped_up = None
+        self.frames = 0
+        self.steps_down = 0
+        self.steps_up = 0
+        self.decisions = deque(maxlen=100)
+
+    @property
+    def level(self):
+        return self.ladder[self.index]
+
+    def _sense(self, now):
+        if self.sensor is not None and (self._last_sense is None or now - self._last_sense >= self.sense_interval):
+            self.reading = self.sensor.read()
+            self._last_sense = now
+
+    def _throttled(self):
+        freq, max_freq = self.reading['freq_mhz'], self.reading['max_freq_mhz']
+        return freq is not None and max_freq is not None and freq < self.throttle_ratio * max_freq
+
+    def _step(self, index, reason, now):
+        old = self.level
+        if index > self.index:
+            self.steps_down += 1
+            # A step up that is undone within the backoff was too early, wait longer next time
+            if self._stepped_up is not None and now - self._stepped_up < self.backoff:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            self._stepped_down = now
+        else:
+            self.steps_up += 1
+            self._stepped_up = now
+        self.index = index
+        self._frames_at_level = 0
+        decision = {'time': now, 'from': old.name, 'to': self.level.name, 'reason': reason,
+                    'latency_ms': self.latency * 1000, **self.reading}
+        self.decisions.append(decision)
+        _LOGGER.info("quality %s -> %s reason=%s latency_ms=%.1f temp_c=%s freq_mhz=%s backoff_s=%.0f",
+                     old.name, self.level.name, reason, self.latency * 1000, self.reading['temp_c'],
+                     self.reading['freq_mhz'], self.backoff)
+
+    def update(self, latency):
+        """
+        Adds the end-to-end latency of a frame in seconds.
+
+        Returns:
+            Level: The level for the next frame.
+        """
+        now = self.clock()
+        self.frames += 1
+        self._frames_at_level += 1
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self._sense(now)
+        if self._frames_at_level < self.min_frames:
+            return self.level
+
+        temp = self.reading['temp_c']
+        hot = temp is not None and temp >= self.hot_c
+        if self.index < len(self.ladder) - 1 and (self.latency > self.target or hot):
+            self._step(self.index + 1, 'hot' if hot else 'latency', now)
+        elif (self.index > 0 and self.latency < self.headroom * self.target
+              and (temp is None or temp < self.cool_c) and not self._throttled()
+              and (self._stepped_down is None or now - self._stepped_down >= self.backoff)):
+            self._step(self.index - 1, 'headroom', now)
+        elif self._stepped_up is not None and now - self._stepped_up >= self.backoff:
+            # The level held, the next failure starts from the initial backoff
+            self.backoff = self.min_backoff
+        return self.level
+
+    def delay(self, elapsed):
+        """Seconds to sleep after a frame that took elapsed seconds, to run at the frame rate of the level."""
+        return max(0.0, 1 / self.level.fps - elapsed)
+
+    def metrics(self):
+        """Returns the current level, the smoothed latency and the decision counts."""
+        return {
+            'level': self.level.name,
+            'latency_ms': self.latency * 1000 if self.latency is not None else None,
+            'target_ms': self.target * 1000,
+            'frames': self.frames,
+            'steps_down': self.steps_down,
+            'steps_up': self.steps_up,
+            'backoff_s': self.backoff,
+            **self.reading,
+        }
+
+
+class AdaptiveDetector:
+    def __init__(self, controller, make_detector):
+        """
+        Detector that follows the level of a QualityController.
+
+        The detector of a new model is built and warmed up in the background by a model_registry.ModelRegistry,
+        the frames in between still run at the previous level and their latency is not passed to the controller.
+
+        Args:
+            controller: QualityController
+            make_detector: Callable building a YOLOv7-style detector from a model path, called once per model
+        """
+        self.controller = controller
+        self.registry = ModelRegistry(make_detector, capacity=len({level.model for level in controller.ladder}))
+        self.level = None
+        # Level whose model is still loading, and the load
+        self._pending = None
+        self._loading = None
+        self._apply(controller.level, wait=True)
+
+    def _apply(self, level, wait=False):
+        self._loading = self.registry.switch(level.model, wait=wait)
+        self._pending = level
+        self._finish_switch()
+
+    def _finish_switch(self):
+        if self.registry.model == self._pending.model:
+            # Threads of OpenCV's dnn and of the resizing, applies to the next call
+            cv2.setNumThreads(self._pending.threads)
+            self.level, self._pending = self._pending, None
+        elif self._loading is None or self._loading.done():
+            # The load failed, the previous level stays and the next update asks the registry again
+            self._pending = None
+
+    @property
+    def detector(self):
+        return self.registry.detector
+
+    def __call__(self, image):
+        return self.registry(image)
+
+    def update(self, latency):
+        """
+        Passes the frame latency to the controller and switches the detector when the level changes.
+
+        Returns:
+            Level: The level the detector runs at, the previous one while the model of a new level loads.
+        """
+        if self._pending is not None:
+            # The frame may have run on either model, only frames of the level's own model go to the controller
+            self._finish_switch()
+            return self.level
+        level = self.controller.update(latency)
+        if level != self.level:
+            self._apply(level)
+        return self.level
+
+    def draw_detections(self, image, *args, **kwargs):
+        return self.registry.draw_detections(image, *args, **kwargs)
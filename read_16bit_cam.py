@@ -1,31 +1,45 @@
+import sys
+
 import cv2
 import numpy as np
 
-# Open the camera using the appropriate backend
-cap = cv2.VideoCapture(0)
+from agc import AutoGainControl
+from thermal_capture import RawFrameFile, ThermalCapture
+
+WIDTH, HEIGHT = 320, 512
 
-cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'GREY'))
+# Open the camera in raw 16 bit mode, or replay a raw dump given on the command line
+if len(sys.argv) > 1:
+    cap = None
+    frames = iter(RawFrameFile(sys.argv[1], WIDTH, HEIGHT))
 
-# Check if the camera opened successfully
-if not cap.isOpened():
-    print("Cannot open camera")
-    exit()
+    def read_frame():
+        frame16 = next(frames, None)
+        return frame16 is not None, frame16
+else:
+    try:
+        cap = ThermalCapture(0, WIDTH, HEIGHT)
+    except IOError:
+        print("Cannot open camera")
+        exit()
+    read_frame = cap.read
 
+agc = AutoGainControl(bit_depth=14)
+display = np.empty((HEIGHT, WIDTH), np.uint8)
 
 # Read and display frames from the camera
 while True:
-    ret, raw_frame = cap.read()
+    ret, frame16 = read_frame()
     if not ret:
         print("Cannot receive frame. Exiting ...")
         break
-    
-    # split_frame = raw_frame.reshape(512, 320, 2)
-    
-    # cv2.imshow('Camera Feed', np.hstack((split_frame[:,:,0], split_frame[:,:,1])))
+
+    cv2.imshow('Camera Feed', agc(frame16, out=display))
 
     if cv2.waitKey(1) == ord('q'):
         break
 
 # Release the capture and close windows
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+if cap is not None:
+    cap.release()
+cv2.destroyAllWindows()
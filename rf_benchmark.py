@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from rpi_rf import RFDevice, SimulatedChip
+from rpi_rf.rpi_rf import PROTOCOLS, encode_code
+
+TX_GPIO = 17
+RX_GPIO = 27
+
+
+def bench_encode(proto, iterations):
+    """Returns encoded codes per second without and with the encode cache."""
+    # A handful of channel codes sent over and over, like keep-alive traffic
+    pool = [random.getrandbits(24) for _ in range(16)]
+    codes = [pool[i % len(pool)] for i in range(iterations)]
+    results = []
+    for encode in (encode_code.__wrapped__, encode_code):
+        start = time.perf_counter()
+        for code in codes:
+            encode(code, proto, 32)
+        results.append(iterations / (time.perf_counter() - start))
+    return results
+
+
+def bench_timing(proto, code=1234, repeat=2):
+    """
+    Sends a code over a realtime simulated chip and returns the TimingError the TX engine achieved.
+    """
+    chip = SimulatedChip(realtime=True)
+    tx = RFDevice(TX_GPIO, tx_repeat=repeat, backend=chip)
+    tx.enable_tx()
+    tx.tx_code(code, proto, PROTOCOLS[proto].pulselength)
+    tx.cleanup()
+    return tx.tx_timing
+
+
+def bench_decode(proto, trials, jitter_us, noise_rate, seed=0):
+    """
+    Loops TX back to RX on a virtual clock chip and decodes random codes.
+
+    Returns:
+        float: Fraction of codes decoded with the right value.
+    """
+    rng = random.Random(seed)
+    chip = SimulatedChip(realtime=False, seed=seed)
+    tx = RFDevice(TX_GPIO, backend=chip)
+    rx = RFDevice(RX_GPIO, backend=chip)
+    tx.enable_tx()
+    rx.enable_rx()
+    chip.connect(TX_GPIO, RX_GPIO, jitter_us=jitter_us, noise_rate=noise_rate)
+
+    decoded = 0
+    for _ in range(trials):
+        code = rng.randrange(1, 1 << 24)
+        rx.rx_code = None
+        # tx_code keeps the previous pulselength unless one is given
+        tx.tx_code(code, proto, PROTOCOLS[proto].pulselength)
+        # Idle gap between transmissions
+        chip.sleep(0.1)
+        if rx.rx_code == code:
+            decoded += 1
+    tx.cleanup()
+    rx.cleanup()
+    return decoded / trials
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=50, help="Codes sent per protocol for the decode test")
+    parser.add_argument("--jitter", type=float, default=20, help="Edge jitter in microseconds")
+    parser.add_argument("--noise", type=float, default=0.0, help="Glitch probability per edge")
+    parser.add_argument("--encode-iterations", type=int, default=10000, help="Codes encoded per protocol")
+    parser.add_argument("--no-timing", action="store_true", help="Skip the realtime timing test")
+    args = parser.parse_args()
+
+    print(f"{'proto':>5} {'encode/s':>10} {'cached/s':>10} {'err mean us':>12} {'err max us':>11} {'decoded':>8}")
+    for proto in range(1, len(PROTOCOLS)):
+        uncached, cached = bench_encode(proto, args.encode_iterations)
+        if args.no_timing:
+            err_mean, err_max = float("nan"), float("nan")
+        else:
+            err_mean, err_max, _ = bench_timing(proto)
+        success = bench_decode(proto, args.trials, args.jitter, args.noise)
+        print(f"{proto:>5} {uncached:>10.0f} {cached:>10.0f} {err_mean:>12.1f} {err_max:>11.1f} {success:>8.0%}")
@@ -0,0 +1,304 @@
+import cv2
+import numpy as np
+
+from model_meta import load_yaml
+from yolov7.utils import nms
+
+EMPTY = (np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int))
+
+
+def _overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_rects(rects):
+    """Merges overlapping xyxy rectangles until none overlap, so no pixel is run through the detector twice."""
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                if _overlap(rects[i], rects[j]):
+                    a, b = rects[i], rects.pop(j)
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(r) for r in rects]
+
+
+class CameraROI:
+    def __init__(self, regions, pad=16):
+        """
+        Parts of a fixed camera view that matter, e.g. a trail or a road edge.
+
+        Args:
+            regions: List of {'rect': [x1, y1, x2, y2]} or {'polygon': [[x, y], ...]} in frame pixels
+            pad: Context in pixels added around every region when cropping
+        """
+        self.polygons = []
+        for region in regions:
+            if 'rect' in region:
+                x1, y1, x2, y2 = region['rect']
+                self.polygons.append(np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], np.int32))
+            elif 'polygon' in region:
+                self.polygons.append(np.array(region['polygon'], np.int32).reshape(-1, 2))
+            else:
+                raise ValueError(f"Region needs a 'rect' or a 'polygon': {region}")
+        if not self.polygons:
+            raise ValueError("No regions given")
+        self.pad = pad
+        self._mask = None
+        self._crops = None
+
+    def _prepare(self, height, width):
+        if self._mask is not None and self._mask.shape == (height, width):
+            return
+        self._mask = np.zeros((height, width), np.uint8)
+        cv2.fillPoly(self._mask, self.polygons, 1)
+        rects = []
+        for polygon in self.polygons:
+            x, y, w, h = cv2.boundingRect(polygon)
+            rects.append((max(x - self.pad, 0), max(y - self.pad, 0),
+                          min(x + w + self.pad, width), min(y + h + self.pad, height)))
+        self._crops = merge_rects(rects)
+
+    def crops(self, height, width):
+        """Returns the xyxy rectangles to run the detector on for a frame of this size."""
+        self._prepare(height, width)
+        return self._crops
+
+    def coverage(self, height, width):
+        """Fraction of the frame pixels inside the crops."""
+        return sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in self.crops(height, width)) / (height * width)
+
+    def inside(self, boxes, height, width):
+        """Tells for every xyxy box whether its bottom center, where an animal stands, is inside a region."""
+        self._prepare(height, width)
+        boxes = np.asarray(boxes, np.float32).reshape(-1, 4)
+        x = np.clip(((boxes[:, 0] + boxes[:, 2]) / 2).astype(int), 0, width - 1)
+        y = np.clip(boxes[:, 3].astype(int), 0, height - 1)
+        return self._mask[y, x].astype(bool)
+
+    def filter(self, boxes, scores, class_ids, height, width):
+        """Drops detections outside the regions."""
+        if len(scores) == 0:
+            return EMPTY
+        keep = self.inside(boxes, height, width)
+        return np.asarray(boxes)[keep], np.asarray(scores)[keep], np.asarray(class_ids)[keep]
+
+    def draw(self, image, color=(0, 255, 255)):
+        """Outlines the regions on an image."""
+        cv2.polylines(image, self.polygons, True, color, 2)
+        return image
+
+
+def load_rois(path, pad=16):
+    """
+    Reads per-camera regions from YAML:
+
+        cameras:
+          trail:
+            - rect: [0, 200, 640, 480]
+          road:
+            - polygon: [[0, 300], [400, 250], [640, 300], [640, 480], [0, 480]]
+
+    Returns:
+        dict: Camera name to CameraROI.
+    """
+    cameras = load_yaml(path).get('cameras') or {}
+    return {str(name): CameraROI(regions, pad) for name, regions in cameras.items()}
+
+
+def input_aspect(detector):
+    """Width over height of the model input of a YOLOv7 or ObjectDetector, None when the detector does not say."""
+    width = getattr(detector, 'input_width', None) or getattr(detector, 'input_size', None)
+    height = getattr(detector, 'input_height', None) or getattr(detector, 'input_size', None)
+    return width / height if width and height else None
+
+
+def input_pixels(detector):
+    """Pixels of the model input of a YOLOv7 or ObjectDetector, None when the detector does not say."""
+    width = getattr(detector, 'input_width', None) or getattr(detector, 'input_size', None)
+    height = getattr(detector, 'input_height', None) or getattr(detector, 'input_size', None)
+    return width * height if width and height else None
+
+
+def _padded_size(height, width, aspect):
+    # Smallest size with the aspect ratio that holds height x width
+    if aspect is None:
+        return height, width
+    if width / height > aspect:
+        return int(np.ceil(width / aspect)), width
+    return height, int(np.ceil(height * aspect))
+
+
+def mosaic_layout(sizes, aspect=None):
+    """
+    Places crops in rows, tallest first, with the number of columns that wastes the least area once the mosaic
+    is padded to aspect.
+
+    Args:
+        sizes: (height, width) per crop
+        aspect: Width over height of the model input, None for no padding
+
+    Returns:
+        tuple: (top, left) per crop and the (height, width) of the padded mosaic.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][0])
+    best = None
+    for columns in range(1, len(sizes) + 1):
+        positions = [None] * len(sizes)
+        top = width = 0
+        for row in range(0, len(order), columns):
+            left = 0
+            for i in order[row:row + columns]:
+                positions[i] = (top, left)
+                left += sizes[i][1]
+            width = max(width, left)
+            top += sizes[order[row]][0]
+        padded = _padded_size(top, width, aspect)
+        if best is None or padded[0] * padded[1] < best[1][0] * best[1][1]:
+            best = positions, padded
+    return best
+
+
+def letterbox(image, aspect):
+    """Pads image at the bottom or right to aspect, so resizing it to the model input does not stretch it."""
+    height, width = image.shape[:2]
+    padded = _padded_size(height, width, aspect)
+    if padded == (height, width):
+        return image
+    canvas = np.zeros(padded + image.shape[2:], image.dtype)
+    canvas[:height, :width] = image
+    return canvas
+
+
+class ROIDetector:
+    def __init__(self, detector, roi, mosaic=True):
+        """
+        Runs a YOLOv7-style detector on the ROI crops only and maps the boxes back to frame coordinates.
+
+        Args:
+            detector: Callable returning (boxes, scores, class_ids), e.g. YOLOv7
+            roi: CameraROI of the camera
+            mosaic: Tile all crops into one image and run the detector once; False runs it once per crop, every
+                inference costs the full model input however small the crop is
+
+        YOLOv7 resizes its input to the model size without keeping the aspect ratio, so crops and mosaics are
+        padded to the input aspect ratio first (see input_aspect). A detector that has neither input_width and
+        input_height nor input_size gets them unpadded, and wide or tall crops are stretched.
+        """
+        self.detector = detector
+        self.roi = roi
+        self.mosaic = mosaic
+        self.aspect = input_aspect(detector)
+        self.input_pixels = input_pixels(detector)
+        self.boxes, self.scores, self.class_ids = EMPTY
+        self.inferences = 0
+        self.pixels = 0
+        self.frame_pixels = 0
+
+    def __call__(self, image):
+        return self.detect_objects(image)
+
+    def _detect(self, image):
+        # The network runs on its input size, a detector without one on the image as it is
+        self.inferences += 1
+        self.pixels += self.input_pixels or image.shape[0] * image.shape[1]
+        return self.detector(image)
+
+    def _run(self, image, crops):
+        if not self.mosaic or len(crops) == 1:
+            for x1, y1, x2, y2 in crops:
+                boxes, scores, class_ids = self._detect(letterbox(image[y1:y2, x1:x2], self.aspect))
+                if len(scores):
+                    yield np.asarray(boxes, np.float32) + np.array([x1, y1, x1, y1], np.float32), scores, class_ids
+            return
+
+        # A grid rather than a row, a row of wide crops would be squeezed into the model input
+        positions, size = mosaic_layout([(y2 - y1, x2 - x1) for x1, y1, x2, y2 in crops], self.aspect)
+        canvas = np.zeros(size + image.shape[2:], image.dtype)
+        for (top, left), (x1, y1, x2, y2) in zip(positions, crops):
+            canvas[top:top + y2 - y1, left:left + x2 - x1] = image[y1:y2, x1:x2]
+        boxes, scores, class_ids = self._detect(canvas)
+        if not len(scores):
+            return
+        boxes, scores, class_ids = np.asarray(boxes, np.float32), np.asarray(scores), np.asarray(class_ids)
+        centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+        for (top, left), (x1, y1, x2, y2) in zip(positions, crops):
+            # A box belongs to the tile its center is in, boxes are not continued across tiles
+            keep = ((centers_x >= left) & (centers_x < left + x2 - x1) &
+                    (centers_y >= top) & (centers_y < top + y2 - y1))
+            offset = np.array([x1 - left, y1 - top, x1 - left, y1 - top], np.float32)
+            yield boxes[keep] + offset, scores[keep], class_ids[keep]
+
+    def detect_objects(self, image):
+        height, width = image.shape[:2]
+        crops = self.roi.crops(height, width)
+        self.frame_pixels += height * width
+
+        parts = list(self._run(image, crops))
+        if not parts:
+            self.boxes, self.scores, self.class_ids = EMPTY
+            return self.boxes, self.scores, self.class_ids
+        boxes = np.concatenate([p[0] for p in parts])
+        scores = np.concatenate([np.asarray(p[1]) for p in parts])
+        class_ids = np.concatenate([np.asarray(p[2]) for p in parts])
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        boxes, scores, class_ids = self.roi.filter(boxes, scores, class_ids, height, width)
+        if len(scores) > 1 and len(crops) > 1:
+            keep = nms(boxes, scores, getattr(self.detector, 'iou_threshold', 0.5))
+            boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+        self.boxes, self.scores, self.class_ids = boxes, scores, class_ids
+        return boxes, scores, class_ids
+
+    def draw_detections(self, image, mask_alpha=0.4):
+        return self.roi.draw(self.detector.renderer.draw(image, self.boxes, self.scores, self.class_ids,
+                                                         mask_alpha=mask_alpha))
+
+    def pixel_fraction(self):
+        """Network input pixels, inferences times the model input, over the frame pixels; 1 or more is no saving."""
+        return self.pixels / self.frame_pixels if self.frame_pixels else 0.0
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from frame_source import open_source
+    from yolov7 import YOLOv7
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Camera index, video or recording")
+    parser.add_argument("--rois", default="rois.yaml", help="Per-camera regions")
+    parser.add_argument("--camera", required=True, help="Camera name in the regions file")
+    parser.add_argument("--model", default="models/yolov7-tiny_480x640.onnx", help="Detector model")
+    parser.add_argument("--per-crop", action="store_true", help="One inference per crop instead of a mosaic")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to process")
+    args = parser.parse_args()
+
+    detector = YOLOv7(args.model)
+    roi_detector = ROIDetector(detector, load_rois(args.rois)[args.camera], not args.per_crop)
+    # Reference: the whole frame, with and without suppressing detections outside the regions
+    full_time = roi_time = 0.0
+    frames = full_count = inside_count = roi_count = 0
+    with open_source(args.source) as source:
+        for _, (frame, _) in zip(range(args.frames), source):
+            frames += 1
+            start = time.perf_counter()
+            boxes, scores, class_ids = detector(frame)
+            full_time += time.perf_counter() - start
+            full_count += len(scores)
+            inside_count += len(roi_detector.roi.filter(boxes, scores, class_ids, *frame.shape[:2])[1])
+            start = time.perf_counter()
+            roi_count += len(roi_detector(frame)[1])
+            roi_time += time.perf_counter() - start
+    print(f"Whole frame: {full_time / frames * 1000:.1f} ms, {full_count} detections, {inside_count} inside")
+    print(f"ROI crops:   {roi_time / frames * 1000:.1f} ms, {roi_count} detections, "
+          f"{roi_detector.inferences / frames:.1f} inferences per frame, "
+          f"{roi_detector.pixel_fraction():.0%} of the pixels")
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 from .rpi_rf import RFDevice
+from .backend import GpiodBackend, SimulatedChip
 
 
 __version__ = '0.9.7_gpiod'
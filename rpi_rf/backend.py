@@ -0,0 +1,216 @@
+"""
+GPIO backends for RFDevice.
+
+GpiodBackend talks to a real gpiochip through libgpiod, SimulatedChip records edges in memory so TX and RX
+timing can be developed and benchmarked off the Pi.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def precise_sleep(delay):
+    """Sleep in small steps so the wake-up error stays around 1% of the delay."""
+    _delay = delay / 100
+    end = time.time() + delay - _delay
+    while time.time() < end:
+        time.sleep(_delay)
+
+
+class GpiodBackend:
+    """GPIO access through libgpiod on a gpiochip character device."""
+
+    def __init__(self, gpio_dev="/dev/gpiochip0"):
+        # Imported here so rpi_rf can be used with other backends on machines without libgpiod
+        import gpiod
+        from gpiod.line import Direction, Edge, Value
+        self._gpiod = gpiod
+        self._direction = Direction
+        self._edge = Edge
+        self.gpio_dev = gpio_dev
+        self.ACTIVE = Value.ACTIVE
+        self.INACTIVE = Value.INACTIVE
+
+    def request_output(self, gpio, consumer):
+        """Request a line as output, returns a request with set_value(gpio, value) and release()."""
+        return self._gpiod.request_lines(
+            self.gpio_dev,
+            consumer=consumer,
+            config={gpio: self._gpiod.LineSettings(direction=self._direction.OUTPUT, output_value=self.INACTIVE)}
+        )
+
+    def request_input(self, gpio, consumer, callback=None):
+        """
+        Request a line as input.
+
+        When a callback is given, edges are read on a thread and passed as callback(gpio, timestamp_ns)
+        with the kernel event timestamp.
+        """
+        if callback is None:
+            return self._gpiod.request_lines(
+                self.gpio_dev,
+                consumer=consumer,
+                config={gpio: self._gpiod.LineSettings(direction=self._direction.INPUT)}
+            )
+        request = self._gpiod.request_lines(
+            self.gpio_dev,
+            consumer=consumer,
+            config={gpio: self._gpiod.LineSettings(direction=self._direction.INPUT,
+                                                   edge_detection=self._edge.BOTH)}
+        )
+        return _GpiodEdgeReader(request, callback)
+
+    def clock_ns(self):
+        return time.perf_counter_ns()
+
+    def sleep(self, delay):
+        precise_sleep(delay)
+
+
+class _GpiodEdgeReader:
+    """Reads edge events of an input request on a thread until released."""
+
+    def __init__(self, request, callback):
+        self.request = request
+        self._callback = callback
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read_thread, daemon=True)
+        self._thread.start()
+
+    def _read_thread(self):
+        while not self._stopped:
+            if not self.request.wait_edge_events(0.1):
+                continue
+            for event in self.request.read_edge_events():
+                self._callback(event.line_offset, event.timestamp_ns)
+
+    def get_value(self, gpio):
+        return self.request.get_value(gpio)
+
+    def release(self):
+        self._stopped = True
+        self._thread.join()
+        self.request.release()
+
+
+class SimulatedLine:
+    """A requested line on a SimulatedChip."""
+
+    def __init__(self, chip, gpio, consumer, callback=None):
+        self.chip = chip
+        self.gpio = gpio
+        self.consumer = consumer
+        self.callback = callback
+        self.value = 0
+
+    def set_value(self, gpio, value):
+        self.chip.drive(gpio, value)
+
+    def get_value(self, gpio):
+        return self.chip.levels.get(gpio, 0)
+
+    def release(self):
+        self.chip.release(self.gpio)
+
+
+class SimulatedChip:
+    """
+    In-memory gpiochip backend.
+
+    Every output edge is recorded as (timestamp_ns, value) in edges[gpio]. Output lines can be looped back to
+    input lines with connect(), which delivers the edges to the input callback with optional jitter and noise.
+    With realtime=False the chip has a virtual clock that sleep() advances, so transmissions take no wall time
+    and timing is exact.
+    """
+
+    ACTIVE = 1
+    INACTIVE = 0
+    simulated = True
+
+    def __init__(self, realtime=True, seed=None):
+        self.realtime = realtime
+        self.edges = defaultdict(list)
+        self.levels = {}
+        self._lines = {}
+        self._loopbacks = defaultdict(list)
+        self._virtual_ns = 1000000000
+        self._random = random.Random(seed)
+
+    def clock_ns(self):
+        if self.realtime:
+            return time.perf_counter_ns()
+        return self._virtual_ns
+
+    def sleep(self, delay):
+        if self.realtime:
+            precise_sleep(delay)
+        else:
+            self._virtual_ns += int(delay * 1000000000)
+
+    def request_output(self, gpio, consumer):
+        return self._request(SimulatedLine(self, gpio, consumer))
+
+    def request_input(self, gpio, consumer, callback=None):
+        return self._request(SimulatedLine(self, gpio, consumer, callback))
+
+    def _request(self, line):
+        if line.gpio in self._lines:
+            raise OSError(f"GPIO {line.gpio} is busy ({self._lines[line.gpio].consumer})")
+        self._lines[line.gpio] = line
+        return line
+
+    def release(self, gpio):
+        self._lines.pop(gpio, None)
+
+    def connect(self, tx_gpio, rx_gpio, jitter_us=0, noise_rate=0.0, glitch_us=(10, 150)):
+        """
+        Loop the edges driven on tx_gpio back to rx_gpio.
+
+        Args:
+            tx_gpio: Output GPIO to listen on
+            rx_gpio: Input GPIO whose callback receives the edges
+            jitter_us: Standard deviation of the gaussian jitter added to each edge timestamp
+            noise_rate: Probability per edge of an extra glitch pulse before it
+            glitch_us: Range of glitch pulse lengths in microseconds
+        """
+        self._loopbacks[tx_gpio].append((rx_gpio, jitter_us, noise_rate, glitch_us, [0]))
+
+    def disconnect(self, tx_gpio):
+        self._loopbacks.pop(tx_gpio, None)
+
+    def clear(self):
+        """Forget recorded edges."""
+        self.edges.clear()
+
+    def drive(self, gpio, value):
+        """Drive an output GPIO and deliver the edge to connected inputs."""
+        value = int(bool(value))
+        timestamp = self.clock_ns()
+        self.edges[gpio].append((timestamp, value))
+        if self.levels.get(gpio, 0) == value:
+            return
+        self.levels[gpio] = value
+        for rx_gpio, jitter_us, noise_rate, glitch_us, last in self._loopbacks[gpio]:
+            line = self._lines.get(rx_gpio)
+            if line is None or line.callback is None:
+                continue
+            if noise_rate and self._random.random() < noise_rate:
+                glitch = int(self._random.uniform(*glitch_us) * 1000)
+                for offset in (2 * glitch, glitch):
+                    last[0] = self._deliver(line, rx_gpio, timestamp - offset, last[0])
+            edge_time = timestamp
+            if jitter_us:
+                edge_time += int(self._random.gauss(0, jitter_us) * 1000)
+            last[0] = self._deliver(line, rx_gpio, edge_time, last[0])
+
+    def _deliver(self, line, rx_gpio, timestamp, last):
+        # Jitter must not reorder edges
+        timestamp = max(timestamp, last + 1000)
+        self.levels[rx_gpio] = 1 - self.levels.get(rx_gpio, 0)
+        line.callback(rx_gpio, timestamp)
+        return timestamp
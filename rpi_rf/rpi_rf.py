@@ -5,8 +5,10 @@ Sending and receiving 433/315Mhz signals with low-cost GPIO RF Modules on a Rasp
 import logging
 import time
 from collections import namedtuple
-import gpiod
-from gpiod.line import Direction, Value
+from functools import lru_cache
+
+from .backend import GpiodBackend
+from .tx_engine import build_pulse_train, create_engine
 
 MAX_CHANGES = 67
 
@@ -25,17 +27,43 @@ PROTOCOLS = (None,
              Protocol(500, 6, 14, 1, 2, 2, 1),
              Protocol(200, 1, 10, 1, 5, 1, 1))
 
+# Nexa (protocol 6) sends '0' as '01' and '1' as '10'
+_NEXA_SYMBOLS = (b'\x00\x01', b'\x01\x00')
+
+
+@lru_cache(maxsize=256)
+def encode_code(code, proto, length):
+    """
+    Encode a decimal code into a bytes object with one 0/1 value per symbol, MSB first.
+
+    Results are cached, keep-alive loops send the same code over and over.
+    """
+    # Like format(code, '#0{}b'), codes longer than length keep all their bits
+    width = max(length, code.bit_length())
+    bits = bytes((code >> shift) & 1 for shift in range(width - 1, -1, -1))
+    if proto == 6:
+        bits = b''.join([_NEXA_SYMBOLS[b] for b in bits])
+    return bits
+
 
 class RFDevice:
     """Representation of a GPIO RF device."""
 
     # pylint: disable=too-many-instance-attributes,too-many-arguments
     def __init__(self, gpio,
-                 tx_proto=1, tx_pulselength=None, tx_repeat=10, tx_length=24, rx_tolerance=80):
-        """Initialize the RF device."""
+                 tx_proto=1, tx_pulselength=None, tx_repeat=10, tx_length=24, rx_tolerance=80, backend=None):
+        """
+        Initialize the RF device.
+
+        backend is a GPIO backend such as SimulatedChip, a GpiodBackend on gpio_dev is created when none given.
+        """
         self.gpio = gpio
         self.gpio_dev = "/dev/gpiochip0"
+        self.backend = backend
         self.tx_enabled = False
+        self.tx_engine = None
+        # TimingError of the last transmission
+        self.tx_timing = None
         self.tx_proto = tx_proto
         if tx_pulselength:
             self.tx_pulselength = tx_pulselength
@@ -67,25 +95,34 @@ class RFDevice:
             self.disable_rx()
         _LOGGER.debug("Cleanup")
 
-    def enable_tx(self):
-        """Enable TX, set up GPIO using gpiod."""
+    def _get_backend(self):
+        if self.backend is None:
+            self.backend = GpiodBackend(self.gpio_dev)
+        return self.backend
+
+    def enable_tx(self, engine='auto'):
+        """
+        Enable TX, set up GPIO through the TX engine.
+
+        engine is 'pigpio' for DMA waveforms, 'edge' to toggle the line from Python or 'auto' to use pigpio
+        when its daemon is reachable.
+        """
         if self.rx_enabled:
             _LOGGER.error("RX is enabled, not enabling TX")
             return False
         if not self.tx_enabled:
-            self.tx_line = gpiod.request_lines(
-                self.gpio_dev,
-                consumer="rpi_rf_tx",
-                config={self.gpio: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)}
-            )
+            self.tx_engine = create_engine(engine, self.gpio, self.backend, self.gpio_dev)
+            if self.backend is None:
+                self.backend = getattr(self.tx_engine, 'backend', None)
             self.tx_enabled = True
-            _LOGGER.debug("TX enabled")
+            _LOGGER.debug("TX enabled using " + self.tx_engine.name + " engine")
         return True
 
     def disable_tx(self):
-        """Disable TX, release gpiod line."""
+        """Disable TX, release the line."""
         if self.tx_enabled:
-            self.tx_line.release()
+            self.tx_engine.release()
+            self.tx_engine = None
             self.tx_enabled = False
             _LOGGER.debug("TX disabled")
         return True
@@ -113,36 +150,26 @@ class RFDevice:
             self.tx_length = 32
         else:
             self.tx_length = 24
-        rawcode = format(code, '#0{}b'.format(self.tx_length + 2))[2:]
+        rawcode = encode_code(code, self.tx_proto, self.tx_length)
         if self.tx_proto == 6:
-            nexacode = ""
-            for b in rawcode:
-                if b == '0':
-                    nexacode = nexacode + "01"
-                if b == '1':
-                    nexacode = nexacode + "10"
-            rawcode = nexacode
             self.tx_length = 64
         _LOGGER.debug("TX code: " + str(code))
         return self.tx_bin(rawcode)
 
     def tx_bin(self, rawcode):
-        """Send a binary code."""
-        _LOGGER.debug("TX bin: " + str(rawcode))
-        for _ in range(0, self.tx_repeat):
-            if self.tx_proto == 6:
-                if not self.tx_sync():
-                    return False
-            for byte in range(0, self.tx_length):
-                if rawcode[byte] == '0':
-                    if not self.tx_l0():
-                        return False
-                else:
-                    if not self.tx_l1():
-                        return False
-            if not self.tx_sync():
-                return False
-
+        """Send a binary code, either a '0'/'1' string or bytes of 0/1 values from encode_code."""
+        _LOGGER.debug("TX bin: %s", rawcode)
+        if not self.tx_enabled:
+            _LOGGER.error("TX is not enabled, not sending data")
+            return False
+        if isinstance(rawcode, str):
+            rawcode = bytes(b != '0' for b in rawcode)
+        if not 0 < self.tx_proto < len(PROTOCOLS):
+            _LOGGER.error("Unknown TX protocol")
+            return False
+        train = build_pulse_train(rawcode[:self.tx_length], PROTOCOLS[self.tx_proto],
+                                  self.tx_pulselength, self.tx_proto == 6)
+        self.tx_timing = self.tx_engine.send(train, self.tx_repeat)
         return True
 
     def tx_l0(self):
@@ -174,31 +201,23 @@ class RFDevice:
         if not self.tx_enabled:
             _LOGGER.error("TX is not enabled, not sending data")
             return False
-        self.tx_line.set_value(self.gpio, Value.ACTIVE)
-        self._sleep((highpulses * self.tx_pulselength) / 1000000)
-        self.tx_line.set_value(self.gpio, Value.INACTIVE)
-        self._sleep((lowpulses * self.tx_pulselength) / 1000000)
+        self.tx_timing = self.tx_engine.send((highpulses * self.tx_pulselength, lowpulses * self.tx_pulselength))
         return True
 
     def enable_rx(self):
-        """Enable RX, set up GPIO input using gpiod.
-           Note: Event detection must be polled externally."""
+        """Enable RX, set up GPIO input through the backend.
+           Edges are passed to rx_callback with their event timestamps."""
         if self.tx_enabled:
             _LOGGER.error("TX is enabled, not enabling RX")
             return False
         if not self.rx_enabled:
-            self.rx_line = gpiod.request_lines(
-                self.gpio_dev,
-                consumer="rpi_rf_rx",
-                config={self.gpio: gpiod.LineSettings(direction=Direction.INPUT)}
-            )
-            # Event monitoring to be implemented externally (e.g., polling on self.rx_line)
+            self.rx_line = self._get_backend().request_input(self.gpio, "rpi_rf_rx", self.rx_callback)
             self.rx_enabled = True
             _LOGGER.debug("RX enabled")
         return True
 
     def disable_rx(self):
-        """Disable RX, release gpiod line."""
+        """Disable RX, release the line."""
         if self.rx_enabled:
             self.rx_line.release()
             self.rx_enabled = False
@@ -206,9 +225,12 @@ class RFDevice:
         return True
 
     # pylint: disable=unused-argument
-    def rx_callback(self, gpio):
+    def rx_callback(self, gpio, timestamp_ns=None):
         """RX callback for GPIO event detection. Handle basic signal detection."""
-        timestamp = int(time.perf_counter() * 1000000)
+        if timestamp_ns is None:
+            timestamp = int(time.perf_counter() * 1000000)
+        else:
+            timestamp = timestamp_ns // 1000
         duration = timestamp - self._rx_last_timestamp
 
         if duration > 5000:
@@ -256,9 +278,3 @@ class RFDevice:
             return True
 
         return False
-           
-    def _sleep(self, delay):      
-        _delay = delay / 100
-        end = time.time() + delay - _delay
-        while time.time() < end:
-            time.sleep(_delay)
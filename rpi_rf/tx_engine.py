@@ -0,0 +1,170 @@
+"""
+TX engines that send a pre-built pulse train.
+
+EdgeEngine toggles the line from Python once per edge and works with every backend. PigpioEngine hands the
+whole train to the pigpio daemon, which plays it back as a DMA waveform without the interpreter in the loop.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+from .backend import GpiodBackend
+
+_LOGGER = logging.getLogger(__name__)
+
+TimingError = namedtuple('TimingError', ['mean_us', 'max_us', 'edges'])
+
+
+@lru_cache(maxsize=256)
+def build_pulse_train(rawcode, protocol, pulselength, nexa=False):
+    """
+    Build one frame as a tuple of durations in microseconds, alternating high and low and starting high.
+
+    Args:
+        rawcode: bytes of 0/1 symbols from encode_code
+        protocol: Protocol namedtuple
+        pulselength: Pulse length in microseconds
+        nexa: Send a leading sync like protocol 6
+    """
+    sync = (protocol.sync_high * pulselength, protocol.sync_low * pulselength)
+    waveforms = ((protocol.zero_high * pulselength, protocol.zero_low * pulselength),
+                 (protocol.one_high * pulselength, protocol.one_low * pulselength))
+    train = list(sync) if nexa else []
+    for bit in rawcode:
+        train += waveforms[bit]
+    train += sync
+    return tuple(train)
+
+
+def timing_error(planned, timestamps_us):
+    """Compare achieved edge timestamps in microseconds with the planned durations between them."""
+    errors = [abs((b - a) - duration)
+              for a, b, duration in zip(timestamps_us, timestamps_us[1:], planned)]
+    if not errors:
+        return TimingError(0.0, 0.0, 0)
+    return TimingError(sum(errors) / len(errors), max(errors), len(errors))
+
+
+class EdgeEngine:
+    """Sends each edge from Python through the backend line, sleeping to absolute deadlines."""
+
+    name = 'edge'
+
+    def __init__(self, backend, gpio, consumer="rpi_rf_tx"):
+        self.backend = backend
+        self.gpio = gpio
+        self.line = backend.request_output(gpio, consumer)
+
+    def send(self, train, repeat=1):
+        """Send the pulse train repeat times, returns the achieved TimingError."""
+        set_value = self.line.set_value
+        clock_ns = self.backend.clock_ns
+        sleep = self.backend.sleep
+        gpio = self.gpio
+        levels = (self.backend.ACTIVE, self.backend.INACTIVE)
+
+        timestamps = []
+        deadline = clock_ns()
+        for _ in range(repeat):
+            for i, duration in enumerate(train):
+                set_value(gpio, levels[i & 1])
+                timestamps.append(clock_ns() / 1000)
+                # Deadlines are absolute so late wake-ups do not add up over the frame
+                deadline += duration * 1000
+                remaining = deadline - clock_ns()
+                if remaining > 0:
+                    sleep(remaining / 1000000000)
+        return timing_error(train * repeat, timestamps)
+
+    def release(self):
+        self.line.release()
+
+
+class PigpioEngine:
+    """Plays the pulse train as a pigpio DMA waveform, repeats are looped by the daemon."""
+
+    name = 'pigpio'
+    # Waveforms kept on the daemon, keep-alive traffic reuses a few of them
+    MAX_WAVES = 16
+
+    def __init__(self, gpio, pi=None):
+        import pigpio
+        self._pigpio = pigpio
+        self._own_pi = pi is None
+        self.pi = pigpio.pi() if pi is None else pi
+        if not self.pi.connected:
+            raise OSError("pigpio daemon is not running")
+        self.gpio = gpio
+        self.pi.set_mode(gpio, pigpio.OUTPUT)
+        self.pi.write(gpio, 0)
+        self._waves = {}
+
+    def _wave(self, train):
+        wave_id = self._waves.pop(train, None)
+        if wave_id is None:
+            if len(self._waves) >= self.MAX_WAVES:
+                oldest = next(iter(self._waves))
+                self.pi.wave_delete(self._waves.pop(oldest))
+            mask = 1 << self.gpio
+            pulses = [self._pigpio.pulse(0, mask, duration) if i & 1 else self._pigpio.pulse(mask, 0, duration)
+                      for i, duration in enumerate(train)]
+            self.pi.wave_add_new()
+            self.pi.wave_add_generic(pulses)
+            wave_id = self.pi.wave_create()
+            if wave_id < 0:
+                raise OSError(f"pigpio could not create waveform ({wave_id})")
+        # Most recently used last
+        self._waves[train] = wave_id
+        return wave_id
+
+    def send(self, train, repeat=1):
+        """Send the pulse train repeat times, returns the TimingError measured from pigpio edge ticks."""
+        wave_id = self._wave(train)
+        ticks = []
+        callback = self.pi.callback(self.gpio, self._pigpio.EITHER_EDGE,
+                                    lambda gpio, level, tick: ticks.append(tick))
+        # Loop the waveform repeat times: loop start, wave, loop end with repeat count
+        self.pi.wave_chain([255, 0, wave_id, 255, 1, repeat & 0xFF, repeat >> 8])
+        while self.pi.wave_tx_busy():
+            time.sleep(0.001)
+        callback.cancel()
+        # Ticks are a wrapping 32 bit microsecond counter
+        timestamps, offset = [], 0
+        for previous, tick in zip([ticks[0]] + ticks if ticks else [], ticks):
+            if tick < previous:
+                offset += 1 << 32
+            timestamps.append(tick + offset)
+        return timing_error(train * repeat, timestamps)
+
+    def release(self):
+        for wave_id in self._waves.values():
+            self.pi.wave_delete(wave_id)
+        self._waves.clear()
+        if self._own_pi:
+            self.pi.stop()
+
+
+def create_engine(name, gpio, backend=None, gpio_dev="/dev/gpiochip0"):
+    """
+    Create a TX engine.
+
+    Args:
+        name: 'pigpio', 'edge' or 'auto' to use pigpio when its daemon is reachable and fall back to 'edge'
+        gpio: GPIO number
+        backend: GPIO backend for the edge engine, a GpiodBackend on gpio_dev is created when None
+        gpio_dev: gpiochip device used when no backend is given
+    """
+    if name not in ('auto', 'pigpio', 'edge'):
+        raise ValueError(f"Unknown TX engine {name!r}")
+    if name in ('auto', 'pigpio') and not getattr(backend, 'simulated', False):
+        try:
+            return PigpioEngine(gpio)
+        except (ImportError, OSError) as e:
+            if name == 'pigpio':
+                raise
+            _LOGGER.debug("pigpio not available, using edge engine: " + str(e))
+    if backend is None:
+        backend = GpiodBackend(gpio_dev)
+    return EdgeEngine(backend, gpio)
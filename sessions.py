@@ -0,0 +1,247 @@
+"""
+Runs several ONNX Runtime sessions in one process without oversubscribing the CPU.
+
+Every session normally starts an intra-op pool with a thread per core, two detectors running at once then put
+two threads on every core and both slow down. SessionManager creates the sessions on ONNX Runtime's global
+thread pool and FairScheduler lets one inference at a time use it, in weighted fair order: a session with
+priority 2 gets twice the inference time of a session with priority 1 when both are busy.
+
+    python sessions.py models/yolov7-tiny_480x640.onnx models/thermal.onnx --seconds 10
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from startup import create_session, ort, use_global_thread_pool
+
+
+class FairScheduler:
+    def __init__(self, concurrency=1, active_window=0.5):
+        """
+        Grants inference slots in order of virtual time, the inference time a session used divided by its priority.
+
+        A detector loop has one inference outstanding at a time and spends the time between them on pre- and
+        postprocessing. Granting the slot to whoever waits would simply alternate between the loops, so the
+        session that is furthest behind keeps its claim while it was active within active_window seconds.
+
+        Args:
+            concurrency: Inferences that may run at once
+            active_window: Seconds a session that is behind is waited for before others get its turn
+        """
+        self.concurrency = concurrency
+        self.active_window = active_window
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._sessions = set()
+        # Virtual time of the last granted slot, a session waking up from idle starts here instead of
+        # claiming the time it did not use
+        self._now = 0.0
+
+    def _behind(self, entry, now):
+        """Returns seconds to wait for a recently active session with less virtual time than entry, else 0."""
+        wait = 0.0
+        for session in self._sessions:
+            if session is not entry[2] and session.vtime < entry[0] and not session.waiting:
+                remaining = session.last_release + self.active_window - now
+                if remaining > 0 and session.running == 0:
+                    wait = max(wait, remaining)
+        return wait
+
+    def acquire(self, session):
+        with self._cond:
+            self._sessions.add(session)
+            session.vtime = max(session.vtime, self._now)
+            entry = (session.vtime, next(self._order), session)
+            heapq.heappush(self._waiting, entry)
+            session.waiting += 1
+            while True:
+                if self._running < self.concurrency and self._waiting[0] is entry:
+                    wait = self._behind(entry, time.perf_counter())
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._waiting)
+            session.waiting -= 1
+            session.running += 1
+            self._running += 1
+            self._now = session.vtime
+            self._cond.notify_all()
+
+    def release(self, session, elapsed):
+        with self._cond:
+            session.vtime += elapsed / session.priority
+            session.running -= 1
+            session.last_release = time.perf_counter()
+            self._running -= 1
+            self._cond.notify_all()
+
+
+class ManagedSession:
+    def __init__(self, session, scheduler, priority, name):
+        """InferenceSession whose run() waits for its turn, everything else is passed through."""
+        if priority <= 0:
+            raise ValueError("Priority must be positive")
+        self.session = session
+        self.scheduler = scheduler
+        self.priority = priority
+        self.name = name
+        self.vtime = 0.0
+        self.waiting = 0
+        self.running = 0
+        self.last_release = 0.0
+        self.runs = 0
+        self.busy = 0.0
+        self.waited = 0.0
+
+    def run(self, output_names, input_feed, run_options=None):
+        start = time.perf_counter()
+        self.scheduler.acquire(self)
+        granted = time.perf_counter()
+        try:
+            return self.session.run(output_names, input_feed, run_options)
+        finally:
+            elapsed = time.perf_counter() - granted
+            self.scheduler.release(self, elapsed)
+            self.runs += 1
+            self.busy += elapsed
+            self.waited += granted - start
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class SessionManager:
+    def __init__(self, threads=None, concurrency=1):
+        """
+        Creates sessions that share the CPU.
+
+        Must be created before the first session of the process to get the global thread pool. When a session
+        already exists every session keeps its own pool, without spinning between inferences, and the
+        scheduler still keeps them from running at the same time.
+
+        Args:
+            threads: Intra-op threads, the number of CPUs when None
+            concurrency: Inferences that may run at once, 1 gives every inference all threads
+        """
+        self.threads = threads or os.cpu_count() or 1
+        self.shared = use_global_thread_pool(self.threads)
+        self.scheduler = FairScheduler(concurrency)
+        self.sessions = []
+        self.started = time.perf_counter()
+
+    def create(self, model_path, priority=1.0, name=None, options=None, **kwargs):
+        """
+        Creates a session through startup.create_session.
+
+        Args:
+            model_path: ONNX model file
+            priority: Share of the inference time relative to the other sessions
+            name: Name in metrics(), the model file name when None
+            options: Optional SessionOptions to start from
+            kwargs: Passed to create_session
+
+        Returns:
+            ManagedSession
+        """
+        options = options or ort.SessionOptions()
+        if not self.shared:
+            options.intra_op_num_threads = self.threads
+            # Idle pools must not spin on the cores the running session needs
+            options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        session = create_session(model_path, options=options, **kwargs)
+        managed = ManagedSession(session, self.scheduler, priority, name or os.path.basename(str(model_path)))
+        self.sessions.append(managed)
+        return managed
+
+    def metrics(self):
+        """Returns runs per second, inference and wait milliseconds and the share of inference time per session."""
+        elapsed = time.perf_counter() - self.started
+        busy = sum(session.busy for session in self.sessions) or 1.0
+        return {
+            session.name: {
+                'priority': session.priority,
+                'fps': session.runs / elapsed,
+                'inference_ms': session.busy / session.runs * 1000 if session.runs else 0.0,
+                'wait_ms': session.waited / session.runs * 1000 if session.runs else 0.0,
+                'share': session.busy / busy,
+            }
+            for session in self.sessions
+        }
+
+
+def _run_benchmark(models, priorities, mode, seconds, threads):
+    """Runs a YOLOv7 detector per model on its own thread for seconds, returns frames per second per model."""
+    import numpy as np
+
+    from yolov7 import YOLOv7
+
+    manager = SessionManager(threads) if mode == 'shared' else None
+    detectors = [YOLOv7(model, cache_dir=None, manager=manager, priority=priority)
+                 for model, priority in zip(models, priorities)]
+    frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), np.uint8)
+    counts = [0] * len(detectors)
+    stop = time.perf_counter() + seconds
+
+    def loop(i):
+        while time.perf_counter() < stop:
+            detectors[i](frame)
+            counts[i] += 1
+
+    workers = [threading.Thread(target=loop, args=(i,)) for i in range(len(detectors))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [count / seconds for count in counts], manager.shared if manager else False
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("models", nargs="*", help="Models run concurrently, two synthetic models when none")
+    parser.add_argument("--priorities", default=None, help="Comma separated priority per model, 1 each by default")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each setup")
+    parser.add_argument("--threads", type=int, default=None, help="Threads of the shared pool, all CPUs by default")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    priorities = [float(p) for p in args.priorities.split(",")] if args.priorities else [1.0] * len(args.models)
+
+    if args.child:
+        # Global pools are per process, every setup runs in a fresh one
+        fps, shared = _run_benchmark(args.models, priorities, args.child, args.seconds, args.threads)
+        print(json.dumps({'fps': fps, 'shared': shared}))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        models = args.models
+        if not models:
+            from memory_benchmark import synthetic_model
+
+            # Stand-ins for the RGB and the thermal model
+            models = [os.path.join(directory, 'rgb.onnx'), os.path.join(directory, 'thermal.onnx')]
+            synthetic_model(models[0], size=640)
+            synthetic_model(models[1], size=320)
+            priorities = [1.0, 1.0]
+        print(f"{os.cpu_count()} CPUs, {len(models)} detectors on their own threads for {args.seconds:.0f} s")
+        for mode in ("independent", "shared"):
+            command = [sys.executable, os.path.abspath(__file__), *models, "--child", mode,
+                       "--seconds", str(args.seconds), "--priorities", ",".join(map(str, priorities))]
+            if args.threads:
+                command += ["--threads", str(args.threads)]
+            result = subprocess.run(command, capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            usage = json.loads(result.stdout.strip().splitlines()[-1])
+            per_model = ", ".join(f"{os.path.basename(m)} {fps:.1f}" for m, fps in zip(models, usage['fps']))
+            label = mode if mode == "independent" or usage['shared'] else "shared (per-session fallback)"
+            print(f"{label:<30} {sum(usage['fps']):6.1f} fps total ({per_model})")
@@ -0,0 +1,323 @@
+import hashlib
+import importlib.util
+import os
+import platform
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+
+# Reference point of the startup report, as early as this module is imported
+IMPORT_TIME = time.perf_counter()
+
+
+class _MissingModule:
+    """Stands in for a module that is not installed, fails only when it is actually used."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        raise ImportError(f"No module named {self._name!r}")
+
+
+def lazy_import(name):
+    """
+    Returns a module that is only executed on first attribute access.
+
+    Keeps heavy imports (onnxruntime, yaml, tqdm) off the startup path of code that may never use them.
+    A missing module raises ImportError on first use rather than on import.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return _MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+ort = lazy_import('onnxruntime')
+
+
+def process_age():
+    """Seconds since the process started, since this module was imported when that is unknown."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 is the start time in clock ticks after boot, the name in field 2 may contain spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - IMPORT_TIME
+
+
+class StartupTimer:
+    def __init__(self):
+        """Records named startup phases, relative to the process start."""
+        self._offset = process_age() - (time.perf_counter() - IMPORT_TIME)
+        self.phases = []
+
+    def elapsed(self):
+        """Seconds since the process started."""
+        return self._offset + time.perf_counter() - IMPORT_TIME
+
+    def mark(self, name):
+        """Records the end of a phase and returns the time since the process started."""
+        elapsed = self.elapsed()
+        self.phases.append((name, elapsed))
+        return elapsed
+
+    def mark_once(self, name):
+        """Records the end of a phase the first time only, e.g. the first model load of a process that swaps models."""
+        if any(phase == name for phase, _ in self.phases):
+            return None
+        return self.mark(name)
+
+    def report(self):
+        """Returns one line per phase with its duration and the time since the process started."""
+        lines = []
+        previous = self._offset
+        for name, elapsed in self.phases:
+            lines.append(f"{name:<20} {(elapsed - previous) * 1000:8.1f} ms  (at {elapsed * 1000:8.1f} ms)")
+            previous = elapsed
+        return "\n".join(lines)
+
+
+timer = StartupTimer()
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """SHA-1 of a file, read once per path, modification time and size, shared by the session and metadata caches."""
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_path(model_path, cache_dir, providers, level):
+    """Optimized graphs depend on the model, the ONNX Runtime version, the providers, the level and the CPU."""
+    digest = hashlib.sha1(file_digest(model_path).encode())
+    # Level 'all' bakes in layouts for this CPU, a cache copied to another machine must not match
+    digest.update(f"{ort.__version__}|{','.join(providers)}|{level}|{platform.machine()}".encode())
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.{digest.hexdigest()[:16]}.ort.onnx")
+
+
+def available_providers(providers=('CUDAExecutionProvider', 'CPUExecutionProvider')):
+    """Filters providers down to the ones this ONNX Runtime build has."""
+    available = ort.get_available_providers()
+    return [provider for provider in providers if provider in available] or ['CPUExecutionProvider']
+
+
+# Session settings of low_memory=True: initializers allocated as they are instead of through the arena, and no
+# prepacked second copy of the Conv/MatMul weights, so weights from external data stay memory-mapped
+LOW_MEMORY_CONFIG = {
+    'session.use_env_allocators': '1',
+    'session.use_device_allocator_for_initializers': '1',
+    'session.disable_prepacking': '1',
+}
+_shared_arena = False
+
+
+def low_memory_options(options=None):
+    """
+    Returns SessionOptions for boards with little RAM.
+
+    All low memory sessions share one CPU arena that grows by what is requested instead of doubling. The arena
+    stays on, without it glibc's allocator fragments and the peak is higher. Memory patterns are off, they
+    preallocate every intermediate of the graph at once.
+    """
+    global _shared_arena
+    if not _shared_arena:
+        # max_mem 0 is unlimited, strategy 1 is kSameAsRequested, -1 keeps the defaults
+        memory_info = ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT)
+        ort.create_and_register_allocator(memory_info, ort.OrtArenaCfg(0, 1, -1, -1))
+        _shared_arena = True
+    options = options or ort.SessionOptions()
+    options.enable_mem_pattern = False
+    for key, value in LOW_MEMORY_CONFIG.items():
+        options.add_session_config_entry(key, value)
+    return options
+
+
+# Intra-op threads of the process wide pool once use_global_thread_pool() succeeded
+_global_threads = None
+_sessions_created = 0
+
+
+def use_global_thread_pool(intra_threads=None, inter_threads=1):
+    """
+    Makes every session created afterwards run on one process wide thread pool instead of a pool of its own.
+
+    ONNX Runtime creates its environment, and with it the global pools, together with the first session, so
+    this only works before any session exists. From then on create_session turns per-session threads off for
+    every session, ONNX Runtime rejects a mix.
+
+    Args:
+        intra_threads: Threads of the intra-op pool, the number of CPUs when None
+        inter_threads: Threads of the inter-op pool
+
+    Returns:
+        bool: True when the global pools are in use, False when a session was created earlier.
+    """
+    global _global_threads
+    intra_threads = intra_threads or os.cpu_count() or 1
+    if _global_threads is not None:
+        return _global_threads == intra_threads
+    if _sessions_created:
+        return False
+    from onnxruntime.capi import _pybind_state
+
+    _pybind_state.set_global_thread_pool_sizes(intra_threads, inter_threads)
+    _global_threads = intra_threads
+    return True
+
+
+def create_session(model_path, providers=None, cache_dir='auto', level='all', options=None, low_memory=False):
+    """
+    Creates an ONNX Runtime session, reusing the optimized graph of an earlier start.
+
+    The first start optimizes the graph and writes it to cache_dir, later starts load it with optimizations
+    off. The cache key includes the model contents, so a changed model is optimized again. With low_memory the
+    cached graph keeps its weights in a separate file, which ONNX Runtime memory-maps instead of reading.
+
+    Args:
+        model_path: ONNX model file
+        providers: Execution providers, the available ones of CUDA and CPU when None
+        cache_dir: Directory of optimized graphs, 'auto' for .ort_cache next to the model, None disables the cache
+        level: Graph optimization level: 'basic', 'extended' or 'all'
+        options: Optional SessionOptions to start from
+        low_memory: Apply low_memory_options()
+
+    Returns:
+        onnxruntime.InferenceSession
+    """
+    global _sessions_created
+    providers = available_providers() if providers is None else list(providers)
+    options = options or ort.SessionOptions()
+    if low_memory:
+        options = low_memory_options(options)
+    if _global_threads is not None:
+        options.use_per_session_threads = False
+    _sessions_created += 1
+    levels = {
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    if cache_dir is None:
+        options.graph_optimization_level = levels[level]
+        return ort.InferenceSession(str(model_path), options, providers=providers)
+
+    if cache_dir == 'auto':
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(model_path)), '.ort_cache')
+    cached = _cache_path(model_path, cache_dir, providers, level + ('|external' if low_memory else ''))
+    if os.path.exists(cached):
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(cached, options, providers=providers)
+        except Exception:
+            # Unreadable or truncated cache entry, optimize again
+            os.remove(cached)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    options.graph_optimization_level = levels[level]
+    # Written to a temporary name and renamed, so a reset during startup never leaves a half written cache
+    partial = f"{cached}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = partial
+    if low_memory:
+        # Referenced by file name from the graph, so it gets its final name; without the graph it is never read
+        options.add_session_config_entry('session.optimized_model_external_initializers_file_name',
+                                         os.path.basename(cached) + '.data')
+        options.add_session_config_entry('session.optimized_model_external_initializers_min_size_in_bytes',
+                                         '1024')
+    session = ort.InferenceSession(str(model_path), options, providers=providers)
+    if os.path.exists(partial):
+        os.replace(partial, cached)
+    return session
+
+
+def _dummy_input(shape, dtype, size):
+    # Dynamic dimensions are named or None, a batch of one at the given size stands in for them
+    dims = list(shape)
+    for i, dim in enumerate(dims):
+        if not isinstance(dim, int) or dim <= 0:
+            dims[i] = 1 if i == 0 else size
+    return np.zeros(dims, dtype)
+
+
+ORT_TYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(uint8)': np.uint8,
+    'tensor(int8)': np.int8,
+    'tensor(int32)': np.int32,
+    'tensor(int64)': np.int64,
+    'tensor(bool)': np.bool_,
+}
+
+
+def warm_up(session, runs=1, size=640):
+    """
+    Runs a session on zero inputs so the first real frame does not pay for allocation and kernel setup.
+
+    Args:
+        session: onnxruntime.InferenceSession
+        runs: Number of warm-up inferences, 0 skips warm-up
+        size: Stand-in for dynamic spatial dimensions
+
+    Returns:
+        float: Seconds spent warming up.
+    """
+    start = time.perf_counter()
+    if runs:
+        feeds = {item.name: _dummy_input(item.shape, ORT_TYPES.get(item.type, np.float32), size)
+                 for item in session.get_inputs()}
+        for _ in range(runs):
+            session.run(None, feeds)
+    return time.perf_counter() - start
+
+
+def warm_up_dnn(net, shape, runs=1, dtype=np.float32):
+    """Runs a cv2.dnn network on a zero blob of the given input shape, returns the seconds spent."""
+    start = time.perf_counter()
+    blob = np.zeros(shape, dtype)
+    for _ in range(runs):
+        net.setInput(blob)
+        net.forward(net.getUnconnectedOutLayersNames())
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", help="ONNX model")
+    parser.add_argument("--cache-dir", default="auto", help="Optimized graph cache, 'none' disables it")
+    parser.add_argument("--warmup", type=int, default=1, help="Warm-up inferences")
+    args = parser.parse_args()
+
+    timer.mark("imports")
+    session = create_session(args.model, cache_dir=None if args.cache_dir == 'none' else args.cache_dir)
+    timer.mark("session")
+    warm_up(session, args.warmup)
+    timer.mark("warm-up")
+    warm_up(session, 1)
+    timer.mark("first inference")
+    print(timer.report())
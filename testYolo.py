@@ -1,27 +1,72 @@
+import logging
+import os
+import socket
+import sys
 import time
 
 import cv2
 
+from clip_recorder import ClipRecorder
+from frame_source import open_source
+from quality import AdaptiveDetector, Level, QualityController, SystemSensor
+from roi import ROIDetector, load_rois
+from startup import timer
+from uplink import DEFAULT_PORT, Uplink
 # from yolov7 import YOLOv7
 from yolov7.YOLOv7opencv import YOLOv7
 
-# Initialize the webcam
-cap = cv2.VideoCapture(0)
+# Initialize the webcam, or replay a recording given on the command line
+source = open_source(sys.argv[1] if len(sys.argv) > 1 else 0)
 
-# Initialize YOLOv7 object detector
-model_path = "models/yolov7-tiny_480x640.onnx"
-yolov7_detector = YOLOv7(model_path, conf_thres=0.5, iou_thres=0.5)
+# Configurations from best to cheapest, the controller steps down when frames take longer than the target or the
+# CPU gets hot, and back up when it has cooled down
+LADDER = [
+    Level("480x640 2 fps", "models/yolov7-tiny_480x640.onnx", fps=2, threads=4),
+    Level("480x640 1 fps", "models/yolov7-tiny_480x640.onnx", fps=1, threads=4),
+    Level("256x320 1 fps", "models/yolov7-tiny_256x320.onnx", fps=1, threads=2),
+    Level("256x320 0.5 fps", "models/yolov7-tiny_256x320.onnx", fps=0.5, threads=2),
+]
+logging.basicConfig(level=logging.INFO)
+controller = QualityController([level for level in LADDER if os.path.exists(level.model)], target_ms=400,
+                               sensor=SystemSensor())
 
-# cv2.namedWindow("Detected Objects", cv2.WINDOW_NORMAL)
-while cap.isOpened():
-    # Read frame from the video
-    ret, frame = cap.read()
 
-    if not ret:
-        break
+def make_detector(model_path):
+    # Initialize YOLOv7 object detector
+    detector = YOLOv7(model_path, conf_thres=0.5, iou_thres=0.5)
+    # With a camera name after the source, only that camera's regions in rois.yaml are run through the detector
+    if len(sys.argv) > 2:
+        detector = ROIDetector(detector, load_rois("rois.yaml")[sys.argv[2]])
+    return detector
+
+
+yolov7_detector = AdaptiveDetector(controller, make_detector)
 
+# Save the seconds around every detection of a moose-like animal (cow, elephant, bear in COCO)
+MOOSE_LIKE = {19, 20, 21}
+recorder = ClipRecorder("clips", pre_roll=5, post_roll=5)
+
+# With a hub address after the camera name, detections and crops of them go to the hub, see uplink.py
+uplink = None
+if len(sys.argv) > 3:
+    host, _, port = sys.argv[3].partition(":")
+    uplink = Uplink(host, int(port or DEFAULT_PORT), socket.gethostname(), "uplink_spool")
+
+startup_reported = False
+# cv2.namedWindow("Detected Objects", cv2.WINDOW_NORMAL)
+for frame, timestamp in source:
+    start = time.perf_counter()
     # Update object localizer
     boxes, scores, class_ids = yolov7_detector(frame)
+    if not startup_reported:
+        # Import, model load, warm-up and first detection times since the process started
+        print(timer.report())
+        startup_reported = True
+    recorder.push(frame, timestamp)
+    if MOOSE_LIKE.intersection(int(class_id) for class_id in class_ids):
+        recorder.trigger(timestamp, "moose")
+    if uplink is not None:
+        uplink.add(timestamp, sys.argv[2], class_ids, scores, boxes, frame)
 
     combined_img = yolov7_detector.draw_detections(frame)
     cv2.imshow("Detected Objects", combined_img)
@@ -30,4 +75,12 @@ while cap.isOpened():
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
-    time.sleep(1)
\ No newline at end of file
+    # Frame processing latency decides the level, which sets the frame rate
+    elapsed = time.perf_counter() - start
+    yolov7_detector.update(elapsed)
+    time.sleep(controller.delay(elapsed))
+
+recorder.close()
+if uplink is not None:
+    uplink.close()
+print(controller.metrics())
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+
+def make_window_lut(low, high):
+    """
+    Builds a 65536 entry uint8 lookup table that maps [low, high] linearly to [0, 255].
+
+    Args:
+        low: Raw value mapped to 0
+        high: Raw value mapped to 255
+
+    Returns:
+        numpy.ndarray: The lookup table.
+    """
+    high = max(high, low + 1)
+    values = np.arange(65536, dtype=np.float32)
+    return np.clip((values - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+
+
+def apply_lut(frame16, lut, out=None):
+    """Converts a uint16 frame to uint8 with a lookup table, writing into out when given."""
+    # The LUT covers every uint16 value, and mode='raise' would go through a temporary buffer instead of out
+    return np.take(lut, frame16, out=out, mode='clip')
+
+
+def as_uint16(raw, height, width):
+    """
+    Reinterprets a captured frame as a (height, width) uint16 image without copying.
+
+    Drivers hand 16 bit frames over either as uint16 or as uint8 byte pairs (e.g. GREY with double width),
+    both are viewed as little-endian uint16.
+    """
+    if raw.dtype == np.uint16:
+        return raw.reshape(height, width)
+    if raw.nbytes != height * width * 2:
+        raise ValueError(f"Frame of {raw.nbytes} bytes is not a {width}x{height} 16 bit frame")
+    return np.ascontiguousarray(raw).reshape(-1).view('<u2').reshape(height, width)
+
+
+class ThermalCapture:
+    def __init__(self, device=0, width=None, height=None, fourcc='Y16 ', bit_depth=14, api=cv2.CAP_V4L2):
+        """
+        Captures raw 14/16 bit frames into a preallocated buffer.
+
+        Args:
+            device: Camera index or device path
+            width: Frame width in pixels, the driver default when None
+            height: Frame height in pixels, the driver default when None
+            fourcc: Raw pixel format to request, 'Y16 ' or 'GREY' for drivers that pack 16 bit data as bytes
+            bit_depth: Significant bits of the sensor, sets the default display window
+            api: OpenCV capture API
+        """
+        self.cap = cv2.VideoCapture(device, api)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open camera {device}")
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # Hand over the raw buffer instead of converting it to BGR
+        self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.bit_depth = bit_depth
+        self.lut = make_window_lut(0, (1 << bit_depth) - 1)
+
+        self._raw = None
+        self._out8 = np.empty((self.height, self.width), np.uint8)
+
+    def read(self):
+        """
+        Reads the next frame.
+
+        Returns:
+            tuple: (ret, frame16) where frame16 is a uint16 view of the capture buffer, valid until the next read.
+        """
+        ret, raw = self.cap.read(self._raw)
+        if not ret:
+            return False, None
+        # Reuse the buffer OpenCV allocated on the first read
+        self._raw = raw
+        return True, as_uint16(raw, self.height, self.width)
+
+    def read_8bit(self, lut=None):
+        """Reads the next frame and windows it to uint8 with lut, the full sensor range by default."""
+        ret, frame16 = self.read()
+        if not ret:
+            return False, None
+        return True, apply_lut(frame16, self.lut if lut is None else lut, out=self._out8)
+
+    def release(self):
+        self.cap.release()
+
+
+class RawFrameFile:
+    def __init__(self, path, width, height, dtype='<u2', header=0):
+        """
+        Reads frames from a raw dump of consecutive 16 bit frames through a memory map.
+
+        Args:
+            path: Path of the dump file
+            width: Frame width in pixels
+            height: Frame height in pixels
+            dtype: Pixel type of the dump
+            header: Bytes to skip at the start of the file
+        """
+        data = np.memmap(path, dtype=np.dtype(dtype), mode='r', offset=header)
+        frame_size = width * height
+        self.frames = data[:len(data) // frame_size * frame_size].reshape(-1, height, width)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+
+def dump_raw_frames(capture, path, count):
+    """Appends count raw frames from a ThermalCapture to path, readable with RawFrameFile."""
+    with open(path, 'ab') as f:
+        for _ in range(count):
+            ret, frame16 = capture.read()
+            if not ret:
+                break
+            frame16.astype('<u2', copy=False).tofile(f)
@@ -0,0 +1,829 @@
+"""
+Sends the detections of a node to a central hub over a weak link.
+
+Uplink batches detection records and small JPEG crops of the detected objects, packs the records column by
+column and compresses them with zlib, and sends the batches over one persistent TCP connection. The hub
+acknowledges every batch once it is written to its database, at most max_in_flight batches wait for an
+acknowledgement. Batches that cannot go out right away, because the node is offline or the link is slower than
+the detections, are written to a spool directory and sent oldest first when the link is back, so a restart or a
+power cut loses nothing that made it to disk. UplinkHub receives the batches of many nodes into one DetectionStore
+and is small enough to run on the same machine for testing.
+
+Wire format, all integers big endian: a frame is the compressed metadata size and the crop bytes size (2 x uint32),
+the zlib compressed metadata and the JPEG crops back to back. The hub answers every frame written to the
+database with its session and sequence number (uint32, uint64). A batch that arrives twice, because its
+acknowledgement was lost, is acknowledged again and not stored twice.
+
+    python uplink.py hub --db hub.db --crops crops
+    python uplink.py bench --nodes 50 --seconds 20 --rate 2 --crop-every 5 --outage 5
+"""
+import logging
+import os
+import queue
+import random
+import re
+import select
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque, namedtuple
+
+import cv2
+import numpy as np
+
+from detection_store import DetectionRecord
+from image_io import encode_jpeg
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5151
+VERSION = 1
+# Compressed metadata size and crop bytes size
+_FRAME = struct.Struct('>II')
+# Version, session, sequence number, record count, time of the first record
+_HEADER = struct.Struct('>BIQId')
+# Session and sequence number of a stored batch
+_ACK = struct.Struct('>IQ')
+MAX_FRAME = 16 << 20
+# Record columns, stored one after the other so zlib sees runs of similar values. Times are milliseconds after the
+# first record, scores 1/65535 steps, boxes whole pixels and crop the size of the record's JPEG, 0 for none.
+COLUMNS = (('time_ms', '>u4'), ('camera', 'u1'), ('class_id', '>u2'), ('score', '>u2'),
+           ('x1', '>u2'), ('y1', '>u2'), ('x2', '>u2'), ('y2', '>u2'), ('crop', '>u4'))
+
+Batch = namedtuple('Batch', ['node', 'session', 'seq', 'records'])
+
+
+def _pack_strings(strings):
+    data = [bytes([len(strings)])]
+    for string in strings:
+        encoded = string.encode()
+        if len(encoded) > 255:
+            raise ValueError(f"Name longer than 255 bytes: {string}")
+        data += [bytes([len(encoded)]), encoded]
+    return b''.join(data)
+
+
+def _unpack_strings(data, offset):
+    strings = []
+    for _ in range(data[offset]):
+        size = data[offset + 1]
+        strings.append(data[offset + 2:offset + 2 + size].decode())
+        offset += 1 + size
+    return strings, offset + 1
+
+
+def encode_batch(node, session, seq, records, level=6):
+    """
+    Packs records into one frame.
+
+    Args:
+        node: Name of the sending node
+        session: Random number of the sending process, sequence numbers restart with every session
+        seq: Sequence number of the batch within the session
+        records: DetectionRecords, crop is JPEG bytes or None
+        level: zlib compression level
+
+    Returns:
+        bytes: The frame as it goes on the wire.
+    """
+    if len(records) == 0:
+        raise ValueError("Empty batch")
+    cameras = sorted({record.camera for record in records})
+    if len(cameras) > 255:
+        raise ValueError("More than 255 cameras in one batch")
+    index = {camera: i for i, camera in enumerate(cameras)}
+    base = min(record.timestamp for record in records)
+    values = {
+        'time_ms': [round((record.timestamp - base) * 1000) for record in records],
+        'camera': [index[record.camera] for record in records],
+        'class_id': [record.class_id for record in records],
+        'score': [round(record.score * 65535) for record in records],
+        'crop': [len(record.crop) if record.crop else 0 for record in records],
+    }
+    for name in ('x1', 'y1', 'x2', 'y2'):
+        values[name] = [round(getattr(record, name)) for record in records]
+    meta = [_HEADER.pack(VERSION, session, seq, len(records), base), _pack_strings([node] + cameras)]
+    for name, dtype in COLUMNS:
+        info = np.iinfo(np.dtype(dtype))
+        meta.append(np.clip(values[name], info.min, info.max).astype(dtype).tobytes())
+    compressed = zlib.compress(b''.join(meta), level)
+    # JPEG does not compress any further, the crops go around zlib
+    crops = b''.join(record.crop for record in records if record.crop)
+    return _FRAME.pack(len(compressed), len(crops)) + compressed + crops
+
+
+def decode_batch(compressed, crops):
+    """
+    Unpacks the metadata and crop bytes of a frame.
+
+    Returns:
+        Batch: With DetectionRecords whose crop is JPEG bytes or None.
+    """
+    decompressor = zlib.decompressobj()
+    meta = decompressor.decompress(compressed, MAX_FRAME)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Metadata larger than MAX_FRAME")
+    version, session, seq, count, base = _HEADER.unpack_from(meta)
+    if version != VERSION:
+        raise ValueError(f"Unsupported uplink version {version}")
+    strings, offset = _unpack_strings(meta, _HEADER.size)
+    node, cameras = strings[0], strings[1:]
+    columns = {}
+    for name, dtype in COLUMNS:
+        columns[name] = np.frombuffer(meta, dtype, count, offset).tolist()
+        offset += np.dtype(dtype).itemsize * count
+    if sum(columns['crop']) != len(crops):
+        raise ValueError("Crop sizes do not match the crop bytes")
+    records = []
+    position = 0
+    for i in range(count):
+        size = columns['crop'][i]
+        records.append(DetectionRecord(base + columns['time_ms'][i] / 1000, cameras[columns['camera'][i]],
+                                       columns['class_id'][i], columns['score'][i] / 65535, columns['x1'][i],
+                                       columns['y1'][i], columns['x2'][i], columns['y2'][i],
+                                       crops[position:position + size] if size else None))
+        position += size
+    return Batch(node, session, seq, records)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    position = 0
+    while position < size:
+        received = sock.recv_into(view[position:])
+        if received == 0:
+            return None
+        position += received
+    return bytes(buffer)
+
+
+class Uplink:
+    def __init__(self, host, port, node, spool_dir, batch_size=64, flush_interval=2.0, queue_size=1000,
+                 max_in_flight=8, max_spool_bytes=256 << 20, max_rate=None, crop_size=96, crop_quality=70,
+                 ack_timeout=30.0, connect_timeout=5.0, retry_max=60.0):
+        """
+        Sends detection batches to an UplinkHub from a background thread.
+
+        add() never blocks the inference thread: records are queued per frame, and when the queue is full new
+        frames are dropped and counted, like DetectionStore does. Everything past the queue is kept, in memory
+        while the link keeps up and in spool_dir when it does not.
+
+        Args:
+            host: Hub address
+            port: Hub port
+            node: Name of this node at the hub, cameras are stored as node/camera
+            spool_dir: Directory for batches waiting for the link, batches found there are sent first
+            batch_size: Records per batch the sender aims for
+            flush_interval: Maximum seconds a record waits for its batch
+            queue_size: Maximum frames waiting for the sender thread
+            max_in_flight: Batches sent without an acknowledgement before sending pauses
+            max_spool_bytes: Oldest spooled batches are deleted beyond this
+            max_rate: Bytes per second the uplink may use, None for no limit
+            crop_size: Longest side of the JPEG crops in pixels
+            crop_quality: JPEG quality of the crops
+            ack_timeout: Seconds without an acknowledgement after which the connection is dropped and reopened
+            connect_timeout: Seconds a connection attempt may take
+            retry_max: Longest pause between connection attempts, the pause doubles from 1 s
+        """
+        self.address = (host, port)
+        self.node = node
+        self.spool_dir = str(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_in_flight = max_in_flight
+        self.max_spool_bytes = max_spool_bytes
+        self.max_rate = max_rate
+        self.crop_size = crop_size
+        self.crop_quality = crop_quality
+        self.ack_timeout = ack_timeout
+        self.connect_timeout = connect_timeout
+        self.retry_max = retry_max
+
+        self.session = random.getrandbits(32)
+        self._seq = 0
+        self._sock = None
+        self._acks = b''
+        self._retry_at = 0.0
+        self._backoff = 1.0
+        self._send_at = 0.0
+        # Encoded batches waiting for the link: (key, frame, records) in memory while connected, (key, path,
+        # size, records) on disk; key is (session, seq)
+        self._outbox = deque()
+        self._spool = deque()
+        self._spool_bytes = 0
+        # Batches sent and not yet acknowledged, key to (sent, frame, spool entry, records)
+        self._inflight = OrderedDict()
+        self._stop_at = None
+
+        self.dropped = 0
+        self.batches_sent = 0
+        self.batches_acked = 0
+        self.records_acked = 0
+        self.bytes_sent = 0
+        self.spooled = 0
+        self.spool_dropped = 0
+        self.connects = 0
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._scan_spool()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._sender_thread, name=f'uplink-{node}', daemon=True)
+        self._thread.start()
+
+    def _scan_spool(self):
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            match = re.fullmatch(r'\d+-([0-9a-f]{8})-(\d+)-(\d+)\.batch', name)
+            if match:
+                size = os.path.getsize(path)
+                key = (int(match[1], 16), int(match[2]))
+                self._spool.append((key, path, size, int(match[3])))
+                self._spool_bytes += size
+
+    def _crop(self, frame, box):
+        height, width = frame.shape[:2]
+        x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+        x2, y2 = min(int(np.ceil(box[2])), width), min(int(np.ceil(box[3])), height)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        crop = frame[y1:y2, x1:x2]
+        scale = self.crop_size / max(x2 - x1, y2 - y1)
+        if scale < 1:
+            return cv2.resize(crop, (max(round((x2 - x1) * scale), 1), max(round((y2 - y1) * scale), 1)),
+                              interpolation=cv2.INTER_AREA)
+        # The camera overwrites the frame, the crop is encoded later on the sender thread
+        return crop.copy()
+
+    def add(self, timestamp, camera, class_ids, scores, boxes, frame=None):
+        """
+        Queues the detections of one frame, as returned by YOLOv7.detect_objects.
+
+        Args:
+            timestamp: Unix time of the frame
+            camera: Camera name
+            class_ids: Detection class ids
+            scores: Detection scores
+            boxes: Boxes as (x1, y1, x2, y2) in frame pixels
+            frame: BGR frame to send a crop of every detection from, None sends no crops
+
+        Returns:
+            bool: False when the records were dropped because the sender fell behind.
+        """
+        timestamp = float(timestamp)
+        rows = [DetectionRecord(timestamp, camera, int(class_id), float(score), float(box[0]), float(box[1]),
+                                float(box[2]), float(box[3]), None if frame is None else self._crop(frame, box))
+                for class_id, score, box in zip(class_ids, scores, boxes)]
+        if not rows:
+            return True
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped += len(rows)
+            return False
+        return True
+
+    def _encode(self, rows):
+        rows = [row._replace(crop=encode_jpeg(row.crop, self.crop_quality)) if row.crop is not None else row
+                for row in rows]
+        key = (self.session, self._seq)
+        self._seq += 1
+        return key, encode_batch(self.node, self.session, key[1], rows), len(rows)
+
+    def _sender_thread(self):
+        pending = []
+        deadline = None
+        stopping = False
+        while True:
+            now = time.monotonic()
+            flushed = None
+            timeouts = [1.0]
+            if deadline is not None:
+                timeouts.append(deadline - now)
+            if self._inflight or (self._sock is not None and (self._spool or self._outbox)):
+                # Acknowledgements and the rate limit are polled
+                timeouts.append(0.05)
+            elif self._spool:
+                timeouts.append(self._retry_at - now)
+            try:
+                item = None if stopping else self._queue.get(timeout=max(min(timeouts), 0))
+            except queue.Empty:
+                item = False
+            if item is None:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                # Flush marker, the pending records go out right away
+                flushed = item
+                if pending:
+                    deadline = now
+            elif item:
+                pending.extend(item)
+                if deadline is None:
+                    deadline = now + self.flush_interval
+            if pending and (len(pending) >= self.batch_size or stopping or time.monotonic() >= deadline):
+                self._add_batch(*self._encode(pending))
+                pending = []
+                deadline = None
+            if flushed is not None:
+                flushed.set()
+            self._pump(bool(pending))
+            if stopping and (self.backlog == 0 or time.monotonic() >= self._stop_at):
+                break
+        # Whatever did not make it waits on disk for the next start
+        self._disconnect(None)
+
+    @property
+    def backlog(self):
+        """Batches not acknowledged yet, plus frames waiting for the sender thread."""
+        return len(self._outbox) + len(self._spool) + len(self._inflight) + self._queue.qsize()
+
+    def _add_batch(self, key, frame, records):
+        if len(self._outbox) + len(self._inflight) < 2 * self.max_in_flight:
+            # Written to the spool by _pump() when connecting fails
+            self._outbox.append((key, frame, records))
+        else:
+            # The link does not keep up
+            self._spill(key, frame, records)
+
+    def _spill(self, key, frame, records):
+        name = f"{int(time.time() * 1000):013d}-{key[0]:08x}-{key[1]:010d}-{records}.batch"
+        path = os.path.join(self.spool_dir, name)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(frame)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            _LOGGER.warning("uplink %s: cannot spool batch: %s", self.node, e)
+            self.spool_dropped += records
+            return
+        self._spool.append((key, path, len(frame), records))
+        self._spool_bytes += len(frame)
+        self.spooled += 1
+        while self._spool_bytes > self.max_spool_bytes and len(self._spool) > 1:
+            _, old_path, size, old_records = self._spool.popleft()
+            self._remove(old_path, size)
+            self.spool_dropped += old_records
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._spool_bytes -= size
+
+    def _connect(self):
+        try:
+            sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        except OSError as e:
+            self._retry_at = time.monotonic() + self._backoff
+            _LOGGER.debug("uplink %s: connecting failed, retry in %.0f s: %s", self.node, self._backoff, e)
+            self._backoff = min(self._backoff * 2, self.retry_max)
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # A send that does not get through in ack_timeout counts as a lost link
+        sock.settimeout(self.ack_timeout)
+        self._sock = sock
+        self._acks = b''
+        self._backoff = 1.0
+        self.connects += 1
+        _LOGGER.info("uplink %s: connected to %s:%d, %d batches spooled", self.node, *self.address,
+                     len(self._spool))
+
+    def _disconnect(self, error):
+        if self._sock is not None:
+            if error is not None:
+                _LOGGER.info("uplink %s: connection lost: %s", self.node, error)
+            self._sock.close()
+            self._sock = None
+            self._retry_at = time.monotonic() + self._backoff
+        # Unacknowledged batches are sent again, the hub drops the ones it already has
+        for key, (_, frame, entry, records) in reversed(self._inflight.items()):
+            if entry is not None:
+                self._spool.appendleft(entry)
+        memory = [(key, frame, records) for key, (_, frame, entry, records) in self._inflight.items()
+                  if entry is None]
+        self._inflight.clear()
+        for batch in memory + list(self._outbox):
+            self._spill(*batch)
+        self._outbox.clear()
+
+    def _pump(self, pending=False):
+        if self._sock is None:
+            if (pending or self._outbox or self._spool) and time.monotonic() >= self._retry_at:
+                self._connect()
+            if self._sock is None:
+                # Offline, the batches that waited for the connection go to disk
+                for batch in self._outbox:
+                    self._spill(*batch)
+                self._outbox.clear()
+                return
+        try:
+            while len(self._inflight) < self.max_in_flight and (self._spool or self._outbox):
+                now = time.monotonic()
+                if now < self._send_at:
+                    break
+                if self._spool:
+                    entry = self._spool.popleft()
+                    key, path, _, records = entry
+                    try:
+                        with open(path, 'rb') as f:
+                            frame = f.read()
+                    except OSError as e:
+                        _LOGGER.warning("uplink %s: cannot read spooled batch: %s", self.node, e)
+                        self._remove(path, entry[2])
+                        continue
+                    self._inflight[key] = (now, None, entry, records)
+                else:
+                    key, frame, records = self._outbox.popleft()
+                    self._inflight[key] = (now, frame, None, records)
+                self._sock.sendall(frame)
+                self.batches_sent += 1
+                self.bytes_sent += len(frame)
+                if self.max_rate:
+                    self._send_at = max(now, self._send_at) + len(frame) / self.max_rate
+            self._read_acks()
+            if self._inflight and time.monotonic() - next(iter(self._inflight.values()))[0] > self.ack_timeout:
+                raise TimeoutError("no acknowledgement")
+        except OSError as e:
+            self._disconnect(e)
+
+    def _read_acks(self):
+        while select.select([self._sock], [], [], 0)[0]:
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionResetError("hub closed the connection")
+            self._acks += data
+            count = len(self._acks) // _ACK.size
+            for i in range(count):
+                key = _ACK.unpack_from(self._acks, i * _ACK.size)
+                item = self._inflight.pop(key, None)
+                if item is not None:
+                    _, _, entry, records = item
+                    if entry is not None:
+                        self._remove(entry[1], entry[2])
+                    self.batches_acked += 1
+                    self.records_acked += records
+            self._acks = self._acks[count * _ACK.size:]
+
+    def flush(self, timeout=None):
+        """
+        Sends the pending records and waits until the hub acknowledged everything queued so far.
+
+        Returns:
+            bool: False when the backlog was not empty within timeout seconds.
+        """
+        marker = threading.Event()
+        self._queue.put(marker)
+        marker.wait(timeout)
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.backlog:
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def metrics(self):
+        return {
+            'node': self.node,
+            'connected': self._sock is not None,
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'batches_sent': self.batches_sent,
+            'batches_acked': self.batches_acked,
+            'records_acked': self.records_acked,
+            'bytes_sent': self.bytes_sent,
+            'bytes_per_record': self.bytes_sent / self.records_acked if self.records_acked else 0.0,
+            'in_flight': len(self._inflight),
+            'spooled_batches': len(self._spool),
+            'spool_bytes': self._spool_bytes,
+            'spool_dropped': self.spool_dropped,
+            'connects': self.connects,
+        }
+
+    def close(self, timeout=5.0):
+        """Sends what it can within timeout seconds and spools the rest for the next start."""
+        self._stop_at = time.monotonic() + timeout
+        self._queue.put(None)
+        self._thread.join()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        hub = self.server.hub
+        sock = self.request
+        sock.settimeout(hub.idle_timeout)
+        with hub._lock:
+            hub._connections.add(sock)
+        try:
+            self._receive(hub, sock)
+        finally:
+            with hub._lock:
+                hub._connections.discard(sock)
+
+    def _receive(self, hub, sock):
+        while True:
+            header = _recv_exact(sock, _FRAME.size)
+            if header is None:
+                return
+            meta_size, crops_size = _FRAME.unpack(header)
+            if meta_size + crops_size > MAX_FRAME:
+                _LOGGER.warning("hub: %d byte frame from %s", meta_size + crops_size, self.client_address)
+                return
+            meta = _recv_exact(sock, meta_size)
+            crops = _recv_exact(sock, crops_size) if crops_size else b''
+            if meta is None or crops is None:
+                return
+            try:
+                batch = decode_batch(meta, crops)
+            except (ValueError, IndexError, struct.error, zlib.error) as e:
+                _LOGGER.warning("hub: bad batch from %s: %s", self.client_address, e)
+                return
+            # Closing without an acknowledgement makes the node send the batch again later
+            if not hub.receive(batch, _FRAME.size + meta_size + crops_size):
+                return
+            sock.sendall(_ACK.pack(batch.session, batch.seq))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    # Nodes reconnect together after an outage, the default backlog of 5 resets most of them
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        _LOGGER.debug("hub: connection from %s failed", client_address, exc_info=True)
+
+
+class UplinkHub:
+    def __init__(self, host='0.0.0.0', port=DEFAULT_PORT, store=None, crop_dir=None, idle_timeout=300.0,
+                 dedup_window=4096, write_timeout=30.0):
+        """
+        Receives batches from Uplink nodes, a thread per connected node.
+
+        Args:
+            host: Address to listen on
+            port: Port to listen on, 0 picks a free one, see address
+            store: DetectionStore the records go to with camera node/camera, None only counts them
+            crop_dir: Directory the crops are written to as node/session-seq-index.jpg, their path is the crop of
+                the stored record; None discards crops
+            idle_timeout: Seconds a silent connection is kept
+            dedup_window: Batches per node session remembered to recognize ones sent twice
+            write_timeout: Seconds a batch may wait for the database before it is not acknowledged, the node sends it
+                again; a copy that arrives while the batch is still being written waits for that write
+        """
+        self.store = store
+        self.crop_dir = crop_dir
+        self.idle_timeout = idle_timeout
+        self.dedup_window = dedup_window
+        self.write_timeout = write_timeout
+        self._bind = (host, port)
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._seen = {}
+        # (node, session, seq) of the batches being written, to an event set when the write is done
+        self._writing = {}
+        self._connections = set()
+        self.nodes = {}
+        self.batches = 0
+        self.records = 0
+        self.crops = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.started = time.monotonic()
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._server = _Server(self._bind, _Handler)
+        self._server.hub = self
+        # A restart listens on the same port
+        self._bind = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name='uplink-hub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops listening and closes the node connections, the nodes spool until the hub is back."""
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            connections = list(self._connections)
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread.join()
+
+    def receive(self, batch, size):
+        """
+        Stores one batch, called by the connection threads.
+
+        Returns:
+            bool: False when the records were not written, the batch is not acknowledged.
+        """
+        key = (batch.node, batch.session)
+        reservation = (batch.node, batch.session, batch.seq)
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None:
+                seen = self._seen[key] = (set(), deque())
+            if batch.seq in seen[0]:
+                self.duplicates += 1
+                return True
+            writing = self._writing.get(reservation)
+            if writing is None:
+                self._writing[reservation] = threading.Event()
+        if writing is not None:
+            # Sent again while the first copy is written, e.g. after a reconnect, answered like that copy
+            writing.wait(self.write_timeout)
+            with self._lock:
+                if batch.seq not in seen[0]:
+                    return False
+                self.duplicates += 1
+                return True
+        try:
+            return self._write(batch, size, seen)
+        finally:
+            with self._lock:
+                self._writing.pop(reservation).set()
+
+    def _write(self, batch, size, seen):
+        records = batch.records
+        if self.crop_dir is not None and any(record.crop for record in records):
+            directory = os.path.join(self.crop_dir, re.sub(r'[^\w.-]', '_', batch.node))
+            os.makedirs(directory, exist_ok=True)
+            for i, record in enumerate(records):
+                if record.crop:
+                    path = os.path.join(directory, f"{batch.session:08x}-{batch.seq}-{i}.jpg")
+                    with open(path, 'wb') as f:
+                        f.write(record.crop)
+                    records[i] = record._replace(crop=path)
+        else:
+            records = [record._replace(crop=None) for record in records]
+        if self.store is not None:
+            # One entry is one transaction, a batch is written completely or not at all, and it is only
+            # acknowledged once it is on disk so the node can delete its copy
+            if not self.store.add_records([record._replace(camera=f"{batch.node}/{record.camera}")
+                                           for record in records]):
+                return False
+            if not self.store.flush(self.write_timeout):
+                return False
+        with self._lock:
+            seen[0].add(batch.seq)
+            seen[1].append(batch.seq)
+            if len(seen[1]) > self.dedup_window:
+                seen[0].discard(seen[1].popleft())
+            node = self.nodes.setdefault(batch.node, {'batches': 0, 'records': 0, 'bytes': 0, 'last_seen': 0.0})
+            node['batches'] += 1
+            node['records'] += len(records)
+            node['bytes'] += size
+            node['last_seen'] = time.time()
+            self.batches += 1
+            self.records += len(records)
+            self.crops += sum(1 for record in records if record.crop)
+            self.bytes += size
+        return True
+
+    def metrics(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'nodes': len(self.nodes),
+                'batches': self.batches,
+                'records': self.records,
+                'crops': self.crops,
+                'duplicates': self.duplicates,
+                'bytes': self.bytes,
+                'records_per_s': self.records / elapsed,
+                'bytes_per_record': self.bytes / self.records if self.records else 0.0,
+            }
+
+
+def _benchmark(nodes, seconds, rate, crop_every, outage, max_rate):
+    """Runs a hub and nodes sending synthetic detections in this process, returns hub and node metrics."""
+    import json
+    import tempfile
+
+    from detection_store import DetectionStore
+
+    frame = cv2.imread('moose-1.jpg')
+    if frame is None:
+        frame = np.tile(np.linspace(0, 255, 640, dtype=np.uint8)[None, :, None], (480, 1, 3))
+    height, width = frame.shape[:2]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = DetectionStore(os.path.join(directory, 'hub.db'))
+        hub = UplinkHub('127.0.0.1', 0, store, os.path.join(directory, 'crops')).start()
+        host, port = hub.address
+        uplinks = [Uplink(host, port, f'node{i:02d}', os.path.join(directory, 'spool', str(i)), max_rate=max_rate)
+                   for i in range(nodes)]
+        generated = [0] * nodes
+        json_bytes = [0] * nodes
+        stop = time.monotonic() + seconds
+
+        def node_loop(i):
+            rng = random.Random(i)
+            x, y = rng.uniform(0, width - 200), rng.uniform(0, height - 200)
+            next_frame = time.monotonic() + rng.uniform(0, 1 / rate)
+            while next_frame < stop:
+                time.sleep(max(next_frame - time.monotonic(), 0))
+                # An animal walking through the picture
+                x = min(max(x + rng.uniform(-8, 8), 0), width - 200)
+                y = min(max(y + rng.uniform(-4, 4), 0), height - 200)
+                box = (x, y, x + rng.uniform(120, 200), y + rng.uniform(120, 200))
+                score = rng.uniform(0.5, 1.0)
+                with_crop = crop_every and generated[i] % crop_every == 0
+                uplinks[i].add(time.time(), 'cam0', [19], [score], [box], frame if with_crop else None)
+                generated[i] += 1
+                json_bytes[i] += len(json.dumps({'node': uplinks[i].node, 'camera': 'cam0', 'timestamp': time.time(),
+                                                 'class_id': 19, 'score': score, 'box': box})) + 1
+                next_frame += 1 / rate
+
+        threads = [threading.Thread(target=node_loop, args=(i,)) for i in range(nodes)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        if outage:
+            # The hub goes away for a while, the nodes spool and catch up
+            time.sleep(seconds / 3)
+            hub.stop()
+            time.sleep(outage)
+            hub.start()
+        for thread in threads:
+            thread.join()
+        delivered = all(uplink.flush(timeout=60) for uplink in uplinks)
+        elapsed = time.monotonic() - start
+        for uplink in uplinks:
+            uplink.close()
+        hub.stop()
+        store.flush()
+        stored = store.count()
+        store.close()
+        node_metrics = [uplink.metrics() for uplink in uplinks]
+        metrics = hub.metrics()
+        metrics.update({
+            'generated': sum(generated),
+            'stored': stored,
+            'delivered': delivered,
+            'records_per_s': metrics['records'] / elapsed,
+            'json_bytes_per_record': sum(json_bytes) / max(sum(generated), 1),
+            'spooled_batches': sum(m['spooled_batches'] for m in node_metrics),
+            'batches_spooled_during_run': sum(uplink.spooled for uplink in uplinks),
+            'dropped': sum(m['dropped'] + m['spool_dropped'] for m in node_metrics),
+            'connects': sum(m['connects'] for m in node_metrics),
+        })
+        return metrics
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    hub_parser = commands.add_parser("hub", help="Receive detections from nodes")
+    hub_parser.add_argument("--host", default="0.0.0.0")
+    hub_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    hub_parser.add_argument("--db", default="hub.db", help="DetectionStore database")
+    hub_parser.add_argument("--crops", default=None, help="Directory for the crops, discarded when not given")
+    bench_parser = commands.add_parser("bench", help="Hub and simulated nodes in this process")
+    bench_parser.add_argument("--nodes", type=int, default=50)
+    bench_parser.add_argument("--seconds", type=float, default=20)
+    bench_parser.add_argument("--rate", type=float, default=2, help="Detections per second per node")
+    bench_parser.add_argument("--crop-every", type=int, default=5, help="Send a crop with every n-th detection, "
+                                                                      "0 for none")
+    bench_parser.add_argument("--outage", type=float, default=0, help="Seconds the hub is down during the run")
+    bench_parser.add_argument("--max-rate", type=float, default=None, help="Uplink bytes per second per node")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.command == "hub" else logging.WARNING)
+
+    if args.command == "hub":
+        from detection_store import DetectionStore
+
+        hub = UplinkHub(args.host, args.port, DetectionStore(args.db), args.crops).start()
+        print(f"Listening on {hub.address[0]}:{hub.address[1]}")
+        try:
+            while True:
+                time.sleep(60)
+                print(hub.metrics())
+        except KeyboardInterrupt:
+            hub.stop()
+            hub.store.close()
+    else:
+        result = _benchmark(args.nodes, args.seconds, args.rate, args.crop_every, args.outage, args.max_rate)
+        print(f"{args.nodes} nodes, {args.rate:g} detections/s each, a crop every {args.crop_every}, "
+              f"{args.outage:g} s outage")
+        print(f"stored {result['stored']} of {result['generated']} detections, {result['duplicates']} duplicate "
+              f"batches, {result['dropped']} dropped, {result['batches_spooled_during_run']} batches spooled, "
+              f"{result['connects']} connections")
+        print(f"hub {result['records_per_s']:.0f} records/s, {result['bytes_per_record']:.1f} bytes/record on the wire "
+              f"({result['json_bytes_per_record']:.1f} as JSON lines without crops)")
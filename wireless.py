@@ -1,5 +1,11 @@
 from rpi_rf import RFDevice
+from rpi_rf.rpi_rf import PROTOCOLS
+import heapq
 import threading
+import time
+
+# Receivers (uno_sketch) drop the relay when no ON code arrives within this window
+RELAY_TIMEOUT = 5.0
 
 
 class SignalControl:
@@ -63,6 +69,225 @@ class SignalControl:
         self._thread.join()
 
 
+def frame_airtime(code: int, tx_proto: int=1, tx_pulselength: int|None=None, tx_length: int|None=None,
+                  tx_repeat: int=10) -> float:
+    """
+    Returns the time in seconds that RFDevice.tx_code needs to send one code.
+
+    Args:
+        code: Decimal code to send
+        tx_proto: Protocol number from PROTOCOLS
+        tx_pulselength: Pulse length in microseconds, protocol default when None
+        tx_length: Code length in bits, chosen like RFDevice.tx_code when None
+        tx_repeat: Number of times the code is repeated per frame
+    """
+    protocol = PROTOCOLS[tx_proto]
+    pulselength = tx_pulselength or protocol.pulselength
+    if not tx_length:
+        tx_length = 32 if tx_proto == 6 or code > 16777216 else 24
+    ones = bin(code & ((1 << tx_length) - 1)).count('1')
+    zeros = tx_length - ones
+    if tx_proto == 6:
+        # Nexa sends every bit as a pair of symbols plus a leading sync
+        ones, zeros = tx_length, tx_length
+        syncs = 2
+    else:
+        syncs = 1
+    pulses = (ones * (protocol.one_high + protocol.one_low) +
+              zeros * (protocol.zero_high + protocol.zero_low) +
+              syncs * (protocol.sync_high + protocol.sync_low))
+    return tx_repeat * pulses * pulselength / 1000000
+
+
+class Channel:
+    def __init__(self, name, on_code: int, off_code: int, keepalive: int|float=1, tx_proto: int=1,
+                 tx_length: int|None=None, tx_repeat: int=10, tx_pulselength: int|None=None):
+        """
+        One logical receiver controlled by MultiChannelControl.
+
+        Args:
+            name: Channel name used to address it
+            on_code: ON signal code
+            off_code: OFF signal code
+            keepalive: Time interval between ON signals while the channel is ON
+            tx_proto: Protocol used for this channel
+            tx_length: Code length in bits, chosen by RFDevice.tx_code when None
+            tx_repeat: Number of repeats per frame, fewer repeats means more channels fit in the air
+            tx_pulselength: Pulse length in microseconds, the protocol default when None
+        """
+        if not 0 < keepalive < RELAY_TIMEOUT:
+            raise ValueError(f"Keep-alive of channel {name!r} must be between 0 and {RELAY_TIMEOUT} s")
+        self.name = name
+        self.on_code = int(on_code)
+        self.off_code = int(off_code)
+        self.keepalive = keepalive
+        self.tx_proto = tx_proto
+        self.tx_length = tx_length
+        self.tx_repeat = tx_repeat
+        # Always passed to tx_code, which would otherwise keep the pulse length of the previous channel
+        self.tx_pulselength = tx_pulselength or PROTOCOLS[tx_proto].pulselength
+
+        self.state = False
+        self.frames_sent = 0
+        self.last_on_time = None
+        self.max_on_gap = 0.0
+        # Bumped on every state change so stale schedule entries can be dropped
+        self._generation = 0
+
+    def airtime(self, state: bool) -> float:
+        """Returns the airtime in seconds of one ON or OFF frame of this channel."""
+        return frame_airtime(self.on_code if state else self.off_code, self.tx_proto, self.tx_pulselength,
+                             self.tx_length, self.tx_repeat)
+
+
+class MultiChannelControl:
+    def __init__(self, rf_device: RFDevice, channels=()):
+        """
+        Controls many receivers over one RFDevice with a single scheduler thread.
+
+        Frames are sent earliest deadline first, so ON channels get their keep-alive interleaved with
+        state changes of other channels instead of one channel holding the transmitter.
+
+        Args:
+            rf_device: An instance of the RFDevice with enabled tx
+            channels: Initial Channel instances
+        """
+        self.rf_device = rf_device
+        self._channels = {}
+        # Heap of (due time, sequence, channel name, generation)
+        self._queue = []
+        self._seq = 0
+
+        self._stopped = False
+        self._cond = threading.Condition()
+        for channel in channels:
+            self.add_channel(channel)
+
+        self._start_time = time.monotonic()
+        self._frames_sent = 0
+        self._busy_time = 0.0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._scheduler_thread, daemon=True)
+        self._thread.start()
+
+    def add_channel(self, channel: Channel):
+        with self._cond:
+            if channel.name in self._channels:
+                raise ValueError(f"Channel {channel.name!r} already exists")
+            self._channels[channel.name] = channel
+            utilization = self.utilization()
+            if utilization > 1:
+                self._channels.pop(channel.name)
+                raise ValueError(f"Channel {channel.name!r} does not fit, keep-alive airtime would be "
+                                 f"{utilization * 100:.0f}% of the transmitter")
+            # Start in the OFF state and tell the receiver so
+            self._schedule(channel, time.monotonic())
+
+    def remove_channel(self, name):
+        with self._cond:
+            channel = self._channels.pop(name)
+            channel._generation += 1
+
+    def utilization(self) -> float:
+        """Returns the fraction of transmitter time needed if every channel is ON."""
+        return sum(channel.airtime(True) / channel.keepalive for channel in self._channels.values())
+
+    def set_state(self, name, state):
+        state = bool(state)
+        with self._cond:
+            channel = self._channels[name]
+            # Only act when there is a change
+            if channel.state != state:
+                channel.state = state
+                channel._generation += 1
+                self._schedule(channel, time.monotonic())
+
+    def get_state(self, name) -> bool:
+        return self._channels[name].state
+
+    def _schedule(self, channel, due):
+        self._seq += 1
+        heapq.heappush(self._queue, (due, self._seq, channel.name, channel._generation))
+        self._cond.notify_all()
+
+    def _next_frame(self):
+        """Waits for the earliest due frame, returns None when stopped."""
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, _, name, generation = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._queue)
+                channel = self._channels.get(name)
+                if channel is None or channel._generation != generation:
+                    continue
+                return channel, channel.state, due, generation
+        return None
+
+    def _scheduler_thread(self):
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return
+            channel, state, due, generation = frame
+
+            start = time.monotonic()
+            self.rf_device.tx_repeat = channel.tx_repeat
+            self.rf_device.tx_code(channel.on_code if state else channel.off_code,
+                                   channel.tx_proto, channel.tx_pulselength, channel.tx_length)
+            end = time.monotonic()
+
+            with self._cond:
+                latency = start - due
+                self._frames_sent += 1
+                self._busy_time += end - start
+                self._latency_sum += latency
+                self._latency_max = max(self._latency_max, latency)
+                channel.frames_sent += 1
+                if state:
+                    if channel.last_on_time is not None:
+                        channel.max_on_gap = max(channel.max_on_gap, start - channel.last_on_time)
+                    channel.last_on_time = start
+                else:
+                    channel.last_on_time = None
+                # Keep-alive is measured from the start of the frame so the interval does not drift
+                if state and channel._generation == generation:
+                    self._schedule(channel, start + channel.keepalive)
+
+    def stats(self) -> dict:
+        """
+        Returns throughput and latency accounting since the controller was started.
+
+        Latency is how late a frame started compared to when it was due, max_on_gap is the longest
+        time a receiver went without an ON frame and must stay below RELAY_TIMEOUT.
+        """
+        with self._cond:
+            elapsed = time.monotonic() - self._start_time
+            frames = self._frames_sent
+            return {
+                'frames': frames,
+                'frames_per_s': frames / elapsed if elapsed > 0 else 0.0,
+                'busy_fraction': self._busy_time / elapsed if elapsed > 0 else 0.0,
+                'latency_mean_ms': self._latency_sum / frames * 1000 if frames else 0.0,
+                'latency_max_ms': self._latency_max * 1000,
+                'max_on_gap_s': max((c.max_on_gap for c in self._channels.values()), default=0.0),
+                'channels': {name: c.frames_sent for name, c in self._channels.items()},
+            }
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
 if __name__ == "__main__":
     # <<<Testing with manual control>>>
     PIN = 17  # GPIO pin
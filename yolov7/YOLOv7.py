@@ -1,33 +1,63 @@
 import time
 import cv2
 import numpy as np
-import onnxruntime
 
-from yolov7.utils import xywh2xyxy, nms, draw_detections
+from model_meta import load_meta
+from profiling import ort_report, profile_options
+from startup import create_session, timer, warm_up
+from yolov7.utils import xywh2xyxy, nms, DetectionRenderer
 
 
 class YOLOv7:
-    def __init__(self, path, conf_thres=0.7, iou_thres=0.5, official_nms=False):
+    def __init__(self, path, conf_thres=0.7, iou_thres=0.5, official_nms=False, warmup=1, cache_dir='auto',
+                 classes=None, profile=False, low_memory=False, manager=None, priority=1.0):
         self.conf_threshold = conf_thres
         self.iou_threshold = iou_thres
-        self.official_nms = official_nms
+        # Class names and input shape from the model metadata, then the classes YAML, then COCO
+        self.meta = load_meta(path, classes)
+        # Models fused by onnx_tools.fuse_nms have the official end-to-end output
+        self.official_nms = official_nms or self.meta.postprocess == 'nms'
+        self.class_names = self.meta.names
+        self.renderer = DetectionRenderer(self.class_names, self.meta.colors)
+        # Optimized graphs are cached next to the model, see startup.create_session
+        self.cache_dir = cache_dir
+        # Per-operator timings of every inference, see profile_report()
+        self.profile = profile
+        self.path = path
+        self.warmup_runs = warmup
+        # Session without arenas and drawing on the frame itself, see startup.low_memory_options
+        self.low_memory = low_memory
+        # Several detectors in one process share the CPU through a sessions.SessionManager
+        self.manager = manager
+        self.priority = priority
 
         # Initialize model
         self.initialize_model(path)
+        timer.mark_once("model loaded")
+
+        # Run the first, slow inferences before the first frame arrives
+        self.warm_up(warmup)
+        timer.mark_once("warm-up")
+        self.first_detection = None
 
     def __call__(self, image):
         return self.detect_objects(image)
 
     def initialize_model(self, path):
-        self.session = onnxruntime.InferenceSession(path,
-                                                    providers=['CUDAExecutionProvider',
-                                                               'CPUExecutionProvider'])
+        options = profile_options() if self.profile else None
+        if self.manager is not None:
+            self.session = self.manager.create(path, self.priority, cache_dir=self.cache_dir, options=options,
+                                               low_memory=self.low_memory)
+        else:
+            self.session = create_session(path, cache_dir=self.cache_dir, options=options, low_memory=self.low_memory)
         # Get model info
         self.get_input_details()
         self.get_output_details()
 
         self.has_postprocess = 'score' in self.output_names or self.official_nms
 
+    def warm_up(self, runs):
+        warm_up(self.session, runs)
 
     def detect_objects(self, image):
         input_tensor = self.prepare_input(image)
@@ -42,22 +72,22 @@ class YOLOv7:
             # Process output data
             self.boxes, self.scores, self.class_ids = self.process_output(outputs)
 
+        if self.first_detection is None:
+            # Seconds from process start to the first usable detection, False for detectors loaded later (model swaps)
+            self.first_detection = timer.mark_once("first detection") or False
+
         return self.boxes, self.scores, self.class_ids
 
     def prepare_input(self, image):
         self.img_height, self.img_width = image.shape[:2]
 
-        input_img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # Resize input image
-        input_img = cv2.resize(input_img, (self.input_width, self.input_height))
+        if self.raw_input:
+            # The model converts uint8 BGR frames itself, see onnx_tools.add_preprocessing
+            return cv2.resize(image, (self.input_width, self.input_height))[np.newaxis]
 
-        # Scale input pixel values to 0 to 1
-        input_img = input_img / 255.0
-        input_img = input_img.transpose(2, 0, 1)
-        input_tensor = input_img[np.newaxis, :, :, :].astype(np.float32)
-
-        return input_tensor
+        # Resize, swap to RGB, scale to 0-1 and transpose to NCHW float32 in one pass, without the float64
+        # intermediate of dividing the uint8 image
+        return cv2.dnn.blobFromImage(image, 1 / 255, (self.input_width, self.input_height), swapRB=True)
 
 
     def inference(self, input_tensor):
@@ -151,18 +181,29 @@ class YOLOv7:
         boxes *= np.array([self.img_width, self.img_height, self.img_width, self.img_height])
         return boxes
 
-    def draw_detections(self, image, draw_scores=True, mask_alpha=0.4):
+    def profile_report(self):
+        """Ends profiling of a detector created with profile=True and returns the profiling.ProfileReport."""
+        return ort_report(self.session, self.path, skip_runs=self.warmup_runs)
 
-        return draw_detections(image, self.boxes, self.scores,
-                               self.class_ids, mask_alpha)
+    def draw_detections(self, image, draw_scores=True, mask_alpha=0.4):
+        # In low memory mode the frame itself is annotated instead of a copy, unless it is read-only like the
+        # memory-mapped frames of frame_source.ReplaySource
+        in_place = self.low_memory and image.flags.writeable
+        return self.renderer.draw(image, self.boxes, self.scores, self.class_ids, out=image if in_place else None,
+                                  mask_alpha=mask_alpha)
 
     def get_input_details(self):
         model_inputs = self.session.get_inputs()
         self.input_names = [model_inputs[i].name for i in range(len(model_inputs))]
 
         self.input_shape = model_inputs[0].shape
-        self.input_height = self.input_shape[2]
-        self.input_width = self.input_shape[3]
+        # Models with preprocessing in the graph take (1, H, W, 3) uint8 BGR frames
+        self.raw_input = model_inputs[0].type == 'tensor(uint8)'
+        if self.raw_input:
+            self.input_height, self.input_width = self.input_shape[1:3]
+        else:
+            self.input_height = self.input_shape[2]
+            self.input_width = self.input_shape[3]
 
     def get_output_details(self):
         model_outputs = self.session.get_outputs()
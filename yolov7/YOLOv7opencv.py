@@ -4,22 +4,35 @@ import cv2
 import time
 import numpy as np
 
+from profiling import DnnProfiler
+from startup import warm_up_dnn
+
 class YOLOv7(YOLOv7Orignal):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def initialize_model(self, path):
         self.net = cv2.dnn.readNetFromONNX(path)
+        self.profiler = DnnProfiler(self.net, path) if self.profile else None
         # Get model info
         self.get_input_details()
         self.get_output_details()
 
         self.has_postprocess = 'score' in self.output_names or self.official_nms
 
+    def warm_up(self, runs):
+        if self.raw_input:
+            warm_up_dnn(self.net, (1, self.input_height, self.input_width, 3), runs, np.uint8)
+        else:
+            warm_up_dnn(self.net, (1, 3, self.input_height, self.input_width), runs)
+
+    def profile_report(self):
+        return self.profiler.report()
+
     def get_input_details(self):
-        # Set input height and width based on the model's expected input size
-        self.input_height = 480  # Replace with your model's expected input height
-        self.input_width = 640   # Replace with your model's expected input width
+        # Input height and width from the model, 480x640 when its input shape is dynamic
+        self.input_height, self.input_width = self.meta.input_shape or (480, 640)
+        self.raw_input = self.meta.preprocess == 'bgr_uint8_nhwc'
 
         # Get the names of all layers (not typically needed for input details)
         self.input_names = self.net.getLayerNames()
@@ -34,7 +47,7 @@ class YOLOv7(YOLOv7Orignal):
         # Ensure the input tensor is in the correct format
         # OpenCV expects the input to be a blob with shape [batch_size, channels, height, width]
         # and type np.float32
-        if input_tensor.dtype != np.float32:
+        if input_tensor.dtype != np.float32 and not self.raw_input:
             input_tensor = input_tensor.astype(np.float32)
 
         # Set the input to the network
@@ -43,6 +56,8 @@ class YOLOv7(YOLOv7Orignal):
         # Perform forward pass to get outputs
         # If there are multiple outputs, outputs will be a dict with layer names as keys
         outputs = self.net.forward(self.output_names)
+        if self.profiler is not None:
+            self.profiler.add()
 
         print(f"Inference time: {(time.perf_counter() - start)*1000:.2f} ms")
         return outputs
\ No newline at end of file
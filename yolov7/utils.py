@@ -1,20 +1,11 @@
 import numpy as np
 import cv2
 
-class_names = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
-               'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
-               'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
-               'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard',
-               'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
-               'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch',
-               'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard',
-               'cell phone', 'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase',
-               'scissors', 'teddy bear', 'hair drier', 'toothbrush']
-class_names.append('8367')
-
-# Create a list of colors for each class where each color is a tuple of 3 integer values
-rng = np.random.default_rng(3)
-colors = rng.uniform(0, 255, size=(len(class_names), 3))
+from model_meta import COCO_NAMES, class_colors
+
+# Default labels and colors for COCO models, detectors of other models take theirs from model_meta.load_meta
+class_names = list(COCO_NAMES)
+colors = class_colors(len(class_names))
 
 
 def nms(boxes, scores, iou_threshold):
@@ -70,46 +61,133 @@ def xywh2xyxy(x):
     return y
 
 
-def draw_detections(image, boxes, scores, class_ids, mask_alpha=0.3):
-    mask_img = image.copy()
-    det_img = image.copy()
-
-    img_height, img_width = image.shape[:2]
-    size = min([img_height, img_width]) * 0.0006
-    text_thickness = int(min([img_height, img_width]) * 0.001)
-
-    # Draw bounding boxes and labels of detections
-    for box, score, class_id in zip(boxes, scores, class_ids):
-        if type(class_id) != int:
-            class_id = 0
-
-        color = colors[class_id]
-
-        x1, y1, x2, y2 = box.astype(int)
+class DetectionRenderer:
+    def __init__(self, class_names=class_names, colors=colors, mask_alpha=0.3, font_scale=None, enabled=True,
+                 reuse_output=False, cache_size=512):
+        """
+        Draws detections by blending only inside the boxes and pasting cached label sprites.
+
+        Args:
+            class_names: Label of every class id
+            colors: Color of every class id
+            mask_alpha: Opacity of the box fill, 0 draws outlines only
+            font_scale: Fixed label font scale, scaled with the image size when None
+            enabled: When False draw() returns the image untouched, for headless runs
+            reuse_output: Draw into one internal buffer instead of a new copy per call
+            cache_size: Maximum number of cached label sprites
+        """
+        self.class_names = class_names
+        # Integer colors once, casting float colors on every fill is slower than the fill itself
+        self.colors = [tuple(int(c) for c in color) for color in colors]
+        self.mask_alpha = mask_alpha
+        self.font_scale = font_scale
+        self.enabled = enabled
+        self.reuse_output = reuse_output
+        self.cache_size = cache_size
+        self._sprites = {}
+        self._out = None
+
+    def _label_sprite(self, class_id, score, size, text_thickness, gray=False):
+        score_pct = int(score * 100)
+        key = (class_id, score_pct, size, text_thickness, gray)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            if len(self._sprites) >= self.cache_size:
+                self._sprites.clear()
+            label = self.class_names[class_id] if class_id < len(self.class_names) else str(class_id)
+            caption = f'{label} {score_pct}%'
+            (tw, th), _ = cv2.getTextSize(text=caption, fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+                                          fontScale=size, thickness=text_thickness)
+            th = int(th * 1.2)
+            sprite = np.empty((th, tw, 3), np.uint8)
+            cv2.rectangle(sprite, (0, 0), (tw, th), self._color(class_id), -1)
+            cv2.putText(sprite, caption, (0, th), cv2.FONT_HERSHEY_SIMPLEX, size, (255, 255, 255),
+                        text_thickness, cv2.LINE_AA)
+            if gray:
+                sprite = cv2.cvtColor(sprite, cv2.COLOR_BGR2GRAY)
+            self._sprites[key] = sprite
+        return sprite
+
+    def _color(self, class_id, gray=False):
+        color = self.colors[class_id % len(self.colors)]
+        if gray:
+            blue, green, red = color[:3]
+            return (round(0.114 * blue + 0.587 * green + 0.299 * red),)
+        return color
+
+    def draw(self, image, boxes, scores, class_ids, out=None, mask_alpha=None):
+        """
+        Draws xyxy boxes with labels.
+
+        Args:
+            image: BGR or 8 bit single channel (e.g. thermal) image to annotate, single channel images get gray
+                boxes and labels
+            boxes: Boxes as (x1, y1, x2, y2)
+            scores: Detection scores
+            class_ids: Detection class ids
+            out: Output image, pass image itself to draw in place
+            mask_alpha: Opacity of the box fill for this call, the renderer's mask_alpha when None
+
+        Returns:
+            numpy.ndarray: The annotated image.
+        """
+        if not self.enabled:
+            return image
+        if out is None:
+            if self.reuse_output:
+                if self._out is None or self._out.shape != image.shape:
+                    self._out = np.empty_like(image)
+                out = self._out
+            else:
+                out = np.empty_like(image)
+        if out is not image:
+            np.copyto(out, image)
+
+        img_height, img_width = image.shape[:2]
+        if self.font_scale is None:
+            size = min([img_height, img_width]) * 0.0006
+            text_thickness = max(int(min([img_height, img_width]) * 0.001), 1)
+        else:
+            size = self.font_scale
+            text_thickness = 1
+        alpha = self.mask_alpha if mask_alpha is None else mask_alpha
+        gray = image.ndim == 2 or image.shape[2] == 1
+
+        for box, score, class_id in zip(boxes, scores, class_ids):
+            class_id = int(class_id)
+            color = self._color(class_id, gray)
+            x1, y1, x2, y2 = (int(v) for v in box)
+            cx1, cy1 = max(x1, 0), max(y1, 0)
+            cx2, cy2 = min(x2, img_width), min(y2, img_height)
+
+            # Tint only the box area instead of blending whole frames
+            if alpha > 0 and cx2 > cx1 and cy2 > cy1:
+                roi = out[cy1:cy2, cx1:cx2]
+                fill = np.empty_like(roi)
+                cv2.rectangle(fill, (0, 0), (cx2 - cx1, cy2 - cy1), color, -1)
+                cv2.addWeighted(fill, alpha, roi, 1 - alpha, 0, dst=roi)
+
+            cv2.rectangle(out, (x1, y1), (x2, y2), color, 2)
+
+            # Paste the label above the box, clipped to the image
+            sprite = self._label_sprite(class_id, score, size, text_thickness, gray)
+            if image.ndim == 3 and gray:
+                sprite = sprite[..., np.newaxis]
+            sh, sw = sprite.shape[:2]
+            top, left = y1 - sh, x1
+            sy, sx = max(-top, 0), max(-left, 0)
+            ey, ex = min(sh, img_height - top), min(sw, img_width - left)
+            if ey > sy and ex > sx:
+                out[top + sy:top + ey, left + sx:left + ex] = sprite[sy:ey, sx:ex]
+
+        return out
+
+
+_default_renderer = DetectionRenderer()
 
-        # Draw rectangle
-        cv2.rectangle(det_img, (x1, y1), (x2, y2), color, 2)
 
-        # Draw fill rectangle in mask image
-        cv2.rectangle(mask_img, (x1, y1), (x2, y2), color, -1)
-
-        label = class_names[class_id]
-        caption = f'{label} {int(score * 100)}%'
-        (tw, th), _ = cv2.getTextSize(text=caption, fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-                                      fontScale=size, thickness=text_thickness)
-        th = int(th * 1.2)
-
-        cv2.rectangle(det_img, (x1, y1),
-                      (x1 + tw, y1 - th), color, -1)
-        cv2.rectangle(mask_img, (x1, y1),
-                      (x1 + tw, y1 - th), color, -1)
-        cv2.putText(det_img, caption, (x1, y1),
-                    cv2.FONT_HERSHEY_SIMPLEX, size, (255, 255, 255), text_thickness, cv2.LINE_AA)
-
-        cv2.putText(mask_img, caption, (x1, y1),
-                    cv2.FONT_HERSHEY_SIMPLEX, size, (255, 255, 255), text_thickness, cv2.LINE_AA)
-
-    return cv2.addWeighted(mask_img, mask_alpha, det_img, 1 - mask_alpha, 0)
+def draw_detections(image, boxes, scores, class_ids, mask_alpha=0.3):
+    return _default_renderer.draw(image, boxes, scores, class_ids, mask_alpha=mask_alpha)
 
 
 def draw_comparison(img1, img2, name1, name2, fontsize=2.6, text_thickness=3):